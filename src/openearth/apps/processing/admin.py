@@ -46,12 +46,18 @@ class ProcessingJobAdmin(reversion.VersionAdmin):
     search_fields = ('uuid', 'environment__name',
                      'environment__author__username')
     readonly_fields = ('status', 'start', 'created_date', 'environment',
-                       'script_link')
+                       'script_link', 'ready_seconds', 'resource_profile',
+                       'cpu_seconds', 'peak_cpu', 'peak_memory', 'batch',
+                       'parameters', 'force_rerun', 'input_fingerprint',
+                       'cached_from')
 
     fieldsets = (
         (None, {
             'fields': ('status', 'start', 'created_date', 'environment',
-                       'script_link')
+                       'script_link', 'ready_seconds', 'resource_profile',
+                       'cpu_seconds', 'peak_cpu', 'peak_memory', 'batch',
+                       'parameters', 'force_rerun', 'input_fingerprint',
+                       'cached_from')
         }),
         ('Terminal output', {
             'classes': ('collapse',),
@@ -90,6 +96,20 @@ class ProcessingJobInlineAdmin(admin.TabularInline):
     extra = 0
 
 
+class ProcessingBatchAdmin(admin.ModelAdmin):
+    def progress(self, obj):
+        progress = obj.progress()
+        return '{done}/{total} ({failed} failed)'.format(**progress)
+    progress.short_description = _('progress')
+
+    list_display = ('__unicode__', 'environment', 'concurrency',
+                    'created_date', 'finished_date', 'progress')
+    list_filter = ('environment',)
+    readonly_fields = ('environment', 'script', 'created_date',
+                       'finished_date', 'progress')
+    inlines = [ProcessingJobInlineAdmin]
+
+
 class ProcessingEnvironmentAdmin(reversion.VersionAdmin):
     exclude = ('author',)
     readonly_fields = ('created_date',)
@@ -115,6 +135,7 @@ class ProcessingEnvironmentAdmin(reversion.VersionAdmin):
         obj.save()
 
 admin.site.register(models.Extension, ExtensionAdmin)
+admin.site.register(models.ProcessingBatch, ProcessingBatchAdmin)
 admin.site.register(models.ProcessingEnvironment, ProcessingEnvironmentAdmin)
 admin.site.register(models.ProcessingJob, ProcessingJobAdmin)
 admin.site.register(models.ProcessingJobResult, ProcessingJobResultAdmin)
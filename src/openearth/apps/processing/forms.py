@@ -1,9 +1,11 @@
-from models import ProcessingEnvironment, ProcessingJob
+from models import ProcessingBatch, ProcessingEnvironment, ProcessingJob
 from widgets import BootstrapDatetimePickerWidget, TerminalWidget
 from django import forms
 from django.conf import settings
+import json
 from openearth.apps.processing.fields import InterpreterField
 from openearth.libs import svn
+from openearth.apps.script_execution_manager.gateway import make_token
 
 
 class ProcessingJobImageAdminForm(forms.ModelForm):
@@ -67,6 +69,8 @@ class JobAdminForm(forms.ModelForm):
                 self.fields[field].required = False
                 self.fields[field].widget.attrs['data-ws-url'] = '{SCHEMA}://{SERVER_NAME}:{SERVER_PORT}{WEBSOCKET_URL}{UUID}'.format(**self.request.META)
                 self.fields[field].widget.attrs['data-ws-type'] = 'subscribe-superuser'
+                self.fields[field].widget.attrs['data-ws-token'] = make_token(
+                    self.request.user, instance.uuid)
                 self.fields[field].widget.attrs['id'] = 'terminal'
 
     class Meta:
@@ -92,6 +96,7 @@ class JobForm(forms.ModelForm):
         self.fields['revision'].widget.group = 'advanced'
         self.fields['script_revision'].widget.group = 'advanced'
         self.fields['open_earth_revision'].widget.group = 'advanced'
+        self.fields['force_rerun'].widget.group = 'advanced'
 
         if instance:
             def get_field(f):
@@ -135,4 +140,63 @@ class JobForm(forms.ModelForm):
     class Meta:
         model = ProcessingJob
         fields = ['status', 'environment', 'start', 'auto_commit', 'script',
-                  'revision', 'script_revision', 'open_earth_revision', ]
+                  'revision', 'script_revision', 'open_earth_revision',
+                  'force_rerun', ]
+
+
+class BatchForm(forms.ModelForm):
+    """
+    Form of the batch submission endpoint.
+
+    Description:
+        runs is a JSON list with an object per job, with (all optional) the
+        parameters (object), revision, script_revision and
+        open_earth_revision of the job. The instance needs its environment.
+    """
+    RUN_KEYS = ('parameters', 'revision', 'script_revision',
+                'open_earth_revision')
+
+    runs = forms.CharField()
+
+    def clean_script(self):
+        script = self.cleaned_data['script']
+        if script not in self.instance.environment.get_script_choices():
+            raise forms.ValidationError('Unknown script %r' % script)
+        return script
+
+    def clean_concurrency(self):
+        concurrency = self.cleaned_data['concurrency']
+        maximum = settings.PROCESSING_BATCH['max_concurrency']
+        if not 1 <= concurrency <= maximum:
+            raise forms.ValidationError(
+                'Concurrency must be between 1 and %d' % maximum)
+        return concurrency
+
+    def clean_runs(self):
+        try:
+            runs = json.loads(self.cleaned_data['runs'])
+        except ValueError, e:
+            raise forms.ValidationError('Invalid JSON: %s' % e)
+        if not isinstance(runs, list) or not runs:
+            raise forms.ValidationError('Runs must be a non-empty list')
+        if len(runs) > settings.PROCESSING_BATCH['max_jobs']:
+            raise forms.ValidationError(
+                'At most %d runs' % settings.PROCESSING_BATCH['max_jobs'])
+        for run in runs:
+            if not isinstance(run, dict) or set(run) - set(self.RUN_KEYS):
+                raise forms.ValidationError(
+                    'A run is an object with the keys %s' %
+                    ', '.join(self.RUN_KEYS))
+            if not isinstance(run.get('parameters') or {}, dict):
+                raise forms.ValidationError('Parameters must be an object')
+            for key in self.RUN_KEYS[1:]:
+                if run.get(key) is not None and (
+                        not isinstance(run[key], int) or run[key] < 1):
+                    raise forms.ValidationError(
+                        '%s must be a revision number' % key)
+        return runs
+
+    class Meta:
+        model = ProcessingBatch
+        fields = ['script', 'start', 'auto_commit', 'concurrency',
+                  'reuse_containers', 'force_rerun']
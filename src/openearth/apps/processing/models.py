@@ -1,14 +1,22 @@
 from __future__ import unicode_literals
+from datetime import timedelta
+from itertools import islice
+import json
 import urlparse
+from uuid import uuid4
 from celery.result import AsyncResult
 from django.utils.translation import ugettext_lazy as _
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Sum
 from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from djorm_pgarray.fields import TextArrayField
 from django_extensions.db.fields import PostgreSQLUUIDField
 from filer.fields.file import FilerFileField
-from openearth.apps.script_execution_manager.tasks import commit
+from openearth.apps.script_execution_manager.tasks import advance_batch, \
+    commit, refresh_log_index
 from django.utils.functional import lazy
 from openearth.libs import svn
 from django.core import exceptions
@@ -25,18 +33,22 @@ def get_revisions(url, username, password, limit=100, revision=None,
         revision=revision)
 
     if format:
-        formatted = []
-        for revision in revisions:
-            formatted.append((
-                int(revision['@revision']),
-                '[%(@revision)s] %(msg)s @ %(date)s by %(author)s' % revision,
-            ))
-
-        return tuple(formatted)
+        return format_revisions(revisions)
     else:
         return revisions
 
 
+def format_revisions(revisions):
+    formatted = []
+    for revision in revisions:
+        formatted.append((
+            int(revision['@revision']),
+            '[%(@revision)s] %(msg)s @ %(date)s by %(author)s' % revision,
+        ))
+
+    return tuple(formatted)
+
+
 def get_open_earth_python_revisions(limit=100, revision=None, format=False):
     return get_revisions(
         url=settings.OPEN_EARTH_TOOLS_PYTHON_URL,
@@ -178,6 +190,13 @@ class ProcessingEnvironment(models.Model):
         return self.get_revisions(self.get_scripts_url(), limit,
                                   revision, format)
 
+    def get_log_index(self, url):
+        return SvnLogIndex.for_url(
+            url,
+            username=self.REPOS.SVN['username'],
+            password=self.REPOS.SVN['password']
+        )
+
     def get_script_choices(self, for_choices=False):
         output, err = svn.list_(
             url=self.get_scripts_url(),
@@ -249,6 +268,46 @@ class ProcessingJob(models.Model):
     open_earth_revision = models.PositiveIntegerField(
         help_text='Execute with specific open earth version',
         null=True, blank=True)
+    ready_seconds = models.FloatField(
+        help_text='Seconds from launching the container until its SSH server '
+                  'accepted connections',
+        null=True, blank=True, editable=False)
+    resource_profile = models.CharField(
+        help_text='Resource profile of the container, see '
+                  'settings.CONTAINER[\'resource_profiles\']',
+        max_length=50, blank=True, editable=False)
+    cpu_seconds = models.FloatField(
+        help_text='CPU time used by the container while running the job',
+        null=True, blank=True, editable=False)
+    peak_cpu = models.FloatField(
+        help_text='Most cores used at once, between two samples',
+        null=True, blank=True, editable=False)
+    peak_memory = models.BigIntegerField(
+        help_text='Most memory used by the container, in bytes',
+        null=True, blank=True, editable=False)
+    batch = models.ForeignKey('ProcessingBatch', verbose_name=_('batch'),
+                              related_name='jobs',
+                              on_delete=models.SET_NULL,
+                              null=True, blank=True, editable=False)
+    batch_index = models.PositiveIntegerField(
+        help_text='Position of the job in its batch',
+        null=True, blank=True, editable=False)
+    parameters = models.TextField(
+        help_text='JSON object, given to the script in the environment '
+                  'variable DATALAB_PARAMETERS',
+        blank=True)
+    force_rerun = models.BooleanField(
+        _('force rerun'), default=False,
+        help_text=_('Run the script, also when a finished job had the same '
+                    'inputs.'))
+    input_fingerprint = models.CharField(
+        help_text='Hash of the image, script, revisions and parameters, see '
+                  'script_execution_manager.result_cache',
+        max_length=40, blank=True, db_index=True, editable=False)
+    cached_from = models.ForeignKey('self', verbose_name=_('results of'),
+                                    related_name='cached_jobs',
+                                    on_delete=models.SET_NULL,
+                                    null=True, blank=True, editable=False)
 
     def get_script_revisions(self, limit=10, revision=None, format=True):
         return self.environment.get_revisions(self.get_script_url(False),
@@ -310,6 +369,9 @@ class ProcessingJob(models.Model):
             if new_status > self.status:
                 self.status = new_status
             self.save()
+            if self.batch_id and new_status >= self.STATUS.FINISHED:
+                # A place in the batch is free.
+                advance_batch.delay(self.batch_id)
         return self.status
 
     def get_current_status(self):
@@ -323,10 +385,30 @@ class ProcessingJob(models.Model):
 
     def start_job(self):
         """
-        Starts the processing job.
+        Schedules the processing job.
+
+        Description:
+            At self.start the job is queued by the scheduler, which sends it
+            to a worker when there is room for it (see
+            script_execution_manager.scheduler).
 
         Returns:
-            The result string of the task.
+            AsyncResult of the schedule_job task.
+        """
+        from openearth.apps.script_execution_manager.tasks import \
+            schedule_job
+
+        return schedule_job.apply_async(args=[self.uuid], eta=self.start)
+
+    def send_job(self, queue):
+        """
+        Sends the processing job to a worker.
+
+        Arguments:
+            queue: Celery queue of the job, see scheduler.get_queue.
+
+        Returns:
+            AsyncResult of the run_script task.
         """
         from openearth.apps.script_execution_manager.tasks import run_script
 
@@ -342,24 +424,38 @@ class ProcessingJob(models.Model):
             'script_revision': str(self.script_revision or ''),
             'open_earth_tools': self.environment.open_earth,
             'open_earth_revision': self.open_earth_revision,
+            'parameters': self.parameters,
         }
         # Run commit after run_script has run.
         result = run_script.apply_async(
             kwargs=kwargs,
             task_id=self.uuid,
-            eta=self.start,
-            link=commit.s(
-                username=self.environment.author.username,
-                namespace=self.uuid,
-                user_name=self.environment.author.get_full_name(),
-                user_email=self.environment.author.email
-            )
+            queue=queue,
+            link=self.commit_signature()
         )
         return result
 
+    def commit_signature(self):
+        """
+        Returns the signature of the commit task of the job, which takes the
+        result of run_script as first argument.
+        """
+        return commit.s(
+            username=self.environment.author.username,
+            namespace=self.uuid,
+            user_name=self.environment.author.get_full_name(),
+            user_email=self.environment.author.email
+        )
+
     def stop_job(self):
         from openearth.celery import app
+        from openearth.apps.script_execution_manager.scheduler import \
+            get_scheduler
         app.control.revoke(self.uuid, terminate=True, signal='SIGKILL')
+        # A job which waits in the scheduler never reaches a worker.
+        state = get_scheduler().release(self.uuid)
+        if state in (None, 'pending') and self.status < self.STATUS.STARTED:
+            self.set_status('REVOKED')
 
     def get_log(self):
         pass
@@ -373,8 +469,9 @@ class ProcessingJob(models.Model):
              update_fields=None):
         super(ProcessingJob, self).save(force_insert, force_update, using,
                                         update_fields)
-        # directly start/schedule job after successful save
-        if self.status <= self.STATUS.CREATED:
+        # directly start/schedule job after successful save. Jobs of a batch
+        # are started by the batch.
+        if self.status <= self.STATUS.CREATED and not self.batch_id:
             self.start_job()
 
     def __unicode__(self):
@@ -389,6 +486,270 @@ class ProcessingJob(models.Model):
         ordering = ['-created_date']
 
 
+class ProcessingBatch(models.Model):
+    """
+    Jobs which run one script with different parameters or revisions.
+
+    Description:
+        The jobs are created in one transaction (see create), the revisions
+        are validated once, against the svn log index. At most concurrency
+        jobs of the batch are scheduled or running at a time: advance
+        schedules the next ones when jobs are done, and marks the batch
+        finished after the last one.
+
+        With reuse_containers the warm pool of the image (see
+        script_execution_manager.pool) is grown by the concurrency while the
+        batch runs, so its jobs take pre-booted containers instead of each
+        provisioning and booting one.
+    """
+    environment = models.ForeignKey(ProcessingEnvironment,
+                                    verbose_name=_('processing environment'),
+                                    related_name='processing_batch')
+    script = models.CharField(_('script name'), max_length=255)
+    start = models.DateTimeField(_('start batch after '), default=timezone.now)
+    created_date = models.DateTimeField(_('date created'),
+                                        default=timezone.now)
+    finished_date = models.DateTimeField(_('date finished'), null=True,
+                                         blank=True, editable=False)
+    auto_commit = models.BooleanField(_('Commit automatically'), default=True)
+    concurrency = models.PositiveIntegerField(
+        _('concurrency'),
+        default=settings.PROCESSING_BATCH['concurrency'],
+        help_text=_('Number of jobs of the batch which run at the same time.'))
+    reuse_containers = models.BooleanField(
+        _('reuse containers'), default=False,
+        help_text=_('Keep containers of the image booted while the batch '
+                    'runs.'))
+    force_rerun = models.BooleanField(
+        _('force rerun'), default=False,
+        help_text=_('Run every job, also when a finished job had the same '
+                    'inputs.'))
+
+    @classmethod
+    def create(cls, environment, script, runs, **kwargs):
+        """
+        Creates a batch with a job per run, and starts it.
+
+        Arguments:
+            environment: ProcessingEnvironment.
+            script: script name.
+            runs: list of dicts, one per job, with (all optional) the
+                parameters (dict), revision, script_revision and
+                open_earth_revision of the job.
+            kwargs: other fields of the batch.
+
+        Raises:
+            ValidationError if a revision is not in the svn log.
+
+        Returns:
+            The batch.
+        """
+        latest = validate_revisions(environment, script, runs)
+        with transaction.atomic():
+            batch = cls.objects.create(environment=environment, script=script,
+                                       **kwargs)
+            ProcessingJob.objects.bulk_create([
+                ProcessingJob(
+                    uuid=unicode(uuid4()),
+                    environment=environment,
+                    batch=batch,
+                    batch_index=index,
+                    script=script,
+                    start=batch.start,
+                    auto_commit=batch.auto_commit,
+                    force_rerun=batch.force_rerun,
+                    status=ProcessingJob.STATUS.CREATED,
+                    revision=run.get('revision') or latest,
+                    script_revision=run.get('script_revision'),
+                    open_earth_revision=run.get('open_earth_revision'),
+                    parameters=json.dumps(run['parameters'])
+                    if run.get('parameters') else '',
+                )
+                for index, run in enumerate(runs)
+            ])
+        batch.start_batch()
+        return batch
+
+    def start_batch(self):
+        """
+        Starts the batch at self.start.
+        """
+        from openearth.apps.script_execution_manager.tasks import \
+            schedule_batch
+
+        return schedule_batch.apply_async(args=[self.pk], eta=self.start)
+
+    def advance(self):
+        """
+        Schedules jobs until concurrency jobs of the batch are scheduled or
+        running. Marks the batch finished when all its jobs are done.
+
+        Returns:
+            List of the uuids of the scheduled jobs.
+        """
+        from openearth.apps.script_execution_manager.scheduler import \
+            get_scheduler
+        from openearth.apps.script_execution_manager.tasks import \
+            finish_from_cache
+        STATUS = ProcessingJob.STATUS
+        with transaction.atomic():
+            # One advance at a time per batch, or both see the same room.
+            batch = ProcessingBatch.objects.select_for_update().get(pk=self.pk)
+            if batch.finished_date:
+                return []
+            active = batch.jobs.filter(status__gt=STATUS.CREATED,
+                                       status__lt=STATUS.FINISHED).count()
+            uuids = list(batch.jobs.filter(status=STATUS.CREATED).order_by(
+                'batch_index').values_list('uuid', flat=True)[
+                    :max(batch.concurrency - active, 0)])
+            ProcessingJob.objects.filter(uuid__in=uuids).update(
+                status=STATUS.SCHEDULED)
+            finished = not uuids and not active and not batch.jobs.filter(
+                status=STATUS.CREATED).exists()
+            if finished:
+                batch.finished_date = timezone.now()
+                batch.save(update_fields=['finished_date'])
+                self.finished_date = batch.finished_date
+
+        scheduler = get_scheduler()
+        submitted = False
+        for job in ProcessingJob.objects.filter(
+                uuid__in=uuids).order_by('batch_index'):
+            # Jobs with cached results do not wait in the scheduler.
+            if finish_from_cache(job):
+                continue
+            scheduler.submit(job.uuid, self.environment.author.username,
+                             self.environment.libvirt_image.libvirt_image)
+            submitted = True
+        if submitted:
+            scheduler.dispatch()
+        if finished and self.reuse_containers:
+            self.resize_pool(grow=False)
+        return uuids
+
+    def stop(self):
+        """
+        Revokes the jobs which did not start yet and stops the others.
+        """
+        STATUS = ProcessingJob.STATUS
+        self.jobs.filter(status=STATUS.CREATED).update(status=STATUS.REVOKED)
+        for job in self.jobs.filter(status__gt=STATUS.CREATED,
+                                    status__lt=STATUS.FINISHED):
+            job.stop_job()
+        advance_batch.delay(self.pk)
+
+    def pool_containers(self):
+        """
+        Returns the number of containers the batch adds to the warm pool.
+        """
+        if not self.reuse_containers:
+            return 0
+        return min(self.concurrency, self.jobs.count())
+
+    def resize_pool(self, grow=True):
+        """
+        Grows the warm pool of the image by pool_containers, or shrinks it
+        back.
+
+        Description:
+            replenish_pool boots the containers on every host, or destroys
+            the ready containers beyond the new size.
+        """
+        from openearth.apps.script_execution_manager.models import \
+            ContainerPool
+        from openearth.apps.script_execution_manager.tasks import \
+            replenish_pools
+        count = self.pool_containers()
+        if not count:
+            return
+        image = self.environment.libvirt_image.libvirt_image
+        with transaction.atomic():
+            pool, created = ContainerPool.objects.select_for_update() \
+                .get_or_create(image=image)
+            if grow:
+                pool.size += count
+            else:
+                pool.size = max(pool.size - count, 0)
+            pool.save(update_fields=['size'])
+        replenish_pools(image)
+
+    def progress(self):
+        """
+        Returns dict with the number of jobs of the batch in total, done and
+        failed (or revoked), the percentage done, the number of jobs per
+        status, the CPU seconds used and whether the batch is finished.
+        """
+        STATUS = ProcessingJob.STATUS
+        labels = dict(STATUS.choices)
+        counts = dict(
+            (row['status'], row['count']) for row in
+            self.jobs.order_by().values('status').annotate(
+                count=Count('uuid'))
+        )
+        total = sum(counts.values())
+        done = sum(n for status, n in counts.items()
+                   if status >= STATUS.FINISHED)
+        return {
+            'total': total,
+            'done': done,
+            'failed': counts.get(STATUS.FAILURE, 0) +
+            counts.get(STATUS.REVOKED, 0),
+            'percent': 100.0 * done / total if total else 100.0,
+            'statuses': dict((unicode(labels.get(status, status)), n)
+                             for status, n in counts.items()),
+            'cpu_seconds': self.jobs.aggregate(
+                cpu_seconds=Sum('cpu_seconds'))['cpu_seconds'] or 0,
+            'finished': self.finished_date is not None,
+        }
+
+    def get_absolute_url(self):
+        return reverse(
+            'batch_detail',
+            kwargs={'env': self.environment.id, 'pk': self.pk})
+
+    def __unicode__(self):
+        return '{0} batch {1}'.format(self.script, self.pk)
+
+    class Meta:
+        verbose_name = _('batch')
+        verbose_name_plural = _('batches')
+        ordering = ['-created_date']
+
+
+def validate_revisions(environment, script, runs):
+    """
+    Validates the revisions of runs against the svn log index of the repo
+    and of the scripts; one query per index, however many runs.
+
+    Raises:
+        ValidationError if a revision is not in the log.
+
+    Returns:
+        The revision of runs without one: the last revision which changed
+        script, or the last revision of the scripts when script is not in the
+        log. ProcessingJob.clean uses the last revision of the scripts.
+    """
+    scripts_index = environment.get_log_index(environment.get_scripts_url())
+    for field, index in (
+            ('revision',
+             environment.get_log_index(environment.get_repo_url())),
+            ('script_revision', scripts_index)):
+        revisions = set(run[field] for run in runs if run.get(field))
+        known = set(index.entries.filter(
+            revision__in=revisions).values_list('revision', flat=True))
+        invalid = sorted(revisions - known)
+        if invalid:
+            raise exceptions.ValidationError('Invalid {0}: {1}'.format(
+                field.replace('_', ' '), ', '.join(map(str, invalid))))
+    last = scripts_index.revisions(
+        limit=1,
+        path_suffix='/' + environment.REPOS.SVN['scripts'] + script
+    )
+    if last:
+        return int(last[0]['@revision'])
+    return scripts_index.entries.values_list('revision', flat=True).first()
+
+
 def result_file_name(instance, filename):
     return '/'.join([
         'job_results',
@@ -417,3 +778,186 @@ class ProcessingJobResult(models.Model):
     class Meta:
         verbose_name = _('result')
         verbose_name_plural = _('results')
+
+
+def like_escape(value):
+    """
+    Escapes the wildcards of LIKE in value.
+    """
+    return value.replace('\\', '\\\\').replace('%', '\\%') \
+        .replace('_', '\\_')
+
+
+class SvnLogIndex(models.Model):
+    """
+    Persisted log of one svn url, for the revision pickers.
+
+    Description:
+        refresh() only fetches the revisions newer than last_revision, and
+        at most once per settings.SVN_METADATA_HEAD_TIMEOUT seconds. It runs
+        in the refresh_log_index task; requests serve what is indexed so far.
+        revisions() serves pages of the log from the database, in the format
+        of svn.revisions.
+    """
+    url = models.CharField(max_length=255, unique=True)
+    last_revision = models.PositiveIntegerField(default=0)
+    checked = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def for_url(cls, url, username, password):
+        """
+        Returns the index of url, and queues a refresh when it is outdated.
+        """
+        index, created = cls.objects.get_or_create(url=url)
+        if index.is_outdated():
+            # Only the request which claims the check queues the task.
+            claimed = cls.objects.filter(
+                pk=index.pk, checked=index.checked
+            ).update(checked=timezone.now())
+            if claimed:
+                refresh_log_index.delay(index.pk, username, password)
+        return index
+
+    def is_outdated(self):
+        max_age = timedelta(seconds=settings.SVN_METADATA_HEAD_TIMEOUT)
+        return not self.checked or timezone.now() - self.checked >= max_age
+
+    def refresh(self, username, password, force=False):
+        """
+        Adds the revisions of url newer than last_revision.
+
+        Description:
+            The log is stored in batches of 1000 revisions, each committed
+            with its last_revision. An interrupted refresh continues after
+            the last stored batch.
+
+        Returns:
+            Number of added revisions.
+        """
+        if not force and not self.is_outdated():
+            return 0
+
+        head = svn.last_changed_revision(self.url, username, password)
+        added = 0
+        if head > self.last_revision:
+            log = svn.iter_log(
+                self.url, username, password,
+                revision='{0}:{1}'.format(self.last_revision + 1, head),
+                verbose=True
+            )
+            # Entries are stored while svn streams them.
+            while True:
+                batch = list(islice(log, 1000))
+                if not batch:
+                    break
+                added += self.add_entries(batch, int(batch[-1]['@revision']))
+            # The url did not change in the revisions after the last entry.
+            self.add_entries([], head)
+        self.checked = timezone.now()
+        SvnLogIndex.objects.filter(pk=self.pk).update(checked=self.checked)
+        return added
+
+    def add_entries(self, entries, last_revision):
+        """
+        Stores svn.iter_log entries and moves last_revision up to
+        last_revision.
+
+        Description:
+            Entries which are stored already (by a concurrent refresh) are
+            skipped.
+
+        Returns:
+            Number of added entries.
+        """
+        with transaction.atomic():
+            index = SvnLogIndex.objects.select_for_update().get(pk=self.pk)
+            new = [SvnLogEntry.from_log(index, e) for e in entries
+                   if int(e['@revision']) > index.last_revision]
+            SvnLogEntry.objects.bulk_create(new)
+            if last_revision > index.last_revision:
+                index.last_revision = last_revision
+                index.save(update_fields=['last_revision'])
+        self.last_revision = index.last_revision
+        return len(new)
+
+    def revisions(self, limit=100, offset=0, before=None, path=None,
+                  author=None, since=None, until=None, path_suffix=None):
+        """
+        Returns a page of the log, newest first, as svn.revisions does.
+
+        Arguments:
+            limit, offset: page of the filtered log.
+            before: only revisions older than this one.
+            path: only revisions which changed a path containing this.
+            path_suffix: only revisions which changed a path ending with
+                this, for example '/scripts/a.py' for one file.
+            author: only revisions of this author.
+            since, until: only revisions in this date range (datetime).
+        """
+        entries = self.entries.all()
+        if before:
+            entries = entries.filter(revision__lt=before)
+        if author:
+            entries = entries.filter(author=author)
+        if since:
+            entries = entries.filter(date__gte=since)
+        if until:
+            entries = entries.filter(date__lte=until)
+        if path:
+            entries = entries.extra(
+                where=["array_to_string(paths, '\n') LIKE %s"],
+                params=['%{0}%'.format(like_escape(path))]
+            )
+        if path_suffix:
+            entries = entries.extra(
+                where=['EXISTS (SELECT 1 FROM unnest(paths) AS p '
+                       'WHERE p LIKE %s)'],
+                params=['%' + like_escape(path_suffix)]
+            )
+        return [e.as_log() for e in entries[offset:offset + limit]]
+
+    def __unicode__(self):
+        return self.url
+
+    class Meta:
+        verbose_name = _('svn log index')
+        verbose_name_plural = _('svn log indexes')
+
+
+class SvnLogEntry(models.Model):
+    index = models.ForeignKey(SvnLogIndex, related_name='entries')
+    revision = models.PositiveIntegerField()
+    author = models.CharField(max_length=255, blank=True, db_index=True)
+    date = models.DateTimeField(null=True, db_index=True)
+    msg = models.TextField(blank=True)
+    paths = TextArrayField()
+
+    @classmethod
+    def from_log(cls, index, entry):
+        """
+        Creates (unsaved) entry from an svn.iter_log entry.
+        """
+        return cls(
+            index=index,
+            revision=int(entry['@revision']),
+            author=entry['author'],
+            date=parse_datetime(entry['date']) if entry['date'] else None,
+            msg=entry['msg'],
+            paths=entry.get('paths', [])
+        )
+
+    def as_log(self):
+        return {
+            '@revision': unicode(self.revision),
+            'author': self.author,
+            'date': self.date.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            if self.date else None,
+            'msg': self.msg,
+        }
+
+    def __unicode__(self):
+        return 'r{0}'.format(self.revision)
+
+    class Meta:
+        ordering = ['-revision']
+        unique_together = ('index', 'revision')
@@ -145,30 +145,67 @@ $(function () {
     var action = $('#terminal');
     var ws_url = action.data("ws-url");
     var ws_type = action.data("ws-type") || 'subscribe-user';
-    var ws = new WebSocket(ws_url + '?' + ws_type);
-    ws.onopen = function () {
-        console.log("websocket connected");
-        $('#terminal').append(colorString('[Info] Websocket connected. Listening for messages...') + '<br/>');
-    };
-    ws.onmessage = function (e) {
-        var terminal = $('#terminal');
-        var string = colorString(e.data.replace(new RegExp('\r?\n','g'), ''));
-        if (string){
-            terminal.append( string + '<br/>');
-            terminal.trigger("newmsg");
+    var ws_token = action.data("ws-token") || '';
+    // Log lines arrive as "<seq>\x1e<line>". After a lost connection, the
+    // server only sends the lines after the last sequence number seen.
+    var lastSeq = 0;
+    var closing = false;
+    var ws;
+
+    function parseMessage(data) {
+        var i = data.indexOf('\x1e');
+        if (i > 0) {
+            lastSeq = parseInt(data.slice(0, i), 10);
+            return data.slice(i + 1);
         }
-    };
+        return data;
+    }
 
-    ws.onerror = function (e) {
-        console.error(e);
-        $('#terminal').append(colorString('[Error]' + e) + '<br/>');
-    };
-    ws.onclose = function (e) {
-        console.log("connection closed");
-        $('#terminal').append(colorString('[Error] Websocket connection closed.') + '<br/>');
-    };
+    function connect() {
+        ws = new WebSocket(ws_url + '?' + ws_type + '&since=' + lastSeq +
+                           '&token=' + encodeURIComponent(ws_token));
+        ws.onopen = function () {
+            console.log("websocket connected");
+            $('#terminal').append(colorString('[Info] Websocket connected. Listening for messages...') + '<br/>');
+        };
+        ws.onmessage = function (e) {
+            var terminal = $('#terminal');
+            // A record can hold several output lines; each is shown with
+            // the "[LEVEL] time : " prefix of the record.
+            var lines = parseMessage(e.data).split(new RegExp('\r?\n'));
+            var sep = lines[0].indexOf(' : ');
+            var prefix = sep > 0 ? lines[0].slice(0, sep + 3) : '';
+            $.each(lines, function (i, line) {
+                if (i > 0) {
+                    if (!line) {
+                        return;
+                    }
+                    line = prefix + line;
+                }
+                var string = colorString(line);
+                if (string){
+                    terminal.append( string + '<br/>');
+                }
+            });
+            terminal.trigger("newmsg");
+        };
+
+        ws.onerror = function (e) {
+            console.error(e);
+            $('#terminal').append(colorString('[Error]' + e) + '<br/>');
+        };
+        ws.onclose = function (e) {
+            console.log("connection closed");
+            if (!closing) {
+                $('#terminal').append(colorString('[Error] Websocket connection closed. Reconnecting...') + '<br/>');
+                setTimeout(connect, 2000);
+            }
+        };
+    }
+    connect();
 
     window.onbeforeunload = function() {
+        closing = true;
         ws.close()
     };
 
@@ -1,5 +1,9 @@
 from __future__ import unicode_literals
+from django.core.exceptions import ValidationError
 from django.test import TestCase, RequestFactory
+import json
+import mock
+from openearth.apps.processing import models
 from openearth.apps.processing.tests import factories
 
 
@@ -30,3 +34,80 @@ class JobModelTest(TestCase):
         job.start_job()
         print job.environment.get_repo_url()
         print job.script
+
+
+@mock.patch('openearth.apps.script_execution_manager.tasks.schedule_batch'
+            '.apply_async')
+@mock.patch('openearth.apps.script_execution_manager.scheduler'
+            '.get_scheduler')
+class BatchModelTest(TestCase):
+
+    def setUp(self):
+        self.environment = factories.ProcessingEnvironmentFactory()
+        index = models.SvnLogIndex.objects.create(url='repo', last_revision=12)
+        # r11 is the last change of script.py.
+        for revision, path in ((10, 'script.py'), (11, 'script.py'),
+                               (12, 'other.py')):
+            index.entries.create(revision=revision,
+                                 paths=['/repo/scripts/' + path])
+        patcher = mock.patch.object(models.ProcessingEnvironment,
+                                    'get_log_index', return_value=index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_batch(self, runs, **kwargs):
+        return models.ProcessingBatch.create(self.environment, 'script.py',
+                                             runs, **kwargs)
+
+    def test_create(self, get_scheduler, apply_async):
+        batch = self.create_batch(
+            [{'parameters': {'x': 1}}, {'revision': 10}, {}], concurrency=2)
+        jobs = batch.jobs.order_by('batch_index')
+        self.assertEqual([j.revision for j in jobs], [11, 10, 11])
+        self.assertEqual(json.loads(jobs[0].parameters), {'x': 1})
+        self.assertEqual(jobs[2].parameters, '')
+        # Jobs of a batch are not started one by one.
+        self.assertEqual(apply_async.call_count, 1)
+
+        self.assertRaises(ValidationError, self.create_batch,
+                          [{'revision': 11}, {'script_revision': 99}])
+        self.assertEqual(models.ProcessingBatch.objects.count(), 1)
+
+    def test_default_revision_of_script_only(self, get_scheduler,
+                                             apply_async):
+        """
+        Files which only start or end like the script do not count.
+        """
+        index = self.environment.get_log_index('repo')
+        for revision, path in ((13, 'script.py.bak'),
+                               (14, 'old_script.py'),
+                               (15, 'sub/script.py/x')):
+            index.entries.create(revision=revision,
+                                 paths=['/repo/scripts/' + path])
+        self.assertEqual(
+            models.validate_revisions(self.environment, 'script.py', [{}]),
+            11)
+
+    def test_advance(self, get_scheduler, apply_async):
+        STATUS = models.ProcessingJob.STATUS
+        batch = self.create_batch([{}, {}, {}], concurrency=2)
+        jobs = list(batch.jobs.order_by('batch_index').values_list(
+            'uuid', flat=True))
+
+        self.assertEqual(batch.advance(), jobs[:2])
+        self.assertEqual(get_scheduler.return_value.submit.call_count, 2)
+        self.assertEqual(batch.advance(), [])
+
+        batch.jobs.filter(uuid=jobs[0]).update(status=STATUS.FINISHED)
+        self.assertEqual(batch.advance(), jobs[2:])
+
+        batch.jobs.filter(uuid=jobs[1]).update(status=STATUS.FAILURE)
+        batch.jobs.filter(uuid=jobs[2]).update(status=STATUS.FINISHED)
+        self.assertEqual(batch.advance(), [])
+        self.assertIsNotNone(batch.finished_date)
+
+        progress = batch.progress()
+        self.assertEqual(progress['total'], 3)
+        self.assertEqual(progress['done'], 3)
+        self.assertEqual(progress['failed'], 1)
+        self.assertTrue(progress['finished'])
@@ -0,0 +1,187 @@
+from __future__ import unicode_literals
+from django.core.cache import get_cache
+from django.test import TestCase
+from io import BytesIO
+import mock
+import threading
+import time
+
+from openearth.apps.processing.models import SvnLogEntry, SvnLogIndex
+from openearth.libs import svn
+
+
+class SvnMetadataCacheTest(TestCase):
+
+    def setUp(self):
+        # A local memory cache, shared by the threads of a test.
+        patcher = mock.patch('openearth.libs.svn.cache', get_cache(
+            'django.core.cache.backends.locmem.LocMemCache'
+        ))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_is_fixed_revision(self):
+        self.assertTrue(svn.is_fixed_revision(42))
+        self.assertTrue(svn.is_fixed_revision('41:0'))
+        self.assertFalse(svn.is_fixed_revision(None))
+        self.assertFalse(svn.is_fixed_revision(''))
+        self.assertFalse(svn.is_fixed_revision('HEAD'))
+
+    @mock.patch('openearth.libs.svn.fetch_revisions',
+                return_value=[{'@revision': '42'}])
+    def test_revisions_cached(self, fetch_revisions):
+        for i in range(3):
+            revisions = svn.revisions('https://svn/repo', 'u', 'p',
+                                      revision='42')
+        self.assertEqual(revisions, [{'@revision': '42'}])
+        self.assertEqual(fetch_revisions.call_count, 1)
+        svn.revisions('https://svn/repo', 'u', 'p', limit=5, revision='42')
+        self.assertEqual(fetch_revisions.call_count, 2)
+
+    @mock.patch('openearth.libs.svn.fetch_list',
+                return_value=([], 'svn: E170000: URL does not exist'))
+    def test_list_errors_not_cached(self, fetch_list):
+        svn.list_('https://svn/repo', 'u', 'p')
+        svn.list_('https://svn/repo', 'u', 'p')
+        self.assertEqual(fetch_list.call_count, 2)
+
+    @mock.patch('openearth.libs.svn.popen')
+    def test_iter_log_streams_compact_entries(self, popen):
+        popen.return_value.stdout = BytesIO(
+            b'<?xml version="1.0"?><log>'
+            b'<logentry revision="2"><author>jelle</author>'
+            b'<date>2015-06-02T12:00:00.000000Z</date>'
+            b'<paths><path action="M" kind="file">/trunk/a.py</path></paths>'
+            b'<msg> fix </msg></logentry>'
+            b'<logentry revision="1"><author>jelle</author>'
+            b'<date>2015-06-01T12:00:00.000000Z</date><msg/></logentry>'
+            b'</log>'
+        )
+        popen.return_value.poll.return_value = None
+        log = svn.iter_log('https://svn/repo', 'u', 'p', verbose=True)
+        self.assertEqual(next(log), {
+            '@revision': '2', 'author': 'jelle',
+            'date': '2015-06-02T12:00:00.000000Z', 'msg': 'fix',
+            'paths': ['/trunk/a.py'],
+        })
+        log.close()
+        # Stopping early stops svn.
+        popen.return_value.kill.assert_called_once_with()
+
+    @mock.patch('openearth.libs.svn.popen')
+    def test_iter_log_no_log(self, popen):
+        popen.return_value.stdout = BytesIO(b'')
+        self.assertRaises(svn.SvnRepoDoesNotExist, svn.fetch_revisions,
+                          'https://svn/nothing', 'u', 'p')
+
+    def test_concurrent_requests_coalesce(self):
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return ['a.py'], ''
+
+        with mock.patch('openearth.libs.svn.fetch_list',
+                        side_effect=lambda *args: fetch()):
+            threads = [
+                threading.Thread(target=svn.list_,
+                                 args=('https://svn/repo', 'u', 'p'))
+                for i in range(4)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(len(calls), 1)
+
+
+def log_entry(revision, author='jelle', path='/trunk/scripts/a.py'):
+    return {
+        '@revision': unicode(revision),
+        'author': author,
+        'date': '2015-06-0{0}T12:00:00.000000Z'.format(revision),
+        'msg': 'r{0}'.format(revision),
+        'paths': [path],
+    }
+
+
+class SvnLogIndexTest(TestCase):
+
+    @mock.patch('openearth.libs.svn.iter_log')
+    @mock.patch('openearth.libs.svn.last_changed_revision')
+    def test_refresh_fetches_new_revisions_only(self, last_changed_revision,
+                                                iter_log):
+        index = SvnLogIndex.objects.create(url='https://svn/repo')
+        last_changed_revision.return_value = 3
+        iter_log.return_value = iter([log_entry(r) for r in (1, 2, 3)])
+        self.assertEqual(index.refresh('u', 'p'), 3)
+        self.assertEqual(iter_log.call_args[1]['revision'], '1:3')
+
+        # Checked recently; svn is not asked.
+        self.assertEqual(index.refresh('u', 'p'), 0)
+        self.assertEqual(last_changed_revision.call_count, 1)
+
+        last_changed_revision.return_value = 5
+        iter_log.return_value = iter([log_entry(4), log_entry(5)])
+        self.assertEqual(index.refresh('u', 'p', force=True), 2)
+        self.assertEqual(iter_log.call_args[1]['revision'], '4:5')
+        self.assertEqual(index.last_revision, 5)
+
+    @mock.patch('openearth.libs.svn.iter_log')
+    @mock.patch('openearth.libs.svn.last_changed_revision')
+    def test_interrupted_refresh_continues(self, last_changed_revision,
+                                           iter_log):
+        """
+        Every batch of 1000 revisions is stored with its last_revision.
+        """
+        def interrupted_log():
+            for revision in range(1, 1201):
+                yield log_entry(revision)
+            raise svn.SvnException('connection lost')
+
+        index = SvnLogIndex.objects.create(url='https://svn/repo')
+        last_changed_revision.return_value = 1500
+        iter_log.return_value = interrupted_log()
+        self.assertRaises(svn.SvnException, index.refresh, 'u', 'p')
+        index = SvnLogIndex.objects.get(pk=index.pk)
+        self.assertEqual(index.last_revision, 1000)
+        self.assertEqual(index.entries.count(), 1000)
+        self.assertIsNone(index.checked)
+
+        iter_log.return_value = iter([log_entry(r)
+                                      for r in range(1001, 1501)])
+        self.assertEqual(index.refresh('u', 'p'), 500)
+        self.assertEqual(iter_log.call_args[1]['revision'], '1001:1500')
+        self.assertEqual(index.entries.count(), 1500)
+
+    @mock.patch('openearth.apps.processing.models.refresh_log_index')
+    @mock.patch('openearth.libs.svn.last_changed_revision')
+    def test_for_url_queues_refresh(self, last_changed_revision,
+                                    refresh_log_index):
+        """
+        Requests do not wait for svn; one of them queues the refresh.
+        """
+        index = SvnLogIndex.for_url('https://svn/repo', 'u', 'p')
+        self.assertEqual(SvnLogIndex.for_url('https://svn/repo', 'u', 'p'),
+                         index)
+        refresh_log_index.delay.assert_called_once_with(index.pk, 'u', 'p')
+        self.assertFalse(last_changed_revision.called)
+
+    def test_revisions_filters(self):
+        index = SvnLogIndex.objects.create(url='https://svn/repo')
+        SvnLogEntry.objects.bulk_create([
+            SvnLogEntry.from_log(index, log_entry(1)),
+            SvnLogEntry.from_log(index, log_entry(2, author='gerrit')),
+            SvnLogEntry.from_log(index, log_entry(3, path='/trunk/raw/b.csv')),
+        ])
+        revisions = index.revisions()
+        self.assertEqual([r['@revision'] for r in revisions], ['3', '2', '1'])
+        self.assertEqual(revisions[0]['date'], '2015-06-03T12:00:00.000000Z')
+
+        def numbers(**filters):
+            return [int(r['@revision']) for r in index.revisions(**filters)]
+        self.assertEqual(numbers(before=3), [2, 1])
+        self.assertEqual(numbers(author='gerrit'), [2])
+        self.assertEqual(numbers(path='scripts/a.py'), [2, 1])
+        self.assertEqual(numbers(limit=1, offset=1), [2])
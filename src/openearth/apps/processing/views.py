@@ -6,14 +6,20 @@ from django.http import Http404
 from django.views.generic import ListView, CreateView, UpdateView, View
 from django.views.generic.detail import DetailView
 import models
-from forms import EnvironmentForm, JobForm
+from forms import BatchForm, EnvironmentForm, JobForm
 from django.contrib import messages
 from django.utils.translation import ugettext_lazy as _, ugettext
 from django.shortcuts import get_object_or_404, redirect
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import datetime, time
 import json
 from django.http import HttpResponse
 import redis
 from ws4redis import settings as redis_settings
+from openearth.apps.script_execution_manager.gateway import make_token
+from openearth.apps.script_execution_manager.scheduler import get_scheduler
 
 
 class JsonResponse(HttpResponse):
@@ -173,10 +179,41 @@ class JobCreateView(CreateView):
         return result
 
 
+def log_filters(request, limit=100):
+    """
+    Returns the filters of SvnLogIndex.revisions in the query string.
+
+    Query string:
+        revision: only revisions older than this one (next page).
+        offset, limit: page.
+        path, author: filter on changed path and author.
+        since, until: date range, as YYYY-MM-DD.
+    """
+    filters = {}
+    for name in ('offset', 'limit'):
+        if request.GET.get(name, '').isdigit():
+            filters[name] = int(request.GET[name])
+    filters['limit'] = min(filters.get('limit', limit), 1000)
+    if request.GET.get('revision', '').isdigit():
+        filters['before'] = int(request.GET['revision'])
+    for name in ('path', 'author'):
+        if request.GET.get(name):
+            filters[name] = request.GET[name]
+    for name in ('since', 'until'):
+        value = request.GET.get(name) and parse_date(request.GET[name])
+        if value:
+            filters[name] = timezone.make_aware(
+                datetime.combine(value, time.min if name == 'since' else time.max),
+                timezone.get_current_timezone()
+            )
+    return filters
+
+
 class RepoRevisionsView(View):
     def get(self, request, *args, **kwargs):
         env = get_object_or_404(models.ProcessingEnvironment, pk=self.kwargs['env'])
-        return JsonResponse(env.get_revisions())
+        index = env.get_log_index(env.get_repo_url())
+        return JsonResponse(index.revisions(**log_filters(request)))
 
 
 class ScriptsView(View):
@@ -188,16 +225,19 @@ class ScriptsView(View):
 class OpenEarthRevisionsView(View):
     def get(self, request, *args, **kwargs):
         extension = self.kwargs.get('extension')
-        revision = request.GET.get('revision', '')
-        if revision:
-            revision = '%d:0' % (int(revision) - 1)
 
         if extension == 'py' or extension.endswith('.py'):
-            revisions = models.get_open_earth_python_revisions(revision=revision)
+            prefix = 'OPEN_EARTH_TOOLS_PYTHON'
         elif extension == 'm' or extension.endswith('.m'):
-            revisions = models.get_open_earth_matlab_revisions(revision=revision)
+            prefix = 'OPEN_EARTH_TOOLS_MATLAB'
         else:
-            revisions = models.get_open_earth_revisions(revision=revision)
+            prefix = 'OPEN_EARTH_TOOLS'
+        index = models.SvnLogIndex.for_url(
+            getattr(settings, prefix + '_URL'),
+            username=getattr(settings, prefix + '_USERNAME'),
+            password=getattr(settings, prefix + '_PASSWORD'),
+        )
+        revisions = index.revisions(**log_filters(request))
 
         for revision in revisions:
             revision['id'] = revision['@revision']
@@ -208,7 +248,64 @@ class OpenEarthRevisionsView(View):
 class ScriptRevisionsView(View):
     def get(self, request, *args, **kwargs):
         env = get_object_or_404(models.ProcessingEnvironment, pk=self.kwargs['env'])
-        return JsonResponse(env.get_script_revisions(self.kwargs['script']))
+        index = env.get_log_index(env.get_scripts_url())
+        filters = log_filters(request, limit=10)
+        filters.setdefault('path', '/' + self.kwargs['script'])
+        return JsonResponse(models.format_revisions(index.revisions(**filters)))
+
+
+class BatchCreateView(View):
+    """
+    Creates a batch of jobs, see forms.BatchForm for the POST data.
+
+    Returns (JSON) the batch id, the uuids of its jobs and the url of its
+    progress, or the errors with status 400.
+    """
+    def post(self, request, *args, **kwargs):
+        env = get_object_or_404(models.ProcessingEnvironment, pk=self.kwargs['env'])
+        form = BatchForm(request.POST,
+                         instance=models.ProcessingBatch(environment=env))
+        if not form.is_valid():
+            return JsonResponse(dict(
+                (field, [unicode(e) for e in errors])
+                for field, errors in form.errors.items()
+            ), status=400)
+        data = dict(form.cleaned_data)
+        runs = data.pop('runs')
+        script = data.pop('script')
+        try:
+            batch = models.ProcessingBatch.create(env, script, runs, **data)
+        except ValidationError, e:
+            return JsonResponse({'runs': e.messages}, status=400)
+        return JsonResponse({
+            'batch': batch.pk,
+            'jobs': list(batch.jobs.order_by('batch_index').values_list(
+                'uuid', flat=True)),
+            'url': batch.get_absolute_url(),
+        }, status=201)
+
+
+class BatchDetailView(View):
+    """
+    Progress of a batch (JSON), see ProcessingBatch.progress. With
+    action=stop_batch the batch is stopped first.
+    """
+    def get(self, request, *args, **kwargs):
+        batch = get_object_or_404(models.ProcessingBatch, pk=self.kwargs['pk'],
+                                  environment=self.kwargs['env'])
+        if request.GET.get('action') == 'stop_batch':
+            batch.stop()
+        return JsonResponse(batch.progress())
+
+
+class QueueStatsView(View):
+    """
+    Depth and wait times of the job queues, for staff.
+    """
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_staff:
+            return JsonResponse({}, status=403)
+        return JsonResponse(get_scheduler().queue_stats())
 
 
 class JobUpdateView(UpdateView):
@@ -269,6 +366,7 @@ class JobDetailView(DetailView):
 
         context.update({
             'ws_url': '{SCHEMA}://{SERVER_NAME}:{SERVER_PORT}{WEBSOCKET_URL}{UUID}'.format(**self.request.META),
+            'ws_token': make_token(self.request.user, self.kwargs['uuid']),
             'environment': get_object_or_404(models.ProcessingEnvironment, pk=self.kwargs['env']),
             'job': get_object_or_404(models.ProcessingJob, uuid=self.kwargs['uuid']),
         })
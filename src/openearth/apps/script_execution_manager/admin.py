@@ -1,8 +1,8 @@
 from __future__ import unicode_literals
 from django.contrib import admin
-from .models import Compartment, Group, LocationPoint, MeasurementMethod, \
-    Observation, Organ, Parameter, Property, Quality, SampleDevice, \
-    SampleMethod, SpatialReferenceDevice
+from .models import Compartment, ContainerPool, Group, LocationPoint, \
+    MeasurementMethod, Observation, Organ, Parameter, Property, Quality, SampleDevice, \
+    SampleMethod, SpatialReferenceDevice, WarmContainer
 
 
 class ObservationAdmin(admin.ModelAdmin):
@@ -19,6 +19,30 @@ class ObservationAdmin(admin.ModelAdmin):
     raw_id_fields = ('parameter',)
 
 
+class WarmContainerInline(admin.TabularInline):
+    model = WarmContainer
+    fields = ('uuid', 'host', 'state', 'ip_address', 'created', 'ready_at',
+              'job')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+class ContainerPoolAdmin(admin.ModelAdmin):
+    list_display = ('image', 'size', 'available', 'hit_rate', 'time_to_ready')
+    inlines = [WarmContainerInline]
+    actions = ['replenish']
+
+    def replenish(self, request, queryset):
+        from .tasks import replenish_pools
+        for pool in queryset:
+            replenish_pools(pool.image)
+        self.message_user(request, 'Replenishing {0} pool(s).'.format(
+            queryset.count()
+        ))
+    replenish.short_description = 'Boot containers until the pool is full'
+
+
 class GroupAdmin(admin.ModelAdmin):
     list_display = ('description',)
     search_fields = ('description',)
@@ -76,6 +100,7 @@ class SpatialReferenceDeviceAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Compartment, CompartmentAdmin)
+admin.site.register(ContainerPool, ContainerPoolAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(LocationPoint)
 admin.site.register(MeasurementMethod, MeasurementMethodAdmin)
@@ -2,18 +2,42 @@ from __future__ import unicode_literals
 from celery.utils.log import get_task_logger
 from django.core.management import call_command
 import logging
+from netCDF4 import Dataset
 import os
-from shutil import copyfile
-import subprocess
-import sys
-import openearth
-from openearth.apps.script_execution_manager.exec_wrapper import ExecWrapper
+import shutil
+import tempfile
+import threading
+from .reflink import reflink
+
+# The netCDF/HDF5 libraries are not thread safe, while the commit task
+# commits NetCDF files from several threads.
+netcdf_lock = threading.Lock()
 
 
 class CommitError(BaseException):
     pass
 
 
+def copy_file(source, dest):
+    """
+    Copies source to dest, sharing the data blocks when the filesystem can.
+
+    Description:
+        Tries a reflink (FICLONE ioctl, on btrfs and xfs) first, which does
+        not copy any data. Falls back to a regular copy.
+
+    Returns:
+        'reflink' or 'copy'
+    """
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        try:
+            reflink(src, dst)
+            return 'reflink'
+        except (IOError, OSError):
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+            return 'copy'
+
+
 class CommitBase(object):
 
     def __init__(self, source, dest, processing_job, published=False, user_email=None, user_name=None):
@@ -82,31 +106,31 @@ class CommitCSV(CommitBase):
 
     def call_commit_command(self, published=True):
         """
-        Calls csv_worker command to validate and insert CSV data into db.
+        Validates and inserts CSV data into db, like the csv_worker command.
+
+        Description:
+            Runs in-process with ingest_csv, on the database connection of
+            the current (celery) process. Output of the import is logged to
+            the job logger.
         """
+        # csv_worker imports ProcessingJob, of which the module imports tasks.
+        from openearth.apps.script_execution_manager.management.commands \
+            import csv_worker
         logger = self.get_logger()
-        manage_path = os.path.join(
-            os.path.dirname(openearth.__file__),
-            '..',
-            'manage.py'
-        )
-        cmd = [
-            sys.executable,  # Current python interpreter
-            manage_path,
-            'csv_worker',
-            '--processing-job={0}'.format(self.processing_job),
-            '--csv-input={0}'.format(self.source),
-        ]
-        if published:
-            cmd += ['--published']
-        logger.info('Executing command: "{0}"'.format(' '.join(cmd)))
-        ew = ExecWrapper(
-            command=cmd,
-        )
-        for stdout_stderr in ew.start_process():
-            logger.info(stdout_stderr)
-
-        if ew.get_return_code():
+        logger.info('Importing "{0}" for job {1} (published: {2})'.format(
+            self.source,
+            self.processing_job,
+            published
+        ))
+        try:
+            csv_worker.ingest_csv(
+                self.source,
+                self.processing_job,
+                published=published,
+                job_logger=logger
+            )
+        except Exception, e:
+            logger.error('{0}'.format(e))
             raise CommitError('An error occurred while running commit worker.')
 
     def mark_published(self):
@@ -149,66 +173,85 @@ class CommitNetCDF(CommitBase):
 
     """
 
-    def mark_unpublished(self):
+    def set_global_attributes(self, attributes):
         """
-        Mark NetCDF data unpublished and move to dest immediately.
+        Copies source to dest and sets global attributes of the copy.
+
+        Description:
+            The file is copied with copy_file and only the global attributes
+            are changed, in place, with netCDF4. This replaces ncatted, which
+            rewrote the whole file. Like ncatted "o,c" the attributes are
+            created or overwritten as char attributes and, like ncatted
+            --history, the history attribute is left alone.
 
-        Using ncatted because it copies the file to the destination immediately
-        too. The python lib does not do that.
+            The copy is made next to dest and renamed when it is complete:
+            OPeNDAP never serves a half written file and a failed commit
+            leaves nothing behind.
+
+        Arguments:
+            attributes: list of (name, value) tuples, set in that order.
         """
-        process = subprocess.Popen([
-            '/usr/bin/ncatted',
-            '--attribute', 'processing_level,global,o,c,preliminary',
-            '--attribute', 'processing_job,global,o,c,{uuid}'.format(uuid=self.processing_job),
-            '--overwrite',
-            '--history',
-            '{0}'.format(self.source),
-            '{0}'.format(self.dest)
-        ], stderr=subprocess.PIPE)
-        stderr = process.communicate()[1]
-        if process.returncode:
-            raise CommitError(stderr)
+        logger = logging.getLogger(self.__class__.__name__)
+        fd, tmp = tempfile.mkstemp(
+            suffix='.nc',
+            dir=os.path.dirname(os.path.abspath(self.dest))
+        )
+        os.close(fd)
+        try:
+            method = copy_file(self.source, tmp)
+            with netcdf_lock:
+                rootgrp = Dataset(tmp, mode='a')
+                try:
+                    for name, value in attributes:
+                        rootgrp.setncattr(
+                            name,
+                            '{0}'.format(value).encode('utf-8')
+                        )
+                finally:
+                    rootgrp.close()
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, self.dest)
+        except (IOError, OSError, RuntimeError), e:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            logger.error('{0}: {1}'.format(self.source, e))
+            raise CommitError('{0}: {1}'.format(self.source, e))
+        logger.info('Copied ({0}) "{1}" to "{2}", set {3}'.format(
+            method,
+            self.source,
+            self.dest,
+            ', '.join(name for name, value in attributes)
+        ))
+
+    def mark_unpublished(self):
+        """
+        Mark NetCDF data unpublished and copy to dest.
+        """
+        self.set_global_attributes([
+            ('processing_level', 'preliminary'),
+            ('processing_job', self.processing_job),
+        ])
 
     # Alias to match NetCDF slang
     mark_preliminary = mark_unpublished
 
     def mark_published(self):
         """
-        Mark NetCDF data published and move to dest immediately.
-
-        Using ncatted because it copies the file to the destination immediately
-        too. The python lib does not do that.
+        Mark NetCDF data published and copy to dest.
         """
         import datetime
         date_fmt = '%Y-%m-%dT%H:%M:%SZ'
         date_created = datetime.datetime.utcnow().strftime(date_fmt)
         date_modified = date_created
 
-        command = [
-            '/usr/bin/ncatted',
-            '--attribute', 'processing_level,global,o,c,final',
-            '--attribute', 'uuid,global,o,c,{uuid}'.format(
-                uuid=self.processing_job),
-            '--attribute', 'date_created,global,o,c,{date_created}'.format(
-                date_created=date_created),
-            '--attribute', 'date_modified,global,o,c,{date_modified}'.format(
-                date_modified=date_modified),
-            '--attribute', 'publisher_name,global,o,c,{user_name}'.format(
-                user_name=self.user_name),
-            '--attribute', 'publisher_email,global,o,c,{user_email}'.format(
-                user_email=self.user_email),
-            '--overwrite',
-            '--history',
-            '{0}'.format(self.source),
-            '{0}'.format(self.dest)
-        ]
-        logger = logging.getLogger(self.__class__.__name__)
-        logger.info('mark_published: %r' % ' '.join(command))
-        process = subprocess.Popen(command, stderr=subprocess.PIPE)
-        stderr = process.communicate()[1]
-        if process.returncode:
-            logger.error('stderr: %r' % stderr)
-            raise CommitError(stderr)
+        self.set_global_attributes([
+            ('processing_level', 'final'),
+            ('uuid', self.processing_job),
+            ('date_created', date_created),
+            ('date_modified', date_modified),
+            ('publisher_name', self.user_name),
+            ('publisher_email', self.user_email),
+        ])
 
     # Alias to match NetCDF slang
     mark_final = mark_published
@@ -243,5 +286,5 @@ class CommitKML(CommitBase):
         """
         Move kml data to dest, including directory structure.
         """
-        copyfile(src=self.source, dst=self.dest)
+        shutil.copyfile(src=self.source, dst=self.dest)
 
@@ -15,6 +15,10 @@ import shutil
 import libvirt
 import subprocess
 
+from .provisioners import provision_image, provisioner_for_instance
+from .resources import get_profile
+from .svn_cache import SVN_CACHE_MOUNT
+
 logger = logging.getLogger(__name__)
 
 
@@ -22,15 +26,6 @@ class LibVirtDomainException(Exception):
     pass
 
 
-def sizeof_fmt(num, use_kibibyte=True):
-    base, infix = [(1000., ''), (1024., 'i')][use_kibibyte]
-    for x in ['bytes', 'K%sB' % infix, 'M%sB' % infix, 'G%sB' % infix]:
-        if num < base and num > -base:
-            return "%3.1f%s" % (num, x)
-        num /= base
-    return "%3.1f %s" % (num, 'T%sB' % infix)
-
-
 class LibVirtNet(object):
     """
     Manages defining and starting of network interfaces.
@@ -125,6 +120,7 @@ class LibVirtDomain(object):
     _network_mac_address = None
     dnsmasq_leases = '/var/lib/libvirt/dnsmasq/default.leases'
     _ip_address = None
+    _provisioner = None
 
     def __init__(self, uuid, image, domain_xml_template="containers/domain.xml",
                  driver_uri="lxc:///",
@@ -194,11 +190,12 @@ class LibVirtDomain(object):
 
     def get_ip_address(self):
         """
-        Matches mac address with ip leases from dnsmasq.
+        Matches mac address with the DHCP leases of the network.
 
-        This can only be run after creation of a VM. The default.leases file
-        disappears after a while. Therefore it caches the current ip in
-        self._ip_address
+        This can only be run after creation of a VM. The leases are asked from
+        libvirt if it supports it (libvirt >= 1.2.6), otherwise they are read
+        from dnsmasq's leases file. The default.leases file disappears after
+        a while. Therefore it caches the current ip in self._ip_address
 
         Files:
             /var/lib/libvirt/dnsmasq/default.leases
@@ -215,13 +212,11 @@ class LibVirtDomain(object):
             )
 
         if not self._ip_address:
-            with open(self.dnsmasq_leases, 'r') as fp:
-                for line in fp:
-                    mac = line.split(' ')[1]
-                    ip = line.split(' ')[2]
-                    if mac == self.network_mac_address:
-                        validate_ipv46_address(ip)
-                        return ip
+            ip = self.get_network_lease() or self.get_dnsmasq_lease()
+            if ip:
+                validate_ipv46_address(ip)
+                self._ip_address = ip
+                return ip
 
             raise LibVirtDomainException(
                 'No IP Address found for "{0}" with mac address "{1}".'.format(
@@ -231,20 +226,80 @@ class LibVirtDomain(object):
             )
         return self._ip_address
 
+    def get_network_lease(self):
+        """
+        Returns ip address leased to the domain according to libvirt, or None.
+        """
+        network = self.network.network
+        if not hasattr(network, 'DHCPLeases'):  # libvirt-python < 1.2.6
+            return None
+        try:
+            leases = network.DHCPLeases(self.network_mac_address)
+        except libvirt.libvirtError:
+            return None
+        for lease in leases:
+            return lease['ipaddr']
+
+    def get_dnsmasq_lease(self):
+        """
+        Returns ip address leased to the domain in the leases file, or None.
+        """
+        try:
+            with open(self.dnsmasq_leases, 'r') as fp:
+                for line in fp:
+                    parts = line.split(' ')
+                    if len(parts) > 2 and parts[1] == self.network_mac_address:
+                        return parts[2]
+        except IOError:
+            return None
+
+    def get_base_image_path(self):
+        return os.path.join(settings.CONTAINER['base_dir'], self.image)
+
+    def get_instance_image_path(self):
+        return os.path.join(
+            settings.CONTAINER['base_dir'],
+            self.get_instance_name()
+        )
+
+    @property
+    def provisioner(self):
+        """
+        ImageProvisioner of the instance image.
+
+        Description:
+            Set by copy_base_image. For an image made by another object, it
+            is derived from the instance image on disk.
+        """
+        if not self._provisioner:
+            self._provisioner = provisioner_for_instance(
+                self.get_instance_image_path(),
+                logger,
+                settings.CONTAINER
+            )
+        return self._provisioner
+
     def render_xml(self):
         """
         Renders the xml file, returns parsed xml
+
+        The limits come from the resource profile of the image (see
+        resources.get_profile).
         """
-        fs_params = {
-            "base_dir": settings.CONTAINER['base_dir'],
-            "instance_name": self.get_instance_name()
-        }
+        profile = get_profile(self.image)
+        profile['swap_hard_limit'] = profile['memory'] + profile['swap']
         return self.template.render(Context({
             "name": self.get_instance_name(),
+            "profile": profile,
             "uuid": self.uuid,
             "network_mac_address": self.network_mac_address,
-            "root_filesystem": "{base_dir}/{instance_name}".format(**fs_params),
-            "results_filesystem": self.results_dir
+            "root_filesystem": self.provisioner.source,
+            "root_filesystem_type": self.provisioner.filesystem_type,
+            "root_filesystem_source": self.provisioner.source_attribute,
+            "root_filesystem_driver": self.provisioner.driver,
+            "results_filesystem": self.results_dir,
+            "svn_cache_filesystem": settings.CONTAINER.get('svn_cache_dir'),
+            "svn_cache_mount": SVN_CACHE_MOUNT
         }))
 
     def define(self):
@@ -256,64 +311,26 @@ class LibVirtDomain(object):
 
     def copy_base_image(self):
         """
-        Copies original read only image to run this instance on.
+        Provisions the instance image from the original read only image.
+
+        Description:
+            See provisioners.provision_image. The provisioners to try are
+            configured in settings.CONTAINER['provisioners'].
         """
-        src = os.path.join(settings.CONTAINER['base_dir'], self.image)
-        dst = os.path.join(
-            settings.CONTAINER['base_dir'],
-            self.get_instance_name()
-        )
-        if os.path.exists(dst):
+        dst = self.get_instance_image_path()
+        if os.path.lexists(dst):
             # Rewrite exception description to something humans understand
             raise LibVirtDomainException(
                 'Instance image already exists: {0}'.format(dst)
             )
 
         logger.info("Copying image to '{0}'.".format(dst))
-        length = 16*1024  # 10 times the blocksize as buffer
-
-        try:
-            with open(src, 'rb') as fsrc:
-                # max_size defined by sparse file
-                max_size = os.fstat(fsrc.fileno()).st_size
-
-                # The actual size the sparse file uses on disk (check with du -sh)
-                # http://bugs.python.org/file19108/shutil-2.7.patch for mor info
-                actual_size = os.fstat(fsrc.fileno()).st_blocks * 512
-                logger.info(
-                    "Max size of image: {0} (already used: {1})".format(sizeof_fmt(max_size), sizeof_fmt(actual_size))
-                )
-                log_percent = 0
-                with open(dst, 'wb') as fdst:
-                    while 1:
-                        current_size = os.fstat(fdst.fileno()).st_size
-                        buf = fsrc.read(length)
-                        if not buf:
-                            break
-                        if buf == '\0'*len(buf):
-                            fdst.seek(len(buf), os.SEEK_CUR)  # this is the sparse / empty bit of a file
-                        else:
-                            fdst.write(buf)  # this buffer contains actual non sparse data, copy it to dst
-
-                            percent = 100.0 * current_size/max_size
-                            if percent >= 100.0:
-                                logger.info("[# {:.1%} imgcopy info #] Copying image".format(100.0/100.0))
-                            else:
-                                if log_percent + 1 < percent:
-                                    log_percent = percent
-                                    logger.info("[# {:.1%} imgcopy info #] Copying image".format(percent/100.0))
-
-                    fdst.truncate(max_size) # make this a sparse file like the originating file
-
-            shutil.copystat(src, dst)
-            logger.info("[# 100% imgcopy info #] Image copied")
-        except OSError, e:
-            logger.warn("Tried to copy image: {0}.".format(e))
-
-        # shutil.copy2(
-        #     os.path.join(settings.CONTAINER['base_dir'], self.image),
-        #     target_path
-        # )
+        self._provisioner = provision_image(
+            self.get_base_image_path(),
+            dst,
+            logger,
+            settings.CONTAINER
+        )
 
     def create_results_dir(self):
         """
@@ -332,15 +349,11 @@ class LibVirtDomain(object):
         """
         Deletes image of instance.
         """
-        instance_image_path = os.path.join(
-            settings.CONTAINER['base_dir'],
-            self.get_instance_name()
-        )
-        try:
-            os.remove(instance_image_path)
-        except OSError:  # Raise helpful error message
+        instance_image_path = self.get_instance_image_path()
+        if not os.path.lexists(instance_image_path):  # Raise helpful error message
             raise LibVirtDomainException("Trying to delete instance image '{0}', "
                           "but it does not exist.".format(instance_image_path))
+        self.provisioner.remove()
 
     def delete_results_dir(self):
         shutil.rmtree(self.results_dir)
@@ -386,10 +399,15 @@ class LibVirtDomain(object):
     def destroy(self):
         """
         Destroys (stop) and undefines domain. Deletes instance image.
+
+        Description:
+            The image is deleted last; a logical volume or overlay mount can
+            not be removed while the domain still uses it.
         """
-        self.delete_instance_image()
+        domain = self.domain
         try:
-            self.domain.destroy()
+            domain.destroy()
         except libvirt.libvirtError:
             logger.warn("Tried to destroy '{0}', but it was not running.".format(self.get_instance_name()))
-        self.domain.undefine()
\ No newline at end of file
+        domain.undefine()
+        self.delete_instance_image()
\ No newline at end of file
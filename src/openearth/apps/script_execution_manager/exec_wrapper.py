@@ -1,27 +1,117 @@
 """
 Executes a command, redirects stderr and stdout to a file and to redis.
 """
+from collections import deque, namedtuple
+import errno
+import fcntl
 import logging
+import os
 import subprocess
 import select
+import time
 
 logger = logging.getLogger(__name__)
 
+# A line of output: stream is 'stdout' or 'stderr', time the moment it was
+# read (time.time()), text the line without line ending.
+OutputLine = namedtuple('OutputLine', ['stream', 'time', 'text'])
+
+
+class CommandFailed(Exception):
+    """
+    Command ended with a return code > 0. tail has its last output lines.
+    """
+    def __init__(self, message, returncode, tail):
+        super(CommandFailed, self).__init__(message)
+        self.returncode = returncode
+        self.tail = tail
+
+
+class LineSplitter(object):
+    """
+    Splits the chunks read from one stream into lines.
+
+    Description:
+        Bytes of an unfinished line wait in the buffer until the next chunk.
+        A line longer than max_line_length is cut off; the rest, up to the
+        next line ending, is counted and dropped, so the buffer never holds
+        more than max_line_length bytes.
+    """
+    def __init__(self, stream, max_line_length):
+        self.stream = stream
+        self.max_line_length = max_line_length
+        self.buffer = bytearray()
+        self.skipped = 0
+        self.truncated_lines = 0
+
+    def make_line(self, data, now):
+        text = bytes(data).rstrip(b'\r').decode('utf-8', 'replace')
+        if self.skipped:
+            text += ' [{0} bytes truncated]'.format(self.skipped)
+            self.truncated_lines += 1
+            self.skipped = 0
+        return OutputLine(self.stream, now, text)
+
+    def feed(self, data, now):
+        """
+        Returns list of OutputLine, of the lines completed by data.
+        """
+        lines = []
+        start = 0
+        while True:
+            end = data.find(b'\n', start)
+            if end == -1:
+                self.append(data[start:])
+                return lines
+            self.append(data[start:end])
+            lines.append(self.make_line(self.buffer, now))
+            self.buffer = bytearray()
+            start = end + 1
+
+    def append(self, data):
+        room = self.max_line_length - len(self.buffer)
+        if len(data) > room:
+            self.skipped += len(data) - room
+            data = data[:room]
+        self.buffer.extend(data)
+
+    def flush(self, now):
+        """
+        Returns the unfinished line at the end of the stream, if any.
+        """
+        if not self.buffer and not self.skipped:
+            return []
+        line = self.make_line(self.buffer, now)
+        self.buffer = bytearray()
+        return [line]
+
 
 class ExecWrapper(object):
 
-    def __init__(self, command):
+    # Bytes read from a stream at once.
+    chunk_size = 65536
+
+    def __init__(self, command, max_line_length=4096, tail_lines=100):
         """
         Execute a command, start_process() yields stderr and stdout.
 
         Args:
             command: String or List for subprocess.popen(command)
+            max_line_length: longer lines are cut off, in bytes.
+            tail_lines: number of last lines kept in tail.
 
         Example:
             ExecWrapper(['python', '-u', 'bla.py'])
         """
         self.command = command
         self.process = None
+        self.max_line_length = max_line_length
+        self.tail = deque(maxlen=tail_lines)
+        self.bytes_read = 0
+        self.lines_read = 0
+        self.truncated_lines = 0
+        self.started = None
+        self.ended = None
 
     def parse_command(self):
         """
@@ -38,41 +128,75 @@ class ExecWrapper(object):
 
         return map(get_secret, self.command)
 
-    def start_process(self):
+    def stream_output(self, interval=0.1):
         """
-        Starts a process and catches stderr and stdout. yields it.
+        Starts a process and yields its output in batches.
+
+        Description:
+            stdout and stderr are read without blocking, so a long line
+            without line ending or a burst of output does not hold up the
+            other stream. Every poll (at most interval seconds) yields the
+            lines completed since the previous one.
 
         Returns:
-            The return code of the executed command.
+            Generator of lists of OutputLine.
+
+        Raises:
+            CommandFailed if the return code is > 0.
         """
         self.process = subprocess.Popen(
             self.parse_command(),
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
         )
+        self.started = time.time()
         epoll = select.epoll()
-        fds = {
-            self.process.stdout.fileno(): self.process.stdout,
-            self.process.stderr.fileno(): self.process.stderr,
-        }
+        splitters = {}
+        for stream, fp in (('stdout', self.process.stdout),
+                           ('stderr', self.process.stderr)):
+            fd = fp.fileno()
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            epoll.register(fd, select.EPOLLIN)
+            splitters[fd] = LineSplitter(stream, self.max_line_length)
+
+        try:
+            open_fds = set(splitters)
+            while open_fds:
+                events = epoll.poll(interval)
+                now = time.time()
+                batch = []
+                for fileno, event in events:
+                    splitter = splitters[fileno]
+                    try:
+                        data = os.read(fileno, self.chunk_size)
+                    except OSError as e:
+                        if e.errno == errno.EAGAIN:
+                            continue
+                        raise
+                    if data:
+                        self.bytes_read += len(data)
+                        batch.extend(splitter.feed(data, now))
+                    else:
+                        # EOF (EPOLLHUP is reported with an empty read)
+                        logger.debug("EOF for '{0}' on fileno {1}".format(
+                            ' '.join(self.command),
+                            fileno
+                        ))
+                        batch.extend(splitter.flush(now))
+                        epoll.unregister(fileno)
+                        open_fds.discard(fileno)
+                if batch:
+                    self.lines_read += len(batch)
+                    self.tail.extend(batch)
+                    yield batch
+        finally:
+            epoll.close()
+            self.truncated_lines = sum(
+                s.truncated_lines for s in splitters.values())
 
-        for fd in fds.itervalues():
-            epoll.register(fd.fileno())
-
-        while fds:
-            events = epoll.poll(1, select.EPOLLIN)
-            #events = epoll.poll(1)
-            for fileno, event in events:
-                if event & select.EPOLLIN:
-                    yield fds[fileno].readline()
-                elif event & select.EPOLLHUP:
-                    logger.debug("EPOLLHUP for '{0}' on fileno {1}".format(
-                        ' '.join(self.command),
-                        fileno
-                    ))
-                    epoll.unregister(fileno)
-                    del fds[fileno]
         self.process.wait()
+        self.ended = time.time()
         logger.debug("Process '{0}' ended with return code '{1}'".format(
             ' '.join(self.command),
             self.process.returncode
@@ -80,11 +204,47 @@ class ExecWrapper(object):
 
         if self.process.returncode > 0:
             msg = "Command '{0}' failed".format(' '.join(self.command))
-            raise Exception(msg)
+            raise CommandFailed(msg, self.process.returncode, list(self.tail))
+
+    def start_process(self):
+        """
+        Starts a process and catches stderr and stdout. yields it.
+
+        Description:
+            Yields the lines of stream_output one by one, with line ending.
+        """
+        for batch in self.stream_output():
+            for line in batch:
+                yield line.text + '\n'
 
     def get_return_code(self):
         return self.process.returncode
 
+    def get_stats(self):
+        """
+        Returns dict with the output counters, and bytes and lines per
+        second since the process started.
+        """
+        seconds = (self.ended or time.time()) - self.started \
+            if self.started else 0
+        return {
+            'bytes': self.bytes_read,
+            'lines': self.lines_read,
+            'truncated_lines': self.truncated_lines,
+            'seconds': seconds,
+            'bytes_per_second': self.bytes_read / seconds if seconds else 0,
+            'lines_per_second': self.lines_read / seconds if seconds else 0,
+        }
+
+    def format_tail(self, lines=20):
+        """
+        Returns the last lines of output, for error reports.
+        """
+        return '\n'.join(
+            '[{0}] {1}'.format(line.stream, line.text)
+            for line in list(self.tail)[-lines:]
+        )
+
 
 class SecretString(unicode):
     """
@@ -0,0 +1,283 @@
+"""
+Websocket gateway for job logs.
+
+Description:
+    Runs in the uWSGI websocket instance (see wsgi_websockets.py). Every
+    process has one Multiplexer: one redis connection which PSUBSCRIBEs the
+    patterns of all its clients and puts each published message in the send
+    queue of the clients of that pattern. A client only costs a greenlet and
+    a queue, not a redis connection.
+
+    A client whose queue is full is too slow: it is disconnected instead of
+    holding up the others. The browser reconnects with the last sequence
+    number it has seen and gets the missed lines from the history (see
+    store.RedisHistoryStore). The same happens when published lines were
+    lost, for example while the pubsub connection was re-established.
+
+    Clients are authorized with a signed token (make_token) made by the
+    page which opens the websocket, so no session or user is loaded from
+    the database per connection.
+"""
+from collections import defaultdict
+import logging
+import sys
+
+from django.conf import settings
+from django.core import signing
+from django.core.handlers.wsgi import WSGIRequest, STATUS_CODE_TEXT
+from django.http import HttpResponse, HttpResponseBadRequest, \
+    HttpResponseForbidden, HttpResponseServerError
+from django.utils.encoding import force_str
+import gevent
+from gevent.queue import Queue, Full
+import redis
+from ws4redis.exceptions import WebSocketError, HandshakeError, \
+    UpgradeRequiredError
+
+from .store import RedisHistoryStore, re_ns, split_message
+
+logger = logging.getLogger(__name__)
+
+TOKEN_SALT = 'openearth.apps.script_execution_manager.gateway'
+
+
+def make_token(user, namespace):
+    """
+    Returns token which allows user to open the websocket of namespace.
+    """
+    return signing.dumps(
+        {
+            'username': user.username,
+            'staff': user.is_staff,
+            'namespace': unicode(namespace),
+        },
+        salt=TOKEN_SALT
+    )
+
+
+def read_token(token, namespace):
+    """
+    Returns the data of token.
+
+    Raises:
+        signing.BadSignature if token is invalid, expired or for another
+        namespace.
+    """
+    data = signing.loads(
+        token,
+        salt=TOKEN_SALT,
+        max_age=settings.WEBSOCKET_GATEWAY['token_max_age']
+    )
+    if data['namespace'] != namespace:
+        raise signing.BadSignature('Token is for another namespace')
+    return data
+
+
+def get_channels(request, token):
+    """
+    Returns the channels in the query string which token allows.
+    """
+    allowed = RedisHistoryStore.subscription_channels + \
+        RedisHistoryStore.publish_channels
+    channels = [c for c in request.GET if c in allowed]
+    if not token['staff'] and 'subscribe-superuser' in channels:
+        channels.remove('subscribe-superuser')
+    return channels
+
+
+class Client(object):
+    """
+    Websocket connection with its send queue.
+    """
+    def __init__(self, websocket, store, max_queue):
+        """
+        Arguments:
+            websocket: upgraded websocket.
+            store: RedisHistoryStore with the channels of the client; it
+                replays the history and drops lines sent already.
+            max_queue: messages which can wait before the client is
+                disconnected.
+        """
+        self.websocket = websocket
+        self.store = store
+        self.queue = Queue(max_queue)
+        self.patterns = []
+        self.closed = False
+
+    def put(self, channel, message):
+        """
+        Queues message, closes the client if its queue is full.
+        """
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait((channel, message))
+        except Full:
+            logger.info('Disconnecting slow websocket client')
+            self.close()
+
+    def close(self):
+        self.closed = True
+
+    def run_sender(self):
+        while not self.closed:
+            channel, message = self.queue.get()
+            seq = split_message(message)[0]
+            last = self.store.last_sent(channel)
+            if seq is not None and last is not None and seq > last + 1:
+                # Lines were lost, the client gets them from the history
+                # when it reconnects.
+                logger.info('Disconnecting websocket client, lines lost')
+                self.close()
+                break
+            message = self.store.filter_message(channel, message)
+            if message is not None:
+                self.websocket.send(message)
+
+
+class Multiplexer(object):
+    """
+    Subscribes the patterns of all clients of this process on one pubsub
+    connection.
+    """
+    def __init__(self, connection):
+        self.pubsub = connection.pubsub(ignore_subscribe_messages=True)
+        self.clients = defaultdict(set)
+        self.listener = None
+
+    def subscribe(self, client, patterns):
+        client.patterns = patterns
+        for pattern in patterns:
+            if not self.clients[pattern]:
+                self.pubsub.psubscribe(pattern)
+            self.clients[pattern].add(client)
+        if self.listener is None:
+            self.listener = gevent.spawn(self.listen)
+
+    def unsubscribe(self, client):
+        for pattern in client.patterns:
+            clients = self.clients.get(pattern)
+            if clients is None:
+                continue
+            clients.discard(client)
+            if not clients:
+                del self.clients[pattern]
+                try:
+                    self.pubsub.punsubscribe(pattern)
+                except redis.RedisError:
+                    logger.warning('Could not unsubscribe {0}'.format(
+                        pattern))
+
+    def listen(self):
+        try:
+            for message in self.pubsub.listen():
+                if message['type'] != 'pmessage':
+                    continue
+                for client in list(self.clients.get(message['pattern'], ())):
+                    client.put(message['channel'], message['data'])
+        except redis.RedisError:
+            logger.warning('Lost pubsub connection', exc_info=sys.exc_info())
+            # Clients reconnect, and get what they missed from the history.
+            for clients in self.clients.values():
+                for client in clients:
+                    client.close()
+            self.clients.clear()
+            self.pubsub.reset()
+        finally:
+            self.listener = None
+            # listen() ends when the last pattern is unsubscribed, a client
+            # may have subscribed since.
+            if self.clients:
+                self.listener = gevent.spawn(self.listen)
+
+
+_multiplexer = None
+
+
+def get_multiplexer(connection):
+    """
+    Returns the Multiplexer of this process.
+    """
+    global _multiplexer
+    if _multiplexer is None:
+        _multiplexer = Multiplexer(connection)
+    return _multiplexer
+
+
+def gateway_call(self, environ, start_response):
+    """
+    Streams job logs through the Multiplexer.
+
+    Description:
+        Replaces the __call__ method of ws4redis.uwsgi_runserver-
+        .uWSGIWebsocketServer (see wsgi_websockets.py). Subscription
+        channels are the same as those of RedisHistoryStore: subscribe-user,
+        subscribe-superuser (staff only) and subscribe-broadcast. Other
+        query parameters: token (see make_token) and since (last sequence
+        number seen).
+    """
+    websocket = None
+    client = None
+    sender = None
+    multiplexer = get_multiplexer(self._redis_connection)
+    try:
+        self.assure_protocol_requirements(environ)
+        request = WSGIRequest(environ)
+        match_ns = re_ns.match(request.path_info)
+        if match_ns is None:
+            raise HandshakeError('No namespace in websocket url')
+        namespace = match_ns.group(1)
+        token = read_token(request.GET.get('token', ''), namespace)
+        channels = get_channels(request, token)
+        websocket = self.upgrade_websocket(environ, start_response)
+
+        store = RedisHistoryStore(self._redis_connection)
+        patterns = store.set_channels(token['username'], namespace,
+                                      channels, request.GET.get('since'))
+        client = Client(websocket, store,
+                        settings.WEBSOCKET_GATEWAY['max_queue'])
+        # Subscribe before the history is read, so no line falls in
+        # between; lines in both are dropped by the store.
+        multiplexer.subscribe(client, patterns)
+        store.send_persisted_messages(websocket)
+        sender = gevent.spawn(client.run_sender)
+
+        websocket_fd = websocket.get_file_descriptor()
+        while not websocket.closed and not client.closed:
+            ready = self.select([websocket_fd], [], [], 4.0)[0]
+            if not ready:
+                # flush empty socket
+                websocket.flush()
+                continue
+            message = websocket.receive()
+            # Only published when the client has publish channels.
+            store.publish_message(message)
+    except signing.BadSignature:
+        logger.info('Websocket with invalid token refused')
+        response = HttpResponseForbidden()
+    except WebSocketError:
+        logger.warning('WebSocketError: ', exc_info=sys.exc_info())
+        response = HttpResponse(status=1001, content='Websocket Closed')
+    except UpgradeRequiredError, excpt:
+        logger.info('Websocket upgrade required')
+        response = HttpResponseBadRequest(status=426, content=excpt)
+    except HandshakeError, excpt:
+        logger.warning('HandshakeError: ', exc_info=sys.exc_info())
+        response = HttpResponseBadRequest(content=excpt)
+    except Exception, excpt:
+        logger.error('Other Exception: ', exc_info=sys.exc_info())
+        response = HttpResponseServerError(content=excpt)
+    else:
+        response = HttpResponse()
+    if client:
+        multiplexer.unsubscribe(client)
+        client.close()
+    if sender:
+        sender.kill()
+    if websocket:
+        websocket.close(code=1001, message='Websocket Closed')
+    if hasattr(start_response, 'im_self') and not start_response.im_self.headers_sent:
+        status_text = STATUS_CODE_TEXT.get(response.status_code, 'UNKNOWN STATUS CODE')
+        status = '{0} {1}'.format(response.status_code, status_text)
+        start_response(force_str(status), response._headers.values())
+    return response
@@ -1,5 +1,8 @@
 import redis
 import logging
+from collections import deque
+import threading
+import time
 from openearth.apps.script_execution_manager.store import RedisHistoryStore
 from ws4redis import settings as redis_settings
 from django.conf import settings
@@ -8,8 +11,25 @@ from django.conf import settings
 class WebsocketLoggerHandler(logging.Handler):
     """
     Logger Handler which writes logs to websocket, through redis.
+
+    Records are buffered and published in batches, each batch with one
+    pipeline of publish scripts, one per channel (see
+    RedisHistoryStore.publish_messages):
+    - by a background thread, every flush_interval seconds;
+    - by the logging thread itself as soon as max_batch records wait. This
+      slows down a producer which outruns redis.
+    When redis is unreachable, at most max_buffer records are kept. Older
+    records are dropped, and the next batch starts with a line telling how
+    many were dropped. flush() and close() publish what is left; call them
+    when the task ends.
     """
-    def __init__(self, config, channels):
+    # The background thread ends after this many seconds without records.
+    idle_timeout = 5
+    # Seconds to wait before publishing again after a redis error.
+    retry_interval = 1
+
+    def __init__(self, config, channels, flush_interval=None, max_batch=None,
+                 max_buffer=None):
         # run the regular Handler __init__
         logging.Handler.__init__(self)
         #self.formatter = logging.Formatter('Format: %(message)s')
@@ -24,10 +44,96 @@ class WebsocketLoggerHandler(logging.Handler):
             request_or_config=config,
             channels=channels
         )
+        options = settings.WEBSOCKETLOGGER
+        self.flush_interval = flush_interval or options.get(
+            'flush_interval', 0.1)
+        self.max_batch = max_batch or options.get('max_batch', 500)
+        self.max_buffer = max_buffer or options.get('max_buffer', 10000)
+
+        self.buffer = deque()
+        self.dropped = 0
+        self.retry_at = 0
+        self.buffer_lock = threading.Lock()
+        # One batch at a time, so lines stay in order.
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.flusher = None
 
     def emit(self, record):
         """
-        Publish message to pubsub channel and append to history.
+        Buffer message; it is published to pubsub and appended to history by
+        flush.
         """
         msg = self.format(record)
-        self.redis_store.publish_message(msg)
\ No newline at end of file
+        with self.buffer_lock:
+            if len(self.buffer) >= self.max_buffer:
+                self.buffer.popleft()
+                self.dropped += 1
+            self.buffer.append(msg)
+            full = len(self.buffer) >= self.max_batch
+            if self.flusher is None or not self.flusher.is_alive():
+                self.flusher = threading.Thread(
+                    target=self.run_flusher,
+                    name='websocket-logger-flusher'
+                )
+                self.flusher.daemon = True
+                self.flusher.start()
+        if full and time.time() >= self.retry_at:
+            self.flush()
+
+    def run_flusher(self):
+        idle_since = time.time()
+        while not self.wakeup.is_set():
+            self.wakeup.wait(self.flush_interval)
+            with self.buffer_lock:
+                if self.buffer:
+                    idle_since = time.time()
+                elif time.time() - idle_since > self.idle_timeout:
+                    # emit starts a new thread for the next record.
+                    self.flusher = None
+                    return
+            if time.time() >= self.retry_at:
+                self.flush()
+
+    def take_batch(self):
+        with self.buffer_lock:
+            size = min(len(self.buffer), self.max_batch)
+            batch = [self.buffer.popleft() for i in range(size)]
+            dropped, self.dropped = self.dropped, 0
+        return batch, dropped
+
+    def flush(self):
+        """
+        Publishes all buffered messages.
+
+        Returns:
+            False if redis failed; the messages are kept for a next try.
+        """
+        with self.flush_lock:
+            while True:
+                batch, dropped = self.take_batch()
+                if not batch and not dropped:
+                    return True
+                messages = batch
+                if dropped:
+                    messages = ['[{0} log lines dropped]'.format(dropped)] + \
+                        batch
+                try:
+                    self.redis_store.publish_messages(messages)
+                except redis.RedisError:
+                    self.retry_at = time.time() + self.retry_interval
+                    with self.buffer_lock:
+                        self.buffer.extendleft(reversed(batch))
+                        self.dropped += dropped
+                        while len(self.buffer) > self.max_buffer:
+                            self.buffer.popleft()
+                            self.dropped += 1
+                    return False
+
+    def close(self):
+        self.wakeup.set()
+        flusher = self.flusher
+        if flusher is not None:
+            flusher.join(1)
+        self.flush()
+        logging.Handler.close(self)
@@ -1,13 +1,19 @@
 from django.contrib.gis.geos import Point
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.core.management import BaseCommand
+from django.core.management.base import OutputWrapper
+from django.conf import settings
 from django.db import reset_queries, transaction, connection
+from django.utils.encoding import force_text
+import csv
 import hashlib
 from optparse import make_option
 import os
 import pandas
 import re
 import math
+from StringIO import StringIO
+import time
 from openearth.apps.processing.models import ProcessingJob
 from openearth.apps.script_execution_manager.models import LocationPoint, \
     Compartment, SampleMethod, Parameter, SampleDevice, MeasurementMethod, \
@@ -16,6 +22,294 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class VocabularyIndex(object):
+    """
+    Per-run in memory index of the vocabulary (lookup) tables.
+
+    Description:
+        Each lookup table is loaded once, on first use, into a dict keyed on
+        the lowercased description. This replaces one query per lookup value
+        per CSV row. Hits, misses and load time are kept for reporting.
+
+    Example:
+        index = VocabularyIndex()
+        index.get(Unit, 'Meter')  # Unit object or None
+    """
+
+    def __init__(self):
+        self._index = {}
+        self.hits = 0
+        self.misses = 0
+        self.load_time = 0.0
+
+    @staticmethod
+    def key(value):
+        """
+        Returns the lowercased description; byte strings are utf-8.
+        """
+        return force_text(value, encoding='utf-8').lower()
+
+    def load(self, model):
+        """
+        Loads all descriptions of model. Returns dict with description: obj.
+        """
+        start = time.time()
+        index = {}
+        for obj in model.objects.only('id', 'description').order_by('id'):
+            index.setdefault(self.key(obj.description or ''), obj)
+        self._index[model] = index
+        self.load_time += time.time() - start
+        return index
+
+    def get(self, model, value):
+        """
+        Returns object of model with description value, None if unknown.
+        """
+        index = self._index.get(model)
+        if index is None:
+            index = self.load(model)
+        obj = index.get(self.key(value))
+        if obj is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return obj
+
+    def __contains__(self, item):
+        model, value = item
+        index = self._index.get(model)
+        if index is None:
+            index = self.load(model)
+        return self.key(value) in index
+
+    def stats(self):
+        return 'Vocabulary index: {0} tables loaded in {1:.3f}s, {2} hits, ' \
+               '{3} misses.'.format(len(self._index), self.load_time,
+                                    self.hits, self.misses)
+
+
+class LocationResolver(object):
+    """
+    Per-run, batched resolver of CSV coordinates to LocationPoints.
+
+    Description:
+        All unknown (origx, origy, orig_srid) tuples of a batch are transformed
+        to 4326 and matched against existing LocationPoints in one query. The
+        nearest LocationPoint within tolerance is used. Points without a match
+        are clustered: points within tolerance of each other share one new
+        LocationPoint. The new LocationPoints of a batch are inserted with one
+        INSERT per insert_size points. Resolved points are cached, so repeated
+        stations cost no queries at all.
+
+    Example:
+        resolver = LocationResolver()
+        resolver.resolve([(74235.579, 453534.926, 28992)])
+        resolver.get(74235.579, 453534.926, 28992)  # LocationPoint
+    """
+
+    # New LocationPoints per INSERT statement.
+    insert_size = 1000
+
+    def __init__(self, tolerance=8.181818181818181e-06):
+        self.tolerance = tolerance
+        self._points = {}
+        # Clusters of new points, per grid cell of tolerance x tolerance.
+        self._grid = {}
+        # Clusters which are not inserted yet.
+        self._new = []
+        self.created_ids = set()
+        self.reused = 0
+        self.queries = 0
+
+    @staticmethod
+    def make_key(origx, origy, orig_srid):
+        return float(origx), float(origy), int(orig_srid)
+
+    def get(self, origx, origy, orig_srid):
+        """
+        Returns resolved LocationPoint. Resolves the point if required.
+        """
+        key = self.make_key(origx, origy, orig_srid)
+        if key not in self._points:
+            self.resolve([key])
+        return self._points[key]
+
+    def match_existing(self, keys):
+        """
+        Transforms keys to 4326 and matches them with existing LocationPoints.
+
+        Returns:
+            list of tuples (key, x, y, LocationPoint or None), x and y in 4326.
+        """
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT u.origx, u.origy, u.orig_srid, st_x(u.geom), st_y(u.geom), (
+                SELECT l.id FROM {lp} l
+                WHERE st_dwithin(l.thegeometry, u.geom, %s)
+                ORDER BY st_distance(l.thegeometry, u.geom)
+                LIMIT 1
+            )
+            FROM (
+                SELECT origx, origy, orig_srid, st_transform(
+                    st_setsrid(st_point(origx, origy), orig_srid), 4326
+                ) AS geom
+                FROM (
+                    SELECT unnest(%s::double precision[]) AS origx,
+                        unnest(%s::double precision[]) AS origy,
+                        unnest(%s::integer[]) AS orig_srid
+                ) AS i
+            ) AS u
+        """.format(lp=LocationPoint._meta.db_table), [
+            self.tolerance,
+            [k[0] for k in keys],
+            [k[1] for k in keys],
+            [k[2] for k in keys],
+        ])
+        rows = cursor.fetchall()
+        self.queries += 1
+        ids = set(r[5] for r in rows if r[5] is not None)
+        existing = LocationPoint.objects.in_bulk(ids) if ids else {}
+        return [
+            (self.make_key(*r[0:3]), r[3], r[4], existing.get(r[5]))
+            for r in rows
+        ]
+
+    def cluster(self, key, x, y):
+        """
+        Returns a new LocationPoint within tolerance of x, y or makes one.
+
+        Description:
+            A LocationPoint which is made is not saved yet, see insert_new.
+        """
+        cell = (int(math.floor(x / self.tolerance)),
+                int(math.floor(y / self.tolerance)))
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                neighbour = (cell[0] + dx, cell[1] + dy)
+                for cx, cy, lp in self._grid.get(neighbour, []):
+                    if math.hypot(cx - x, cy - y) <= self.tolerance:
+                        return lp
+
+        lp = LocationPoint(
+            origx=key[0],
+            origy=key[1],
+            orig_srid=key[2],
+            thegeometry=Point(x, y, srid=4326)
+        )
+        self._new.append(lp)
+        self._grid.setdefault(cell, []).append((x, y, lp))
+        return lp
+
+    def insert_new(self):
+        """
+        Inserts the LocationPoints made by cluster and sets their ids.
+        """
+        cursor = connection.cursor()
+        while self._new:
+            chunk = self._new[:self.insert_size]
+            del self._new[:self.insert_size]
+            cursor.execute("""
+                INSERT INTO {lp} (origx, origy, orig_srid, thegeometry,
+                                  description, published)
+                SELECT origx, origy, orig_srid,
+                    st_setsrid(st_point(x, y), 4326), '', false
+                FROM (
+                    SELECT unnest(%s::double precision[]) AS origx,
+                        unnest(%s::double precision[]) AS origy,
+                        unnest(%s::integer[]) AS orig_srid,
+                        unnest(%s::double precision[]) AS x,
+                        unnest(%s::double precision[]) AS y
+                ) AS i
+                RETURNING id
+            """.format(lp=LocationPoint._meta.db_table), [
+                [lp.origx for lp in chunk],
+                [lp.origy for lp in chunk],
+                [lp.orig_srid for lp in chunk],
+                [lp.thegeometry.x for lp in chunk],
+                [lp.thegeometry.y for lp in chunk],
+            ])
+            # Rows are returned in the order of the arrays.
+            for lp, (pk,) in zip(chunk, cursor.fetchall()):
+                lp.id = pk
+                self.created_ids.add(pk)
+
+    def resolve(self, keys):
+        """
+        Resolves keys (origx, origy, orig_srid) to LocationPoints.
+
+        Returns:
+            dict with key: LocationPoint for all given keys.
+        """
+        keys = set(self.make_key(*k) for k in keys)
+        unknown = [k for k in keys if k not in self._points]
+        if unknown:
+            for key, x, y, lp in self.match_existing(unknown):
+                if lp is None:
+                    lp = self.cluster(key, x, y)
+                else:
+                    self.reused += 1
+                self._points[key] = lp
+            self.insert_new()
+        return dict((k, self._points[k]) for k in keys)
+
+    def stats(self):
+        return 'Location resolver: {0} points in {1} queries, {2} new, {3} ' \
+               're-used LocationPoints.'.format(len(self._points),
+                                               self.queries,
+                                               len(self.created_ids),
+                                               self.reused)
+
+
+class LoggerStream(object):
+    """
+    File like object which writes every line to a logger.
+
+    Description:
+        Used as stdout/stderr of the command when it is called in-process, so
+        its output ends up in (for example) the websocket logger of a job.
+    """
+    def __init__(self, logger, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+
+    def write(self, msg):
+        for line in msg.splitlines():
+            if line:
+                self.logger.log(self.level, line)
+
+    def flush(self):
+        pass
+
+
+def ingest_csv(csv_input, processing_job, published=False, mode='orm',
+               job_logger=None):
+    """
+    Imports a CSV file for a processing job, in the current process.
+
+    Description:
+        Does the same as the csv_worker command, without starting a new
+        python interpreter: Django is set up already and the database
+        connection of the caller is used. Output which the command writes to
+        stdout and stderr is sent to job_logger.
+
+    Arguments:
+        csv_input: path to CSV formatted file.
+        processing_job: ProcessingJob object.
+        published: mark the data as published.
+        mode: "orm" or "copy", see the --mode option of the command.
+        job_logger: logger for the output. Defaults to this module's logger.
+
+    Returns:
+        The Command object, which holds the statistics of the run.
+    """
+    job_logger = job_logger or logger
+    cmd = Command()
+    cmd.stdout = OutputWrapper(LoggerStream(job_logger))
+    cmd.stderr = OutputWrapper(LoggerStream(job_logger, logging.ERROR))
+    cmd.ingest(csv_input, processing_job, published=published, mode=mode)
+    return cmd
+
+
 class Command(BaseCommand):
     """
     This command validates CSV data and inserts it into the database.
@@ -26,9 +320,8 @@ class Command(BaseCommand):
         a processing job has succesfully finished and when it has produced CSV
         files.
 
-        While this command also could have been a library, this management
-        command is made for easier testing. Also the CommitNetCDF class calls
-        an external program.
+        CommitCSV does not run the command itself, but calls ingest_csv,
+        which runs the same import in-process.
     """
     option_list = BaseCommand.option_list + (
         make_option(
@@ -49,6 +342,16 @@ class Command(BaseCommand):
             help='ProcessingJob UUID',
             default=''
         ),
+        make_option(
+            '--mode',
+            dest='mode',
+            type='choice',
+            choices=['orm', 'copy'],
+            help='Ingest mode: "orm" inserts row by row through the ORM, '
+                 '"copy" streams the CSV into a staging table with COPY and '
+                 'merges it with set based SQL.',
+            default='orm'
+        ),
     )
     required_csv_columns = {
         'compartment', 'parameter', 'orig_srid', 'origx', 'origy', 'value',
@@ -56,10 +359,77 @@ class Command(BaseCommand):
         'quality', 'unit'
     }
 
+    # CSV column, related model and Observation field of all vocabulary
+    # (lookup) tables. Ordered alphabetically, like the error messages.
+    lookup_models = (
+        ('compartment', Compartment, 'compartment'),
+        ('measurementmethod', MeasurementMethod, 'measurement_method'),
+        ('parameter', Parameter, 'parameter'),
+        ('property', Property, 'property'),
+        ('quality', Quality, 'quality'),
+        ('sampledevice', SampleDevice, 'sample_device'),
+        ('samplemethod', SampleMethod, 'sample_method'),
+        ('unit', Unit, 'unit'),
+    )
+
+    # Staging tables used by the copy mode. They only live during the
+    # transaction of the import.
+    staging_table = 'csv_worker_staging'
+    staging_points_table = 'csv_worker_staging_points'
+    staging_columns = [c for c, m, f in lookup_models] + [
+        'orig_srid', 'origx', 'origy', 'value', 'date', 'concatenated_data',
+        'identity'
+    ]
+    # Rows per pandas chunk which are buffered before COPY-ing them.
+    copy_chunksize = 10000
+
+    # SET clause which appends %(job)s and %(env)s to the arrays of existing
+    # observations (alias o), unless they are in there already.
+    append_job_sql = """
+        processing_jobs = CASE
+            WHEN %(job)s = ANY(coalesce(o.processing_jobs, '{}'))
+            THEN o.processing_jobs
+            ELSE array_append(o.processing_jobs, %(job)s::text)
+        END,
+        processing_environments = CASE
+            WHEN %(env)s = ANY(coalesce(o.processing_environments, '{}'))
+            THEN o.processing_environments
+            ELSE array_append(o.processing_environments, %(env)s::text)
+        END
+    """
+
+    # See point_exists. This should be approximately one meter.
+    point_tolerance = 8.181818181818181e-06
+
     # observation object registry with a dicht which contains Observation
     # objects and their state (created, or existing).
     observations = {}
 
+    # Observations of the current chunk which exist in the database, keyed by
+    # concatenated data. None for data which does not exist (yet).
+    existing_observations = {}
+
+    _vocabulary = None
+    _locations = None
+
+    @property
+    def vocabulary(self):
+        """
+        VocabularyIndex of this run. Created on first use, reset by handle.
+        """
+        if self._vocabulary is None:
+            self._vocabulary = VocabularyIndex()
+        return self._vocabulary
+
+    @property
+    def locations(self):
+        """
+        LocationResolver of this run. Created on first use, reset by handle.
+        """
+        if self._locations is None:
+            self._locations = LocationResolver(self.point_tolerance)
+        return self._locations
+
     def validate_uuid(self, uuid):
         """
         Rude check if uuid is in correct uuid1 format.
@@ -128,6 +498,26 @@ class Command(BaseCommand):
         ])
         return ''.join(data)
 
+    def concatenate_row(self, dictified_chunk):
+        """
+        concatenate_observation_data for one row of a dictified chunk.
+        """
+        return self.concatenate_observation_data(
+            compartment=dictified_chunk['compartment'],
+            date=dictified_chunk['date'],
+            orig_srid=dictified_chunk['orig_srid'],
+            origx=dictified_chunk['origx'],
+            origy=dictified_chunk['origy'],
+            measurementmethod=dictified_chunk['measurementmethod'],
+            parameter=dictified_chunk['parameter'],
+            property=dictified_chunk['property'],
+            quality=dictified_chunk['quality'],
+            sampledevice=dictified_chunk['sampledevice'],
+            samplemethod=dictified_chunk['samplemethod'],
+            unit=dictified_chunk['unit'],
+            value=dictified_chunk['value']
+        )
+
     @staticmethod
     def chunk_to_dict(chunk):
         """
@@ -189,8 +579,9 @@ class Command(BaseCommand):
         Checks if an observation with the same data already exists.
 
         Description:
-            Checks first in self.observations_concatenated_data. If not in list,
-            find in database.
+            Checks first in self.observations_concatenated_data, then in the
+            observations prefetched for this chunk. If not in either, find in
+            database.
 
         Returns:
             Observation Object if a match is found, None if not.
@@ -201,13 +592,35 @@ class Command(BaseCommand):
         if local_observation:
             return local_observation
 
+        if concatenated_observation_data in self.existing_observations:
+            return self.existing_observations[concatenated_observation_data]
+
         try:
             return Observation.objects.get(
-                concatenated_data=concatenated_observation_data
+                identity=Observation.make_identity(
+                    concatenated_observation_data
+                )
             )
         except ObjectDoesNotExist:
             return None
 
+    def prefetch_observations(self, dictified_chunks):
+        """
+        Looks up which observations of a chunk already exist, in one query.
+
+        Description:
+            Fills self.existing_observations, which is used by
+            observation_exists instead of a query per row.
+        """
+        concatenated = set(self.concatenate_row(dc) for dc in dictified_chunks)
+        found = dict(
+            (o.concatenated_data, o)
+            for o in Observation.objects.identified_by(concatenated)
+        )
+        self.existing_observations = dict(
+            (c, found.get(c)) for c in concatenated
+        )
+
     def processing_job_exists(self, uuid):
         return ProcessingJob.objects.filter(uuid=uuid).exists()
 
@@ -245,8 +658,9 @@ class Command(BaseCommand):
             """.format(point=point)
         )
 
-        res = sum(1 for result in qs)
-        return qs[0] if res else False
+        # Evaluate the RawQuerySet once; indexing it runs the query again.
+        results = list(qs)
+        return results[0] if results else False
 
     def create_observation(
         self, location_point, dictified_chunk, published, processing_job
@@ -274,20 +688,17 @@ class Command(BaseCommand):
 
             If a value is NaN, None is returned.
             """
-            field_iexact = '{0}__exact'.format(field)
             value = dictified_chunk[model.__name__.lower()]
             if type(value) == float and math.isnan(value):
                 return None
 
-            try:
-                return model.objects.get(**{
-                    field_iexact: value.lower()
-                })
-            except ObjectDoesNotExist:
+            obj = self.vocabulary.get(model, value)
+            if obj is None:
                 errors.append('{0} "{1}" does not exist.'.format(
                     model.__name__,
                     value
                 ))
+            return obj
 
         compartment = get_relations(Compartment, 'description')
         measurementmethod = get_relations(MeasurementMethod, 'description')
@@ -302,21 +713,7 @@ class Command(BaseCommand):
                 + errors
             raise ObjectDoesNotExist('\n'.join(errors))
 
-        concatenated_data = self.concatenate_observation_data(
-            compartment=dictified_chunk['compartment'],
-            date=dictified_chunk['date'],
-            orig_srid=dictified_chunk['orig_srid'],
-            origx=dictified_chunk['origx'],
-            origy=dictified_chunk['origy'],
-            measurementmethod=dictified_chunk['measurementmethod'],
-            parameter=dictified_chunk['parameter'],
-            property=dictified_chunk['property'],
-            quality=dictified_chunk['quality'],
-            sampledevice=dictified_chunk['sampledevice'],
-            samplemethod=dictified_chunk['samplemethod'],
-            unit=dictified_chunk['unit'],
-            value=dictified_chunk['value']
-        )
+        concatenated_data = self.concatenate_row(dictified_chunk)
         existing_observation = self.observation_exists(concatenated_data)
         env_info = self.make_env_hash(processing_job)
         if existing_observation:
@@ -330,10 +727,12 @@ class Command(BaseCommand):
             elif env_info not in existing_observation.processing_environments:
                 existing_observation.processing_environments.append(env_info)
 
+            # A row which is twice in the chunk finds the observation of the
+            # first one, which is not saved yet.
             return {
                 concatenated_data: {
                     'observation': existing_observation,
-                    'created': False
+                    'created': existing_observation.pk is None
                 }
             }
         else:
@@ -351,6 +750,7 @@ class Command(BaseCommand):
                 value=dictified_chunk['value'],
                 published=published,
                 concatenated_data=concatenated_data,
+                identity=Observation.make_identity(concatenated_data),
                 processing_jobs=[processing_job.uuid],
                 processing_environments=[env_info]
             )
@@ -361,6 +761,41 @@ class Command(BaseCommand):
                 }
             }
 
+    def validate_relations(self, csv_input):
+        """
+        Checks all lookup values of the whole CSV file against the vocabulary.
+
+        Description:
+            Reads only the lookup columns, collects the distinct values and
+            reports every unknown value at once, instead of failing on the
+            first chunk which contains one.
+        Raises:
+            ObjectDoesNotExist with a human readable error message.
+        """
+        lookup_cols = [c for c, m, f in self.lookup_models]
+        values = dict((c, set()) for c in lookup_cols)
+        reader = pandas.read_csv(
+            csv_input,
+            chunksize=self.copy_chunksize,
+            usecols=lookup_cols
+        )
+        for chunk in reader:
+            for col in lookup_cols:
+                values[col].update(chunk[col].dropna().unique())
+
+        errors = []
+        for col, model, field in self.lookup_models:
+            for value in sorted(values[col]):
+                if (model, value) not in self.vocabulary:
+                    errors.append('{0} "{1}" does not exist.'.format(
+                        model.__name__,
+                        value
+                    ))
+        if errors:
+            errors = ['CSV file contains values which are not correct:'] \
+                + errors
+            raise ObjectDoesNotExist('\n'.join(errors))
+
     def chunk_to_db(self, dictified_chunks, published, processing_job):
         """
         Adds LocationPoint if it does not exists. Relates observation to point.
@@ -371,17 +806,19 @@ class Command(BaseCommand):
         self.observations = {}
         new_location_points = []
         existing_location_points = []
+        created_before = set(self.locations.created_ids)
+        points = self.locations.resolve(
+            (dc['origx'], dc['origy'], dc['orig_srid'])
+            for dc in dictified_chunks
+        )
+        created_now = self.locations.created_ids - created_before
+        self.prefetch_observations(dictified_chunks)
         for dc in dictified_chunks:
-            point = Point(dc['origx'], dc['origy'], srid=dc['orig_srid'])
-            lp = self.point_exists(point)
-
-            if not lp:
-                lp = LocationPoint.objects.create(
-                    origx=dc['origx'],
-                    origy=dc['origy'],
-                    orig_srid=dc['orig_srid'],
-                    thegeometry=point
-                )
+            lp = points[self.locations.make_key(
+                dc['origx'], dc['origy'], dc['orig_srid']
+            )]
+            if lp.id in created_now:
+                created_now.remove(lp.id)
                 new_location_points.append(str(lp.id))
             else:
                 existing_location_points.append(str(lp.id))
@@ -426,26 +863,379 @@ class Command(BaseCommand):
                 ', '.join([str(o['observation'].pk) for o in reused_observations])
             )
         )
-        self.save_observations(self.observations)
+        self.save_observations(self.observations, processing_job)
 
-    def save_observations(self, observations):
+    def save_observations(self, observations, processing_job=None):
         """
         Saves all observations from the observation 'registry'.
 
         Description:
             Because the registry is a dict, get all Observation objects out of
-            it. Only save observations. Related objects like
-            ObservationProcessingJobUsage will be saved by method:
-            save_observation_usage.
+            it. New observations are bulk created. Re-used observations get
+            the processing job attached with attach_processing_job, or are
+            saved one by one if no processing job is given.
 
         """
         Observation.objects.bulk_create(
             [v['observation'] for v in observations.itervalues() if v['created']]
         )
 
-        for v in observations.itervalues():
-            if not v['created']:
-                v['observation'].save()
+        reused = [
+            v['observation'] for v in observations.itervalues()
+            if not v['created']
+        ]
+        if processing_job is None:
+            for observation in reused:
+                observation.save()
+        elif reused:
+            self.attach_processing_job(
+                [o.pk for o in reused],
+                processing_job
+            )
+
+    def attach_processing_job(self, observation_ids, processing_job):
+        """
+        Appends processing job and environment to existing observations.
+
+        Description:
+            One UPDATE for all given observations, which only touches the
+            processing_jobs and processing_environments columns.
+        Returns:
+            Number of updated observations.
+        """
+        cursor = connection.cursor()
+        cursor.execute("""
+            UPDATE {obs} o SET {append_job_sql}
+            FROM unnest(%(ids)s::integer[]) AS s(id)
+            WHERE o.id = s.id
+        """.format(
+            obs=Observation._meta.db_table,
+            append_job_sql=self.append_job_sql
+        ), {
+            'ids': list(observation_ids),
+            'job': str(processing_job.uuid),
+            'env': self.make_env_hash(processing_job),
+        })
+        return cursor.rowcount
+
+    def create_staging_tables(self, cursor):
+        """
+        Creates temporary staging tables for the copy mode.
+
+        Description:
+            The tables are dropped automatically when the transaction of the
+            import ends.
+        """
+        lookup_cols = ', '.join(
+            '{0} text'.format(c) for c, m, f in self.lookup_models
+        )
+        cursor.execute("""
+            CREATE TEMPORARY TABLE {staging} (
+                {lookup_cols},
+                orig_srid integer,
+                origx double precision,
+                origy double precision,
+                value double precision,
+                date timestamp,
+                concatenated_data text,
+                identity uuid
+            ) ON COMMIT DROP
+        """.format(staging=self.staging_table, lookup_cols=lookup_cols))
+
+    def chunk_to_copy_buffer(self, dictified_chunks):
+        """
+        Writes dictified chunks as CSV to a buffer, in staging_columns order.
+
+        Description:
+            concatenated_data and identity are calculated here, with the same
+            methods as the orm mode, so both modes recognize each others
+            observations.
+            NaN values in lookup columns become SQL NULLs.
+
+        Returns:
+            StringIO object, positioned at the start.
+        """
+        buf = StringIO()
+        writer = csv.writer(buf)
+        lookup_cols = [c for c, m, f in self.lookup_models]
+        for dc in dictified_chunks:
+            row = []
+            for col in lookup_cols:
+                value = dc[col]
+                if type(value) == float and math.isnan(value):
+                    value = None
+                elif isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                row.append(value)
+            row += [dc['orig_srid'], dc['origx'], dc['origy'], dc['value'],
+                    dc['date']]
+            concatenated_data = self.concatenate_row(dc)
+            row += [
+                concatenated_data,
+                Observation.make_identity(concatenated_data)
+            ]
+            writer.writerow(row)
+        buf.seek(0)
+        return buf
+
+    def flush_copy_buffer(self, cursor, buf):
+        """
+        Streams buffer into the staging table with COPY FROM STDIN.
+
+        Description:
+            Same approach as flushCopyBuffer in datamodel/scripts/pointworker.py
+            but within the transaction of this command.
+        """
+        cursor.copy_expert(
+            'COPY {0} ({1}) FROM STDIN WITH CSV'.format(
+                self.staging_table,
+                ', '.join(self.staging_columns)
+            ),
+            buf
+        )
+        buf.close()
+
+    @staticmethod
+    def lookup_table_sql(model):
+        """
+        SQL for a lookup table with one id per lowercased description.
+
+        Description:
+            Same rule as VocabularyIndex: the descriptions are compared
+            lowercased, the first object (lowest id) wins.
+        """
+        return '(SELECT lower(description) AS description, min(id) AS id ' \
+               'FROM {0} GROUP BY lower(description))'.format(
+                   model._meta.db_table)
+
+    def validate_staged_relations(self, cursor):
+        """
+        Checks if all lookup values in the staging table exist.
+
+        Description:
+            Same check (and error message) as create_observation does per row,
+            but for the whole file at once.
+        Raises:
+            ObjectDoesNotExist with a human readable error message.
+        """
+        errors = []
+        for col, model, field in self.lookup_models:
+            cursor.execute("""
+                SELECT DISTINCT s.{col}
+                FROM {staging} s
+                LEFT OUTER JOIN {lookup} l ON l.description = lower(s.{col})
+                WHERE s.{col} IS NOT NULL AND l.id IS NULL
+                ORDER BY s.{col}
+            """.format(
+                col=col,
+                staging=self.staging_table,
+                lookup=self.lookup_table_sql(model)
+            ))
+            for (value,) in cursor.fetchall():
+                errors.append('{0} "{1}" does not exist.'.format(
+                    model.__name__,
+                    value
+                ))
+        if errors:
+            errors = ['CSV file contains values which are not correct:'] \
+                + errors
+            raise ObjectDoesNotExist('\n'.join(errors))
+
+    def copy_location_points(self, cursor):
+        """
+        Resolves the distinct staged points to LocationPoints.
+
+        Description:
+            The distinct points of the staging table are resolved with the
+            LocationResolver (one spatial query for the whole file, clustering
+            of new points). The result is copied into the points staging table,
+            which relates staged rows to their LocationPoint.
+        Returns:
+            tuple with number of (new, re-used) LocationPoints.
+        """
+        cursor.execute("""
+            SELECT DISTINCT origx, origy, orig_srid FROM {staging}
+        """.format(staging=self.staging_table))
+        points = self.locations.resolve(cursor.fetchall())
+        cursor.execute("""
+            CREATE TEMPORARY TABLE {points} (
+                origx double precision,
+                origy double precision,
+                orig_srid integer,
+                location_id integer
+            ) ON COMMIT DROP
+        """.format(points=self.staging_points_table))
+        buf = StringIO()
+        writer = csv.writer(buf)
+        for key, lp in points.iteritems():
+            writer.writerow(list(key) + [lp.id])
+        buf.seek(0)
+        cursor.copy_expert(
+            'COPY {0} (origx, origy, orig_srid, location_id) '
+            'FROM STDIN WITH CSV'.format(self.staging_points_table),
+            buf
+        )
+        return len(self.locations.created_ids), self.locations.reused
+
+    def merge_staged_observations(self, cursor, published, processing_job):
+        """
+        Merges staged rows into the observation table.
+
+        Description:
+            Observations which already exist (same identity) get the
+            processing job and environment appended, like create_observation
+            does. All other observations are inserted, once per identity.
+        Returns:
+            tuple with number of (new, re-used) Observations.
+        """
+        obs_table = Observation._meta.db_table
+        params = {
+            'job': str(processing_job.uuid),
+            'env': self.make_env_hash(processing_job),
+            'published': published,
+            'tz': settings.TIME_ZONE,
+        }
+        cursor.execute("""
+            UPDATE {obs} o SET {append_job_sql}
+            FROM (SELECT DISTINCT identity FROM {staging}) s
+            WHERE o.identity = s.identity
+        """.format(
+            obs=obs_table,
+            staging=self.staging_table,
+            append_job_sql=self.append_job_sql
+        ), params)
+        reused = cursor.rowcount
+
+        # Naive dates are interpreted in the default time zone, like Django
+        # does when saving naive datetimes with USE_TZ enabled.
+        date_sql = 's.date AT TIME ZONE %(tz)s' if settings.USE_TZ \
+            else 's.date'
+        lookup_fields = ', '.join(
+            '{0}_id'.format(f) for c, m, f in self.lookup_models
+        )
+        lookup_ids = ', '.join(
+            '{0}.id'.format(c) for c, m, f in self.lookup_models
+        )
+        lookup_joins = '\n'.join(
+            'LEFT OUTER JOIN {lookup} {col} '
+            'ON {col}.description = lower(s.{col})'.format(
+                lookup=self.lookup_table_sql(m), col=c
+            ) for c, m, f in self.lookup_models
+        )
+        cursor.execute("""
+            INSERT INTO {obs} (
+                date, value, remark, station, location_id, {lookup_fields},
+                published, concatenated_data, identity, processing_jobs,
+                processing_environments
+            )
+            SELECT DISTINCT ON (s.identity)
+                {date_sql}, s.value, '', '', p.location_id, {lookup_ids},
+                %(published)s, s.concatenated_data, s.identity,
+                ARRAY[%(job)s]::text[],
+                ARRAY[%(env)s]::text[]
+            FROM {staging} s
+            JOIN {points} p ON (
+                p.orig_srid = s.orig_srid
+                AND p.origx = s.origx
+                AND p.origy = s.origy
+            )
+            {lookup_joins}
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {obs} o
+                WHERE o.identity = s.identity
+            )
+            ORDER BY s.identity
+        """.format(
+            obs=obs_table,
+            staging=self.staging_table,
+            points=self.staging_points_table,
+            date_sql=date_sql,
+            lookup_fields=lookup_fields,
+            lookup_ids=lookup_ids,
+            lookup_joins=lookup_joins
+        ), params)
+        return cursor.rowcount, reused
+
+    def copy_to_db(self, csv_input, published, processing_job):
+        """
+        Imports a CSV file with COPY and set based SQL (--mode=copy).
+
+        Description:
+            The CSV is read in chunks, which are streamed into a staging table
+            with COPY FROM STDIN. When the whole file is staged, lookup values
+            are validated, LocationPoints are resolved and observations are
+            merged into the observation table. Should be called within a
+            transaction, the staging tables are dropped on commit.
+        """
+        cursor = connection.cursor()
+        self.create_staging_tables(cursor)
+        reader = pandas.read_csv(
+            csv_input,
+            chunksize=self.copy_chunksize,
+            parse_dates=['date']
+        )
+        rows = 0
+        for chunkno, chunk in enumerate(reader):
+            if not chunkno:
+                self.validate_column_names(chunk.dtypes.index)
+
+            self.stdout.write('Staging chunk {0}'.format(chunkno))
+            dictified_chunks = self.chunk_to_dict(chunk)
+            self.flush_copy_buffer(
+                cursor,
+                self.chunk_to_copy_buffer(dictified_chunks)
+            )
+            rows += len(dictified_chunks)
+            reset_queries()
+
+        self.stdout.write('Staged {0} rows, validating.'.format(rows))
+        self.validate_staged_relations(cursor)
+
+        new_lps, reused_lps = self.copy_location_points(cursor)
+        self.stdout.write(
+            'Writing {0} new LocationPoint objects to database.'.format(new_lps)
+        )
+        self.stdout.write(
+            'Re-using {0} LocationPoint objects.'.format(reused_lps)
+        )
+        new_obs, reused_obs = self.merge_staged_observations(
+            cursor, published, processing_job
+        )
+        self.stdout.write(
+            'Writing {0} Observation objects to database.'.format(new_obs)
+        )
+        self.stdout.write(
+            'Re-using {0} Observation objects.'.format(reused_obs)
+        )
+
+    def rows_to_db(self, csv_input, published, processing_job):
+        """
+        Imports a CSV file in chunks, through the ORM (--mode=orm).
+        """
+        reader = pandas.read_csv(
+            csv_input,
+            chunksize=100,
+            parse_dates=['date']
+        )
+        chunkno = 0
+        with transaction.atomic():
+            for chunk in reader:
+                if not chunkno:
+                    self.validate_column_names(chunk.dtypes.index)
+                    self.validate_relations(csv_input)
+
+                self.stdout.write('Chunk {0}'.format(chunkno))
+                dictified_chunks = self.chunk_to_dict(chunk)
+                self.chunk_to_db(
+                    dictified_chunks,
+                    published,
+                    processing_job
+                )
+                chunkno += 1
+                # Reset query log, which is recorded in debug mode.
+                # This causes a massive memory leak:
+                # 125k lines csv > 1000MB memory
+                reset_queries()
 
     def handle(self, *args, **options):
         if not options['csv_input']:
@@ -472,30 +1262,35 @@ class Command(BaseCommand):
                 )
 
         processing_job = ProcessingJob.objects.get(uuid=options['processing_job'])
-        # Remove old observations from same environment + script.
-        self.remove_or_deref_observations(processing_job)
-        logger.info("Importing {0}".format(options['csv_input']))
-        reader = pandas.read_csv(
+        self.ingest(
             options['csv_input'],
-            chunksize=100,
-            parse_dates=['date']
+            processing_job,
+            published=options['published'],
+            mode=options.get('mode')
         )
-        chunkno = 0
-        with transaction.atomic():
-            for chunk in reader:
-                if not chunkno:
-                    self.validate_column_names(chunk.dtypes.index)
 
-                self.stdout.write('Chunk {0}'.format(chunkno))
-                dictified_chunks = self.chunk_to_dict(chunk)
-                self.chunk_to_db(
-                    dictified_chunks,
-                    options['published'],
-                    # options['processing_job']
-                    processing_job
-                )
-                chunkno += 1
-                # Reset query log, which is recorded in debug mode.
-                # This causes a massive memory leak:
-                # 125k lines csv > 1000MB memory
-                reset_queries()
+    def ingest(self, csv_input, processing_job, published=False, mode='orm'):
+        """
+        Imports a validated CSV file for processing_job.
+
+        Description:
+            Used by handle and ingest_csv. Removes observations of earlier runs
+            of the same environment and script first.
+        """
+        # Remove old observations from same environment + script.
+        self.remove_or_deref_observations(processing_job)
+        logger.info("Importing {0}".format(csv_input))
+        self._vocabulary = VocabularyIndex()
+        self._locations = LocationResolver(self.point_tolerance)
+        if mode == 'copy':
+            with transaction.atomic():
+                self.copy_to_db(csv_input, published, processing_job)
+        else:
+            self.rows_to_db(csv_input, published, processing_job)
+
+        stats = self.vocabulary.stats()
+        logger.info(stats)
+        self.stdout.write(stats)
+        stats = self.locations.stats()
+        logger.info(stats)
+        self.stdout.write(stats)
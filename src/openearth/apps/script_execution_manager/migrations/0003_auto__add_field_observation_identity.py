@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+    """
+    Replaces the unique index on Observation.concatenated_data by a unique
+    index on Observation.identity, the md5 digest of concatenated_data stored
+    as uuid (16 bytes).
+
+    The field is added with the PostgreSQLUUIDField itself: South freezes it
+    as a CharField, which would create a varchar(36) column.
+    """
+
+    def forwards(self, orm):
+        # Adding field 'Observation.identity'
+        db.add_column(u'script_execution_manager_observation', 'identity',
+                      self.gf('django_extensions.db.fields.PostgreSQLUUIDField')(auto=False, null=True),
+                      keep_default=False)
+
+        # Backfill existing observations. Must equal Observation.make_identity.
+        db.execute("""
+            UPDATE script_execution_manager_observation
+            SET identity = md5(concatenated_data)::uuid
+        """)
+        db.execute("""
+            ALTER TABLE script_execution_manager_observation
+            ALTER COLUMN identity SET NOT NULL
+        """)
+
+        # Adding unique constraint on 'Observation', fields ['identity']
+        db.create_unique(u'script_execution_manager_observation', ['identity'])
+
+        # Removing unique constraint on 'Observation', fields ['concatenated_data']
+        db.delete_unique(u'script_execution_manager_observation', ['concatenated_data'])
+
+
+    def backwards(self, orm):
+        # Adding unique constraint on 'Observation', fields ['concatenated_data']
+        db.create_unique(u'script_execution_manager_observation', ['concatenated_data'])
+
+        # Removing unique constraint on 'Observation', fields ['identity']
+        db.delete_unique(u'script_execution_manager_observation', ['identity'])
+
+        # Deleting field 'Observation.identity'
+        db.delete_column(u'script_execution_manager_observation', 'identity')
+
+
+    models = {
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'script_execution_manager.compartment': {
+            'Meta': {'object_name': 'Compartment'},
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '12'}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '60', 'db_index': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'number': ('django.db.models.fields.CharField', [], {'max_length': '12'})
+        },
+        u'script_execution_manager.group': {
+            'Meta': {'object_name': 'Group'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'script_execution_manager.locationpoint': {
+            'Meta': {'object_name': 'LocationPoint'},
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'orig_srid': ('django.db.models.fields.IntegerField', [], {}),
+            'origx': ('django.db.models.fields.FloatField', [], {}),
+            'origy': ('django.db.models.fields.FloatField', [], {}),
+            'published': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'thegeometry': ('django.contrib.gis.db.models.fields.GeometryField', [], {})
+        },
+        u'script_execution_manager.measurementmethod': {
+            'Meta': {'object_name': 'MeasurementMethod'},
+            'classification': ('django.db.models.fields.TextField', [], {}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'link': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        u'script_execution_manager.observation': {
+            'Meta': {'object_name': 'Observation'},
+            'compartment': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Compartment']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'concatenated_data': ('django.db.models.fields.TextField', [], {}),
+            'date': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'identity': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '36'}),
+            'location': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.LocationPoint']", 'on_delete': 'models.DO_NOTHING'}),
+            'measurement_method': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.MeasurementMethod']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'organ': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Organ']", 'null': 'True', 'blank': 'True'}),
+            'parameter': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Parameter']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'processing_environments': ('djorm_pgarray.fields.TextArrayField', [], {'default': 'None', 'dbtype': "'text'", 'null': 'True', 'blank': 'True'}),
+            'processing_jobs': ('djorm_pgarray.fields.TextArrayField', [], {'default': 'None', 'dbtype': "'text'", 'null': 'True', 'blank': 'True'}),
+            'property': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Property']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'published': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'quality': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Quality']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'remark': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'sample_device': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.SampleDevice']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'sample_method': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.SampleMethod']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'station': ('django.db.models.fields.CharField', [], {'max_length': '75', 'blank': 'True'}),
+            'unit': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Unit']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'value': ('django.db.models.fields.FloatField', [], {})
+        },
+        u'script_execution_manager.organ': {
+            'Meta': {'object_name': 'Organ'},
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '12'}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '60', 'db_index': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'script_execution_manager.parameter': {
+            'Meta': {'object_name': 'Parameter'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '255', 'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'reference_id': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        u'script_execution_manager.property': {
+            'Meta': {'object_name': 'Property'},
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '12', 'blank': 'True'}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '255', 'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'reference': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        u'script_execution_manager.quality': {
+            'Meta': {'object_name': 'Quality'},
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '12'}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '60', 'db_index': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'script_execution_manager.referencetablewormsparameter': {
+            'Meta': {'object_name': 'ReferenceTableWormsParameter'},
+            'reference_id': ('django.db.models.fields.PositiveIntegerField', [], {'unique': 'True', 'primary_key': 'True'})
+        },
+        u'script_execution_manager.sampledevice': {
+            'Meta': {'object_name': 'SampleDevice'},
+            'code': ('django.db.models.fields.IntegerField', [], {}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'db_index': 'True', 'max_length': '255', 'blank': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'link': ('django.db.models.fields.TextField', [], {}),
+            'spatial_reference_device': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.SpatialReferenceDevice']", 'null': 'True', 'blank': 'True'})
+        },
+        u'script_execution_manager.samplemethod': {
+            'Meta': {'object_name': 'SampleMethod'},
+            'classification': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '12'}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'link': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'reference': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        u'script_execution_manager.spatialreferencedevice': {
+            'Meta': {'object_name': 'SpatialReferenceDevice'},
+            'code': ('django.db.models.fields.IntegerField', [], {}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'db_index': 'True', 'max_length': '255', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'script_execution_manager.unit': {
+            'Meta': {'object_name': 'Unit'},
+            'alias': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '12'}),
+            'conversion_factor': ('django.db.models.fields.CharField', [], {'max_length': '12', 'blank': 'True'}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'dimension': ('django.db.models.fields.CharField', [], {'max_length': '12', 'blank': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'link': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['script_execution_manager']
\ No newline at end of file
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'ContainerPool'
+        db.create_table(u'script_execution_manager_containerpool', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('image', self.gf('django.db.models.fields.CharField')(unique=True, max_length=255)),
+            ('size', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('hits', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('misses', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('ready_count', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('ready_seconds', self.gf('django.db.models.fields.FloatField')(default=0)),
+        ))
+        db.send_create_signal(u'script_execution_manager', ['ContainerPool'])
+
+        # Adding model 'WarmContainer'
+        db.create_table(u'script_execution_manager_warmcontainer', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('pool', self.gf('django.db.models.fields.related.ForeignKey')(related_name='containers', to=orm['script_execution_manager.ContainerPool'])),
+            ('uuid', self.gf('django.db.models.fields.CharField')(unique=True, max_length=36)),
+            ('host', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('state', self.gf('django.db.models.fields.CharField')(default='BOOTING', max_length=10, db_index=True)),
+            ('ip_address', self.gf('django.db.models.fields.GenericIPAddressField')(max_length=39, null=True, blank=True)),
+            ('created', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('ready_at', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True)),
+            ('job', self.gf('django.db.models.fields.CharField')(db_index=True, max_length=36, blank=True)),
+        ))
+        db.send_create_signal(u'script_execution_manager', ['WarmContainer'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'WarmContainer'
+        db.delete_table(u'script_execution_manager_warmcontainer')
+
+        # Deleting model 'ContainerPool'
+        db.delete_table(u'script_execution_manager_containerpool')
+
+
+    models = {
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'script_execution_manager.compartment': {
+            'Meta': {'object_name': 'Compartment'},
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '12'}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '60', 'db_index': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'number': ('django.db.models.fields.CharField', [], {'max_length': '12'})
+        },
+        u'script_execution_manager.containerpool': {
+            'Meta': {'object_name': 'ContainerPool'},
+            'hits': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'misses': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'ready_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'ready_seconds': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            'size': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        u'script_execution_manager.group': {
+            'Meta': {'object_name': 'Group'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'script_execution_manager.locationpoint': {
+            'Meta': {'object_name': 'LocationPoint'},
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'orig_srid': ('django.db.models.fields.IntegerField', [], {}),
+            'origx': ('django.db.models.fields.FloatField', [], {}),
+            'origy': ('django.db.models.fields.FloatField', [], {}),
+            'published': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'thegeometry': ('django.contrib.gis.db.models.fields.GeometryField', [], {})
+        },
+        u'script_execution_manager.measurementmethod': {
+            'Meta': {'object_name': 'MeasurementMethod'},
+            'classification': ('django.db.models.fields.TextField', [], {}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'link': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        u'script_execution_manager.observation': {
+            'Meta': {'object_name': 'Observation'},
+            'compartment': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Compartment']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'concatenated_data': ('django.db.models.fields.TextField', [], {}),
+            'date': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'identity': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '36'}),
+            'location': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.LocationPoint']", 'on_delete': 'models.DO_NOTHING'}),
+            'measurement_method': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.MeasurementMethod']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'organ': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Organ']", 'null': 'True', 'blank': 'True'}),
+            'parameter': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Parameter']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'processing_environments': ('djorm_pgarray.fields.TextArrayField', [], {'default': 'None', 'dbtype': "'text'", 'null': 'True', 'blank': 'True'}),
+            'processing_jobs': ('djorm_pgarray.fields.TextArrayField', [], {'default': 'None', 'dbtype': "'text'", 'null': 'True', 'blank': 'True'}),
+            'property': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Property']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'published': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'quality': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Quality']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'remark': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'sample_device': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.SampleDevice']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'sample_method': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.SampleMethod']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'station': ('django.db.models.fields.CharField', [], {'max_length': '75', 'blank': 'True'}),
+            'unit': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Unit']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            'value': ('django.db.models.fields.FloatField', [], {})
+        },
+        u'script_execution_manager.organ': {
+            'Meta': {'object_name': 'Organ'},
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '12'}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '60', 'db_index': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'script_execution_manager.parameter': {
+            'Meta': {'object_name': 'Parameter'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '255', 'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'reference_id': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        u'script_execution_manager.property': {
+            'Meta': {'object_name': 'Property'},
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '12', 'blank': 'True'}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '255', 'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'reference': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        u'script_execution_manager.quality': {
+            'Meta': {'object_name': 'Quality'},
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '12'}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '60', 'db_index': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'script_execution_manager.referencetablewormsparameter': {
+            'Meta': {'object_name': 'ReferenceTableWormsParameter'},
+            'reference_id': ('django.db.models.fields.PositiveIntegerField', [], {'unique': 'True', 'primary_key': 'True'})
+        },
+        u'script_execution_manager.sampledevice': {
+            'Meta': {'object_name': 'SampleDevice'},
+            'code': ('django.db.models.fields.IntegerField', [], {}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'db_index': 'True', 'max_length': '255', 'blank': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'link': ('django.db.models.fields.TextField', [], {}),
+            'spatial_reference_device': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.SpatialReferenceDevice']", 'null': 'True', 'blank': 'True'})
+        },
+        u'script_execution_manager.samplemethod': {
+            'Meta': {'object_name': 'SampleMethod'},
+            'classification': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '12'}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'link': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'reference': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        u'script_execution_manager.spatialreferencedevice': {
+            'Meta': {'object_name': 'SpatialReferenceDevice'},
+            'code': ('django.db.models.fields.IntegerField', [], {}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'db_index': 'True', 'max_length': '255', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'script_execution_manager.unit': {
+            'Meta': {'object_name': 'Unit'},
+            'alias': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '12'}),
+            'conversion_factor': ('django.db.models.fields.CharField', [], {'max_length': '12', 'blank': 'True'}),
+            'description': ('openearth.apps.script_execution_manager.models.LowerCaseCharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'dimension': ('django.db.models.fields.CharField', [], {'max_length': '12', 'blank': 'True'}),
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['script_execution_manager.Group']", 'null': 'True', 'on_delete': 'models.DO_NOTHING', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'link': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'})
+        },
+        u'script_execution_manager.warmcontainer': {
+            'Meta': {'object_name': 'WarmContainer'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'host': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.GenericIPAddressField', [], {'max_length': '39', 'null': 'True', 'blank': 'True'}),
+            'job': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '36', 'blank': 'True'}),
+            'pool': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'containers'", 'to': u"orm['script_execution_manager.ContainerPool']"}),
+            'ready_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'state': ('django.db.models.fields.CharField', [], {'default': "'BOOTING'", 'max_length': '10', 'db_index': 'True'}),
+            'uuid': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '36'})
+        }
+    }
+
+    complete_apps = ['script_execution_manager']
\ No newline at end of file
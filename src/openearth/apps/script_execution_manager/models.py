@@ -3,8 +3,11 @@ from django.contrib.contenttypes.generic import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.db import models as gis_models
 from django.db import models
+from django_extensions.db.fields import PostgreSQLUUIDField
 from south.modelsinspector import add_introspection_rules
 from djorm_pgarray.fields import TextArrayField
+import hashlib
+import uuid
 
 
 class LowerCaseCharField(models.CharField):
@@ -36,6 +39,50 @@ class Compartment(models.Model):
         return self.description
 
 
+class ContainerPool(models.Model):
+    """
+    Warm pool of booted, SSH ready containers for one libvirt image.
+
+    Description:
+        Every worker host keeps `size` containers of the image ready, which
+        run_script takes instead of booting a new container. Hits, misses
+        and the boot time are kept for the admin.
+    """
+    image = models.CharField(
+        max_length=255,
+        unique=True,
+        help_text='libvirt_image of the ProcessingJobImage'
+    )
+    size = models.PositiveIntegerField(
+        default=0,
+        help_text='Number of ready containers to keep per host. 0 disables '
+                  'the pool.'
+    )
+    hits = models.PositiveIntegerField(default=0, editable=False)
+    misses = models.PositiveIntegerField(default=0, editable=False)
+    ready_count = models.PositiveIntegerField(default=0, editable=False)
+    ready_seconds = models.FloatField(default=0, editable=False)
+
+    def available(self):
+        return self.containers.filter(state=WarmContainer.READY).count()
+
+    def hit_rate(self):
+        if not self.hits + self.misses:
+            return None
+        return float(self.hits) / (self.hits + self.misses)
+
+    def time_to_ready(self):
+        """
+        Average seconds from boot until a container is ready.
+        """
+        if not self.ready_count:
+            return None
+        return self.ready_seconds / self.ready_count
+
+    def __unicode__(self):
+        return self.image
+
+
 class Group(models.Model):
     """
     Full description of the group
@@ -83,10 +130,31 @@ class MeasurementMethod(models.Model):
         return self.description
 
 
+class ObservationManager(models.Manager):
+    def identified_by(self, concatenated_data):
+        """
+        Observations which match any of the given concatenated data strings.
+
+        Description:
+            Looks up the identities of all strings in one query
+            (identity = ANY(...)), instead of one query per string.
+        """
+        identities = [Observation.make_identity(c) for c in concatenated_data]
+        return super(ObservationManager, self).get_queryset().extra(
+            where=['{0}.identity = ANY(%s::uuid[])'.format(
+                self.model._meta.db_table
+            )],
+            params=[identities]
+        )
+
+
 class Observation(models.Model):
     """
     Observation table. Observations should be unique. ProcessingJobs which
     process observations are stored in the processing_jobs array field.
+
+    Uniqueness is enforced on identity, a 128 bit digest of
+    concatenated_data, which keeps the index small and of fixed width.
     """
     date = models.DateTimeField(db_index=True)  # timestamp without time zone
     value = models.FloatField()  # double precision NOT NULL,
@@ -103,10 +171,31 @@ class Observation(models.Model):
     sample_method = models.ForeignKey('SampleMethod', blank=True, null=True,  on_delete=models.DO_NOTHING)
     measurement_method = models.ForeignKey('MeasurementMethod', blank=True, null=True, on_delete=models.DO_NOTHING)
     published = models.BooleanField(default=False)  # used to be blstatus. TODO: Remove
-    concatenated_data = models.TextField(db_index=True, unique=True)
+    concatenated_data = models.TextField()
+    identity = PostgreSQLUUIDField(auto=False, unique=True, editable=False)
     processing_jobs = TextArrayField()
     processing_environments = TextArrayField()
 
+    objects = ObservationManager()
+
+    @staticmethod
+    def make_identity(concatenated_data):
+        """
+        Returns the identity (md5 digest as uuid string) of concatenated_data.
+
+        Description:
+            Equal to md5(concatenated_data)::uuid in PostgreSQL, which is used
+            to backfill existing observations.
+        """
+        if isinstance(concatenated_data, unicode):
+            concatenated_data = concatenated_data.encode('utf-8')
+        return str(uuid.UUID(hashlib.md5(concatenated_data).hexdigest()))
+
+    def save(self, *args, **kwargs):
+        if not self.identity:
+            self.identity = self.make_identity(self.concatenated_data)
+        super(Observation, self).save(*args, **kwargs)
+
     def __unicode__(self):
         return '{0} - ({1}..{2})'.format(
             self.pk,
@@ -302,3 +391,39 @@ class Unit(models.Model):
 
     def __unicode__(self):
         return self.description
+
+
+class WarmContainer(models.Model):
+    """
+    Container of a ContainerPool.
+
+    Description:
+        uuid is the uuid of the libvirt domain (instance-<uuid>). When a job
+        takes the container, job holds the uuid of the ProcessingJob.
+    """
+    BOOTING = 'BOOTING'
+    READY = 'READY'
+    LEASED = 'LEASED'
+    FAILED = 'FAILED'
+    STATES = (
+        (BOOTING, 'Booting'),
+        (READY, 'Ready'),
+        (LEASED, 'Leased'),
+        (FAILED, 'Failed'),
+    )
+    pool = models.ForeignKey('ContainerPool', related_name='containers')
+    uuid = models.CharField(max_length=36, unique=True)
+    host = models.CharField(max_length=255)
+    state = models.CharField(
+        max_length=10,
+        choices=STATES,
+        default=BOOTING,
+        db_index=True
+    )
+    ip_address = models.GenericIPAddressField(blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    ready_at = models.DateTimeField(blank=True, null=True)
+    job = models.CharField(max_length=36, blank=True, db_index=True)
+
+    def __unicode__(self):
+        return 'instance-{0}'.format(self.uuid)
@@ -0,0 +1,250 @@
+"""
+Warm pool of pre-booted containers, per ProcessingJobImage.libvirt_image.
+
+Description:
+    A pool keeps ContainerPool.size containers of an image booted and SSH
+    ready on every worker host. run_script takes one with acquire_container
+    and hand_over, replenish_pool (see tasks.py) boots new ones in the
+    background. cleanup finds the domain of a job with release_container.
+
+    Pools are kept per host, so replenish_pool is sent to the queue of the
+    host which needs the containers (see get_host_queue); every worker
+    consumes the queue of its host.
+"""
+from __future__ import unicode_literals
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from datetime import timedelta
+import os
+import socket
+import time
+from uuid import uuid4
+
+from .container import LibVirtDomain
+from .models import ContainerPool, WarmContainer
+from .readiness import wait_until_ready
+
+logger = get_task_logger(__name__)
+
+HOST_QUEUE_PREFIX = 'host-'
+
+
+def get_host():
+    return socket.gethostname()
+
+
+def get_host_queue(host=None):
+    """
+    Returns the Celery queue of host, default this host.
+    """
+    return HOST_QUEUE_PREFIX + (host or get_host())
+
+
+def get_pool(image):
+    """
+    Returns the enabled ContainerPool of image, or None.
+    """
+    return ContainerPool.objects.filter(image=image, size__gt=0).first()
+
+
+def boot_container(pool):
+    """
+    Boots one container for pool and marks it ready.
+
+    Description:
+        The time from boot until the container is ready is added to the
+        pool's statistics. A container which fails to boot is destroyed and
+        marked failed.
+
+    Returns:
+        The WarmContainer.
+    """
+    container = WarmContainer.objects.create(
+        pool=pool,
+        uuid=str(uuid4()),
+        host=get_host()
+    )
+    lv = LibVirtDomain(uuid=container.uuid, image=pool.image)
+    start = time.time()
+    try:
+        lv.create()
+        ip = wait_until_ready(lv)[0]
+    except Exception, e:
+        logger.error('Booting pool container {0} failed: {1}'.format(
+            container, e
+        ))
+        container.state = WarmContainer.FAILED
+        container.save()
+        destroy_container(container)
+        raise
+
+    ready_seconds = time.time() - start
+    container.ip_address = ip
+    container.state = WarmContainer.READY
+    container.ready_at = timezone.now()
+    container.save()
+    ContainerPool.objects.filter(pk=pool.pk).update(
+        ready_count=F('ready_count') + 1,
+        ready_seconds=F('ready_seconds') + ready_seconds
+    )
+    logger.info('Pool container {0} ready in {1:.1f}s'.format(
+        container, ready_seconds
+    ))
+    return container
+
+
+def replenish(pool):
+    """
+    Boots containers until pool has pool.size booting or ready containers
+    on this host.
+
+    Description:
+        Containers which are booting for longer than
+        settings.CONTAINER['pool_boot_timeout'] seconds were left by a worker
+        which died; they are destroyed and do not count.
+
+    Returns:
+        Number of booted containers.
+    """
+    stale = timezone.now() - timedelta(
+        seconds=settings.CONTAINER.get('pool_boot_timeout', 600))
+    for container in pool.containers.filter(host=get_host(),
+                                            state=WarmContainer.BOOTING,
+                                            created__lt=stale):
+        logger.warn('Pool container {0} did not boot, destroying it'.format(
+            container))
+        destroy_container(container)
+    present = pool.containers.filter(
+        host=get_host(),
+        state__in=(WarmContainer.BOOTING, WarmContainer.READY)
+    ).count()
+    missing = max(pool.size - present, 0)
+    for i in range(missing):
+        boot_container(pool)
+    return missing
+
+
+def trim(pool):
+    """
+    Destroys ready containers of pool on this host beyond pool.size.
+
+    Description:
+        The containers are marked failed first, so they can not be acquired
+        while they are destroyed.
+
+    Returns:
+        Number of destroyed containers.
+    """
+    containers = pool.containers.filter(
+        host=get_host(),
+        state__in=(WarmContainer.BOOTING, WarmContainer.READY)
+    )
+    with transaction.atomic():
+        excess = max(containers.count() - pool.size, 0)
+        surplus = list(containers.select_for_update().filter(
+            state=WarmContainer.READY
+        ).order_by('ready_at')[:excess])
+        WarmContainer.objects.filter(
+            pk__in=[c.pk for c in surplus]
+        ).update(state=WarmContainer.FAILED)
+    for container in surplus:
+        destroy_container(container)
+    return len(surplus)
+
+
+def acquire_container(image, job_uuid):
+    """
+    Leases a ready container of image on this host to job_uuid.
+
+    Returns:
+        WarmContainer, or None if the image has no pool or no container is
+        ready. Both count as hit or miss of the pool.
+    """
+    pool = get_pool(image)
+    if pool is None:
+        return None
+
+    with transaction.atomic():
+        container = pool.containers.select_for_update().filter(
+            host=get_host(),
+            state=WarmContainer.READY
+        ).order_by('ready_at').first()
+        if container:
+            container.state = WarmContainer.LEASED
+            container.job = str(job_uuid)
+            container.save()
+
+    if container:
+        ContainerPool.objects.filter(pk=pool.pk).update(hits=F('hits') + 1)
+    else:
+        ContainerPool.objects.filter(pk=pool.pk).update(
+            misses=F('misses') + 1
+        )
+    return container
+
+
+def hand_over(container, job_uuid, external_logger=None):
+    """
+    Makes a leased container look like it was created for job_uuid.
+
+    Description:
+        The container writes its results in results-<container uuid>. That
+        directory is renamed to results-<job uuid>, the bind mount in the
+        container follows the rename. Files which are already in the results
+        directory of the job (run.log) are moved into it first; open files
+        stay open.
+
+    Returns:
+        LibVirtDomain of the container.
+    """
+    lv = LibVirtDomain(
+        uuid=container.uuid,
+        image=container.pool.image,
+        external_logger=external_logger
+    )
+    job_results_dir = os.path.join(
+        settings.CONTAINER['base_dir'],
+        'results-{0}'.format(job_uuid)
+    )
+    if os.path.isdir(job_results_dir):
+        for filename in os.listdir(job_results_dir):
+            os.rename(
+                os.path.join(job_results_dir, filename),
+                os.path.join(lv.results_dir, filename)
+            )
+        os.rmdir(job_results_dir)
+    os.rename(lv.results_dir, job_results_dir)
+    lv.results_dir = job_results_dir
+    return lv
+
+
+def release_container(job_uuid):
+    """
+    Forgets the container which was leased to job_uuid.
+
+    Returns:
+        uuid of the container's domain, or None if the job did not use a
+        pool container.
+    """
+    container = WarmContainer.objects.filter(job=str(job_uuid)).first()
+    if container is None:
+        return None
+    container.delete()
+    return container.uuid
+
+
+def destroy_container(container):
+    """
+    Destroys the domain of a (failed) container and forgets it.
+    """
+    lv = LibVirtDomain(uuid=container.uuid, image=container.pool.image)
+    try:
+        lv.destroy()
+    except Exception, e:
+        logger.warn('Cannot destroy pool container {0}: {1}'.format(
+            container, e
+        ))
+    container.delete()
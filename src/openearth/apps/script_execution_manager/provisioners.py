@@ -0,0 +1,364 @@
+"""
+Provisioners of instance images for LibVirt lxc containers.
+
+Description:
+    A provisioner creates the root filesystem of a container instance from a
+    (read only) base image. The cheapest backend which works for the image and
+    host is used, the sparse copy is the fallback which always works.
+
+    reflink: clone of the image file, on filesystems which support it (btrfs,
+        xfs). Shares all data blocks with the base image.
+    qcow2: qcow2 overlay file with the raw base image as backing file.
+        Requires qemu-img and the nbd filesystem driver of libvirt lxc.
+    lvm-thin: thin snapshot of a logical volume with the name of the image,
+        in volume group settings.CONTAINER['lvm_volume_group'].
+    overlay: overlayfs mount with the image as lower dir. Only for images
+        which are a directory (an unpacked root filesystem).
+    copy: sparse copy of the image file.
+"""
+from __future__ import unicode_literals
+from collections import OrderedDict
+from distutils.spawn import find_executable
+import os
+import shutil
+import stat
+import subprocess
+import time
+
+from .reflink import reflink
+
+
+class ProvisionerUnavailable(Exception):
+    pass
+
+
+def sizeof_fmt(num, use_kibibyte=True):
+    base, infix = [(1000., ''), (1024., 'i')][use_kibibyte]
+    for x in ['bytes', 'K%sB' % infix, 'M%sB' % infix, 'G%sB' % infix]:
+        if num < base and num > -base:
+            return "%3.1f%s" % (num, x)
+        num /= base
+    return "%3.1f %s" % (num, 'T%sB' % infix)
+
+
+def run(command):
+    """
+    Runs command, raises ProvisionerUnavailable when it fails.
+    """
+    try:
+        return subprocess.check_output(command, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError), e:
+        raise ProvisionerUnavailable('{0}: {1}'.format(
+            ' '.join(command),
+            getattr(e, 'output', None) or e
+        ))
+
+
+class ImageProvisioner(object):
+    """
+    Base class of the provisioners.
+
+    Description:
+        filesystem_type, source_attribute and driver describe the root
+        filesystem element in domain.xml:
+        <filesystem type="{filesystem_type}">
+          <driver type="{driver[0]}" format="{driver[1]}"/>
+          <source {source_attribute}="{source}"/>
+    """
+    name = None
+    filesystem_type = 'file'
+    source_attribute = 'file'
+    driver = None
+
+    def __init__(self, src, dst, logger):
+        """
+        Arguments:
+            src: path of the base image.
+            dst: path of the instance image.
+            logger: logger for progress lines.
+        """
+        self.src = src
+        self.dst = dst
+        self.logger = logger
+
+    @property
+    def source(self):
+        """
+        Path of the root filesystem, as used in domain.xml.
+        """
+        return self.dst
+
+    @classmethod
+    def owns(cls, path):
+        """
+        Returns True if path is an instance image made by this provisioner.
+        """
+        return False
+
+    def provision(self):
+        """
+        Creates the instance image.
+
+        Raises:
+            ProvisionerUnavailable if this backend can not be used. Nothing
+            is left behind in that case.
+        """
+        raise NotImplementedError()
+
+    def remove(self):
+        os.remove(self.dst)
+
+
+class ReflinkProvisioner(ImageProvisioner):
+    name = 'reflink'
+
+    def provision(self):
+        if not os.path.isfile(self.src):
+            raise ProvisionerUnavailable('Image is not a file.')
+        with open(self.src, 'rb') as fsrc:
+            with open(self.dst, 'wb') as fdst:
+                try:
+                    reflink(fsrc, fdst)
+                except IOError, e:
+                    error = e
+                else:
+                    error = None
+        if error:
+            os.remove(self.dst)
+            raise ProvisionerUnavailable('Reflink failed: {0}'.format(error))
+        shutil.copystat(self.src, self.dst)
+
+
+class Qcow2Provisioner(ImageProvisioner):
+    name = 'qcow2'
+    driver = ('nbd', 'qcow2')
+    magic = b'QFI\xfb'
+
+    @classmethod
+    def owns(cls, path):
+        if not os.path.isfile(path) or os.path.islink(path):
+            return False
+        with open(path, 'rb') as fp:
+            return fp.read(len(cls.magic)) == cls.magic
+
+    def provision(self):
+        if not os.path.isfile(self.src):
+            raise ProvisionerUnavailable('Image is not a file.')
+        if not find_executable('qemu-img'):
+            raise ProvisionerUnavailable('qemu-img not found.')
+        run([
+            'qemu-img', 'create', '-f', 'qcow2',
+            '-o', 'backing_file={0},backing_fmt=raw'.format(self.src),
+            self.dst
+        ])
+
+
+class LvmThinProvisioner(ImageProvisioner):
+    """
+    Thin snapshot of logical volume <volume_group>/<image name>.
+
+    Description:
+        The instance image path is a symlink to the snapshot's device.
+    """
+    name = 'lvm-thin'
+    filesystem_type = 'block'
+    source_attribute = 'dev'
+
+    def __init__(self, src, dst, logger, volume_group=None):
+        super(LvmThinProvisioner, self).__init__(src, dst, logger)
+        self.volume_group = volume_group
+
+    @classmethod
+    def owns(cls, path):
+        return os.path.islink(path) and os.path.exists(path) and \
+            stat.S_ISBLK(os.stat(path).st_mode)
+
+    def provision(self):
+        if not self.volume_group:
+            raise ProvisionerUnavailable('No volume group configured.')
+        origin = '{0}/{1}'.format(
+            self.volume_group,
+            os.path.basename(self.src)
+        )
+        name = os.path.basename(self.dst)
+        run(['lvs', origin])
+        run(['lvcreate', '--snapshot', '--setactivationskip', 'n',
+             '--name', name, origin])
+        os.symlink(
+            os.path.join('/dev', self.volume_group, name),
+            self.dst
+        )
+
+    def remove(self):
+        # Removed after the volume: without the link, a retry can not find it.
+        device = os.path.realpath(self.dst)
+        run(['lvremove', '--force', device])
+        os.remove(self.dst)
+
+
+class OverlayProvisioner(ImageProvisioner):
+    """
+    Overlayfs mount with the image directory as lower dir.
+
+    Description:
+        The instance image is a directory with the upper, work and (mounted)
+        root directories of the overlay.
+    """
+    name = 'overlay'
+    filesystem_type = 'mount'
+    source_attribute = 'dir'
+
+    @property
+    def source(self):
+        return os.path.join(self.dst, 'root')
+
+    @classmethod
+    def owns(cls, path):
+        return os.path.isdir(os.path.join(path, 'upper'))
+
+    def provision(self):
+        if not os.path.isdir(self.src):
+            raise ProvisionerUnavailable('Image is not a directory.')
+        for d in ('upper', 'work', 'root'):
+            os.makedirs(os.path.join(self.dst, d))
+        try:
+            run([
+                'mount', '-t', 'overlay', 'overlay', '-o',
+                'lowerdir={0},upperdir={1},workdir={2}'.format(
+                    self.src,
+                    os.path.join(self.dst, 'upper'),
+                    os.path.join(self.dst, 'work')
+                ),
+                self.source
+            ])
+        except ProvisionerUnavailable:
+            shutil.rmtree(self.dst)
+            raise
+
+    def remove(self):
+        if os.path.ismount(self.source):
+            run(['umount', self.source])
+        shutil.rmtree(self.dst)
+
+
+class SparseCopyProvisioner(ImageProvisioner):
+    """
+    Copies the image, skipping blocks of zeroes to keep the copy sparse.
+    """
+    name = 'copy'
+
+    def provision(self):
+        length = 16*1024  # 10 times the blocksize as buffer
+        logger = self.logger
+
+        try:
+            with open(self.src, 'rb') as fsrc:
+                # max_size defined by sparse file
+                max_size = os.fstat(fsrc.fileno()).st_size
+
+                # The actual size the sparse file uses on disk (check with du -sh)
+                # http://bugs.python.org/file19108/shutil-2.7.patch for mor info
+                actual_size = os.fstat(fsrc.fileno()).st_blocks * 512
+                logger.info(
+                    "Max size of image: {0} (already used: {1})".format(sizeof_fmt(max_size), sizeof_fmt(actual_size))
+                )
+                log_percent = 0
+                with open(self.dst, 'wb') as fdst:
+                    while 1:
+                        current_size = os.fstat(fdst.fileno()).st_size
+                        buf = fsrc.read(length)
+                        if not buf:
+                            break
+                        if buf == '\0'*len(buf):
+                            fdst.seek(len(buf), os.SEEK_CUR)  # this is the sparse / empty bit of a file
+                        else:
+                            fdst.write(buf)  # this buffer contains actual non sparse data, copy it to dst
+
+                            percent = 100.0 * current_size/max_size
+                            if percent >= 100.0:
+                                logger.info("[# {:.1%} imgcopy info #] Copying image".format(100.0/100.0))
+                            else:
+                                if log_percent + 1 < percent:
+                                    log_percent = percent
+                                    logger.info("[# {:.1%} imgcopy info #] Copying image".format(percent/100.0))
+
+                    fdst.truncate(max_size) # make this a sparse file like the originating file
+
+            shutil.copystat(self.src, self.dst)
+            logger.info("[# 100% imgcopy info #] Image copied")
+        except OSError, e:
+            logger.warn("Tried to copy image: {0}.".format(e))
+
+
+PROVISIONERS = OrderedDict(
+    (p.name, p) for p in (
+        ReflinkProvisioner,
+        Qcow2Provisioner,
+        LvmThinProvisioner,
+        OverlayProvisioner,
+        SparseCopyProvisioner,
+    )
+)
+
+# Used when settings.CONTAINER has no 'provisioners'.
+DEFAULT_PROVISIONERS = ('reflink', 'copy')
+
+
+def get_provisioner(name, src, dst, logger, container_settings):
+    cls = PROVISIONERS[name]
+    if cls is LvmThinProvisioner:
+        return cls(src, dst, logger,
+                   volume_group=container_settings.get('lvm_volume_group'))
+    return cls(src, dst, logger)
+
+
+def provision_image(src, dst, logger, container_settings):
+    """
+    Creates instance image dst from src with the first provisioner that works.
+
+    Description:
+        Provisioners are tried in the order of
+        container_settings['provisioners']. The sparse copy is always tried
+        last. Every backend logs imgcopy info lines at the start (0%) and the
+        end (100%), for the progress bar of the job; only the sparse copy logs
+        the progress in between. The chosen backend and the time it took are
+        logged too.
+
+    Returns:
+        The ImageProvisioner which created the image.
+    """
+    names = list(container_settings.get('provisioners', DEFAULT_PROVISIONERS))
+    if SparseCopyProvisioner.name not in names:
+        names.append(SparseCopyProvisioner.name)
+
+    logger.info("[# 0% imgcopy info #] Provisioning image")
+    for name in names:
+        provisioner = get_provisioner(name, src, dst, logger,
+                                      container_settings)
+        start = time.time()
+        try:
+            provisioner.provision()
+        except ProvisionerUnavailable, e:
+            logger.info('Provisioner {0} not used: {1}'.format(name, e))
+            continue
+        logger.info("Image provisioned with {0} in {1:.2f}s".format(
+            name, time.time() - start))
+        logger.info("[# 100% imgcopy info #] Image provisioned")
+        return provisioner
+
+
+def provisioner_for_instance(dst, logger, container_settings):
+    """
+    Returns the provisioner which (probably) made instance image dst.
+
+    Description:
+        Used when the provisioner is not known, for example when a domain is
+        destroyed by another LibVirtDomain object than the one which created
+        it. Plain files are handled by the sparse copy provisioner. The base
+        image is not known; the provisioner can describe and remove dst, but
+        not provision it.
+    """
+    for name, cls in PROVISIONERS.iteritems():
+        if cls.owns(dst):
+            return get_provisioner(name, None, dst, logger, container_settings)
+    return SparseCopyProvisioner(None, dst, logger)
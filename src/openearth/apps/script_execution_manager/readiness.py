@@ -0,0 +1,186 @@
+"""
+Detects when a container is usable: it has an ip address and its SSH server
+accepts connections.
+
+Description:
+    The ip address comes from the DHCP leases of the libvirt network (the
+    DHCPLeases API, libvirt >= 1.2.6) or from the dnsmasq leases file. Between
+    lookups, the directory of the leases file is watched with inotify, so a
+    new lease is seen as soon as dnsmasq writes it. Without inotify the
+    lookups are repeated every POLL_INTERVAL seconds.
+
+    Once the ip is known, the SSH port is probed with short connects until
+    the server sends its banner.
+"""
+from __future__ import unicode_literals
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import socket
+import time
+
+from .container import LibVirtDomainException
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.2
+SSH_PORT = 22
+SSH_CONNECT_TIMEOUT = 0.5
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+
+class ReadinessTimeout(LibVirtDomainException):
+    pass
+
+
+def get_libc():
+    """
+    Returns libc if it has inotify, else None.
+    """
+    name = ctypes.util.find_library('c')
+    if not name:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.inotify_init
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class LeaseWatcher(object):
+    """
+    Waits for changes in the directory of the leases file.
+
+    Example:
+        watcher = LeaseWatcher('/var/lib/libvirt/dnsmasq/default.leases')
+        try:
+            watcher.wait(timeout=1)
+        finally:
+            watcher.close()
+    """
+    fd = None
+
+    def __init__(self, path):
+        libc = get_libc()
+        if libc is None:
+            return
+        fd = libc.inotify_init()
+        if fd < 0:
+            return
+        directory = os.path.dirname(os.path.abspath(path)).encode('utf-8')
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, directory, mask) < 0:
+            os.close(fd)
+            return
+        self.fd = fd
+
+    def wait(self, timeout):
+        """
+        Blocks until something changed, or timeout seconds passed.
+        """
+        if self.fd is None:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return
+        try:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if ready:
+            os.read(self.fd, 4096)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def wait_for_ip(lv, timeout=40):
+    """
+    Waits until the domain got an ip address.
+
+    Arguments:
+        lv: a running LibVirtDomain.
+        timeout: seconds to wait.
+
+    Returns:
+        ip address (str)
+    """
+    deadline = time.time() + timeout
+    watcher = LeaseWatcher(lv.dnsmasq_leases)
+    try:
+        while True:
+            try:
+                return lv.get_ip_address()
+            except LibVirtDomainException, e:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise ReadinessTimeout(unicode(e))
+            # Wake up at least every second; leases from the libvirt API are
+            # not necessarily written to the watched directory.
+            watcher.wait(min(remaining, 1))
+    finally:
+        watcher.close()
+
+
+def ssh_banner(ip, port=SSH_PORT, timeout=SSH_CONNECT_TIMEOUT):
+    """
+    Returns the banner of the SSH server on ip, or None.
+    """
+    try:
+        sock = socket.create_connection((ip, port), timeout)
+    except (socket.error, socket.timeout):
+        return None
+    try:
+        banner = sock.recv(256)
+    except (socket.error, socket.timeout):
+        return None
+    finally:
+        sock.close()
+    if banner.startswith(b'SSH-'):
+        return banner.strip()
+    return None
+
+
+def wait_for_ssh(ip, timeout=60, port=SSH_PORT):
+    """
+    Probes the SSH port of ip until the server sends its banner.
+    """
+    deadline = time.time() + timeout
+    while True:
+        banner = ssh_banner(ip, port)
+        if banner:
+            return banner
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise ReadinessTimeout(
+                'SSH server on "{0}" not ready after {1}s.'.format(ip, timeout)
+            )
+        time.sleep(min(remaining, POLL_INTERVAL))
+
+
+def wait_until_ready(lv, ip_timeout=40, ssh_timeout=60):
+    """
+    Waits until the domain has an ip address and accepts SSH connections.
+
+    Arguments:
+        lv: a running LibVirtDomain.
+
+    Returns:
+        Tuple (ip, seconds waited for the ip, seconds waited for SSH).
+    """
+    start = time.time()
+    ip = wait_for_ip(lv, ip_timeout)
+    got_ip = time.time()
+    wait_for_ssh(ip, ssh_timeout)
+    return ip, got_ip - start, time.time() - got_ip
@@ -0,0 +1,26 @@
+"""
+Reflinks (clones) of files, on filesystems which support it (btrfs, xfs).
+
+Description:
+    A reflink shares all data blocks with the source file; nothing is copied
+    until one of the files is changed.
+"""
+from __future__ import unicode_literals
+import fcntl
+
+# Clone (reflink) ioctl, see linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """
+    Makes dst a clone of src.
+
+    Arguments:
+        src: file object opened for reading.
+        dst: file object opened for writing.
+
+    Raises:
+        IOError if the filesystem does not support reflinks.
+    """
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
@@ -0,0 +1,146 @@
+"""
+Runs the commands of a job in its container over one SSH connection.
+"""
+from __future__ import unicode_literals
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+import subprocess
+import tempfile
+
+from .exec_wrapper import ExecWrapper
+
+
+class RemoteExecutor(object):
+    """
+    Job scoped executor of commands in a container.
+
+    Description:
+        open() starts an SSH master connection, the commands reuse it through
+        its control socket (ControlMaster), so the key exchange and
+        authentication happen once per job. Output of the commands is logged
+        to the job logger, one record per batch of lines.
+
+    Example:
+        with RemoteExecutor(ip, job_logger=logger) as remote:
+            remote.run(['/usr/bin/svn', 'co', url, '/home/worker/svn'])
+            remote.run_concurrently(
+                [['/usr/bin/yum', 'list', 'installed']],
+                [['/opt/python2.7/bin/pip', 'freeze']]
+            )
+    """
+    def __init__(self, ip, job_logger, user='worker', key_path=None):
+        """
+        Arguments:
+            ip: ip address of the container.
+            job_logger: logger of the job, receives the output.
+            user: user to log in with.
+            key_path: private key, defaults to ~/.ssh/id_rsa_worker.
+        """
+        self.ip = ip
+        self.logger = job_logger
+        self.user = user
+        self.key_path = key_path or os.path.join(
+            os.path.expanduser('~'), '.ssh', 'id_rsa_worker'
+        )
+        self.control_dir = None
+
+    @property
+    def control_path(self):
+        return os.path.join(self.control_dir, 'control')
+
+    def ssh_command(self, *options):
+        command = [
+            '/usr/bin/ssh',
+            '-oStrictHostKeyChecking=no',
+            '-oUserKnownHostsFile=/dev/null',
+            '-oControlPath={0}'.format(self.control_path),
+            '-i', self.key_path,
+        ]
+        command.extend(options)
+        command.append('{0}@{1}'.format(self.user, self.ip))
+        return command
+
+    def open(self):
+        """
+        Starts the master connection. Returns when it is authenticated.
+
+        Raises:
+            subprocess.CalledProcessError if ssh fails.
+        """
+        # The socket path has to be short (sun_path is 108 bytes).
+        self.control_dir = tempfile.mkdtemp(prefix='ssh-')
+        try:
+            subprocess.check_call(self.ssh_command(
+                '-oControlMaster=yes', '-oControlPersist=yes',
+                '-oServerAliveInterval=30', '-N', '-f'
+            ))
+        except Exception:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+            self.control_dir = None
+            raise
+
+    def close(self):
+        """
+        Stops the master connection.
+        """
+        if self.control_dir is None:
+            return
+        if os.path.exists(self.control_path):
+            subprocess.call(self.ssh_command('-Oexit'))
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+        self.control_dir = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def run(self, command):
+        """
+        Runs command in the container, logs its output.
+
+        Raises:
+            Exception if the command fails (see ExecWrapper).
+        """
+        self.logger.info('Executing command "{0}"'.format(command))
+        ew = ExecWrapper(
+            command=self.ssh_command('-oControlMaster=no') + list(command)
+        )
+        # One record per batch of output lines, not per line.
+        for batch in ew.stream_output():
+            self.logger.info('\n'.join(line.text for line in batch))
+
+    def run_all(self, commands):
+        for command in commands:
+            self.run(command)
+
+    def run_concurrently(self, *sequences):
+        """
+        Runs sequences of commands at the same time, each as its own session
+        on the connection. Commands within a sequence run in order.
+
+        Raises:
+            The first error of the sequences, after all of them ended.
+        """
+        sequences = [s for s in sequences if s]
+        if not sequences:
+            return
+        pool = ThreadPool(len(sequences))
+        try:
+            results = [
+                pool.apply_async(self.run_all, (s,)) for s in sequences
+            ]
+            errors = []
+            for result in results:
+                try:
+                    result.get()
+                except Exception, e:
+                    errors.append(e)
+        finally:
+            pool.close()
+            pool.join()
+        if errors:
+            raise errors[0]
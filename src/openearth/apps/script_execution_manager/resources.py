@@ -0,0 +1,140 @@
+"""
+Resource profiles of container images, and sampling of what a job used.
+
+Description:
+    A profile sets the vcpus, memory (MiB), swap (MiB), cpu shares and blkio
+    weight of a container; see templates/containers/domain.xml. Profiles
+    are named in settings.CONTAINER['resource_profiles'], images are mapped
+    to a profile in settings.CONTAINER['image_profiles']. Images without a
+    profile get the 'default' profile.
+"""
+from __future__ import unicode_literals
+from django.conf import settings
+import logging
+import threading
+import time
+
+import libvirt
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE = {
+    'vcpus': 1,
+    'memory': 4096,
+    'current_memory': 512,
+    'swap': 128,
+    'cpu_shares': 1024,
+    'blkio_weight': 500,
+}
+
+
+def get_profile_name(image):
+    return settings.CONTAINER.get('image_profiles', {}).get(image, 'default')
+
+
+def get_named_profile(name):
+    """
+    Returns resource profile name, as dict.
+    """
+    profile = dict(DEFAULT_PROFILE)
+    profiles = settings.CONTAINER.get('resource_profiles', {})
+    profile.update(profiles.get('default', {}))
+    profile.update(profiles.get(name, {}))
+    return profile
+
+
+def get_profile(image):
+    """
+    Returns the resource profile of image, as dict.
+    """
+    return get_named_profile(get_profile_name(image))
+
+
+class ResourceSampler(object):
+    """
+    Samples the CPU time and memory use of a running domain in a thread.
+
+    Description:
+        Uses virDomain.info(); for lxc domains libvirt reads the memory use
+        and CPU time from the cgroups of the container. CPU time is counted
+        from start(), so a pre-booted container is not charged for its boot.
+
+    Example:
+        sampler = ResourceSampler(lv.domain)
+        sampler.start()
+        ... run the job ...
+        sampler.stop()
+        sampler.usage()
+    """
+    def __init__(self, domain, interval=5):
+        """
+        Arguments:
+            domain: virDomain.
+            interval: seconds between samples.
+        """
+        self.domain = domain
+        self.interval = interval
+        self.samples = 0
+        self.cpu_seconds = 0
+        self.peak_cpu = 0
+        self.peak_memory = 0
+        self._first_cpu = None
+        self._last = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        state, max_memory, memory, vcpus, cpu_time = self.domain.info()
+        now = time.time()
+        cpu = cpu_time / 1e9
+        if self._first_cpu is None:
+            self._first_cpu = cpu
+        if self._last is not None:
+            last_time, last_cpu = self._last
+            if now > last_time:
+                # Used cores during the interval.
+                self.peak_cpu = max(
+                    self.peak_cpu, (cpu - last_cpu) / (now - last_time))
+        self._last = (now, cpu)
+        self.cpu_seconds = cpu - self._first_cpu
+        self.peak_memory = max(self.peak_memory, memory * 1024)
+        self.samples += 1
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.sample()
+            except libvirt.libvirtError:
+                logger.warning('Sampling resource usage failed',
+                               exc_info=True)
+                return
+
+    def start(self):
+        self.sample()
+        self._thread = threading.Thread(
+            target=self.run, name='resource-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sampling, after a last sample.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.sample()
+        except libvirt.libvirtError:
+            pass
+
+    def usage(self):
+        """
+        Returns dict with cpu_seconds, peak_cpu (cores) and peak_memory
+        (bytes).
+        """
+        return {
+            'cpu_seconds': self.cpu_seconds,
+            'peak_cpu': self.peak_cpu,
+            'peak_memory': self.peak_memory,
+        }
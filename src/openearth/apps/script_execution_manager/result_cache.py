@@ -0,0 +1,150 @@
+"""
+Reuse of the results of a job which ran with the same inputs.
+
+Description:
+    The inputs of a job are the container image, the interpreter, the
+    environment repository at a revision, the script at its revision, the
+    OpenEarth tools revision and the parameters. Their fingerprint is stored
+    on the job (ProcessingJob.input_fingerprint). A job whose fingerprint
+    matches a finished job gets the result files of that job, instead of
+    running in a container.
+
+    The image is identified by its name, size and modification time on the
+    worker, so an image which is replaced gives new fingerprints. Jobs at
+    the latest revision of something (no revision, or OpenEarth tools
+    without a revision) have no fingerprint and always run.
+
+    Jobs with force_rerun set always run; they still store their fingerprint,
+    so later jobs can use their results. Only the jobs of the same user are
+    reused; the results of other users are not shared.
+
+    The check is done before a job is queued in the scheduler (see
+    tasks.finish_from_cache), so a job with cached results does not wait for
+    resources.
+"""
+from __future__ import unicode_literals
+from django.conf import settings
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def image_identity(image):
+    """
+    Returns [name, size, mtime] of the base image, None when it is missing.
+    """
+    if not settings.CONTAINER['base_dir']:
+        return None
+    path = os.path.join(settings.CONTAINER['base_dir'], image)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [os.path.basename(path), stat.st_size, int(stat.st_mtime)]
+
+
+def job_fingerprint(job, image, interpreter, svn_url, open_earth_tools):
+    """
+    Returns the sha1 hex digest of the inputs of job.
+
+    Arguments:
+        job: ProcessingJob.
+        image, interpreter, svn_url, open_earth_tools: as given to run_script.
+
+    Returns:
+        str, or None when the inputs are not fixed.
+    """
+    identity = image_identity(image)
+    if identity is None or not job.revision:
+        return None
+    if open_earth_tools and not job.open_earth_revision:
+        return None
+    if job.parameters:
+        parameters = json.loads(job.parameters)
+    else:
+        parameters = None
+    inputs = {
+        'image': identity,
+        'interpreter': interpreter,
+        'repo': svn_url,
+        'revision': job.revision,
+        'script': job.script,
+        'script_revision': job.script_revision or job.revision,
+        'open_earth_revision': (
+            job.open_earth_revision if open_earth_tools else None),
+        'parameters': parameters,
+    }
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+
+
+def update_fingerprint(job):
+    """
+    Stores the fingerprint of the inputs of job, from its environment.
+    """
+    environment = job.environment
+    job.input_fingerprint = job_fingerprint(
+        job,
+        environment.libvirt_image.libvirt_image,
+        environment.libvirt_image.interpreter,
+        environment.get_repo_url(),
+        environment.open_earth
+    ) or ''
+    # Not saved, saving a job which is not scheduled yet starts it.
+    job.__class__.objects.filter(pk=job.pk).update(
+        input_fingerprint=job.input_fingerprint)
+    return job.input_fingerprint
+
+
+def find_cached_job(job):
+    """
+    Returns the latest finished job of the same user with the fingerprint of
+    job and results.
+
+    Arguments:
+        job: ProcessingJob, with input_fingerprint set.
+
+    Returns:
+        ProcessingJob or None.
+    """
+    if not job.input_fingerprint or job.force_rerun:
+        return None
+    return job.__class__.objects.filter(
+        input_fingerprint=job.input_fingerprint,
+        environment__author_id=job.environment.author_id,
+        status=job.STATUS.FINISHED,
+        processing_result__isnull=False,
+    ).exclude(uuid=job.uuid).order_by('-created_date').first()
+
+
+def link_results(source, job, job_logger=logger):
+    """
+    Adds the result files of source to job.
+
+    Description:
+        The results refer to the files of source, nothing is copied. Results
+        which are linked already are skipped, so a retried task does not
+        link twice.
+
+    Arguments:
+        source: finished ProcessingJob.
+        job: ProcessingJob which gets the results.
+        job_logger: logger of the job.
+
+    Returns:
+        int, number of linked results.
+    """
+    linked = set(job.processing_result.values_list('file_id', flat=True))
+    count = 0
+    for result in source.processing_result.exclude(file=None):
+        if result.file_id in linked:
+            continue
+        job.processing_result.create(file=result.file)
+        job_logger.info('Linked result "{0}" of job {1}'.format(
+            os.path.basename(result.file.path), source.uuid))
+        count += 1
+    job.cached_from = source
+    job.save(update_fields=['cached_from'])
+    return count
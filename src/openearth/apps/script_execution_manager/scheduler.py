@@ -0,0 +1,484 @@
+"""
+Resource-aware scheduling of processing jobs.
+
+Description:
+    Jobs are not sent to Celery when they are started, but put in a queue
+    per resource profile (see resources.py), in a list per user. Worker
+    hosts report their headroom: free CPU, memory (MiB) and container disk
+    (MiB), less what is reserved for the jobs they run. dispatch sends jobs
+    to the Celery queue of their profile while the reported headroom fits
+    them; the next job of a queue is the first job of the user with the
+    fewest dispatched and running jobs, so one user's batch does not hold
+    up the jobs of others.
+
+    A worker admits a job (admit) before it starts the container and
+    reserves the vcpus and memory of the profile on its host. A job which
+    does not fit, because the report was outdated or the host is busy with
+    other work, is retried later (see tasks.run_script). release frees the
+    reservation when the job is done.
+
+    Images get their own queue by giving them their own profile in
+    settings.CONTAINER['image_profiles']. Workers consume all queues,
+    unless started with -Q. Settings are in settings.SCHEDULER.
+
+Example:
+    scheduler = get_scheduler()
+    scheduler.submit(job.uuid, 'admin', image)
+    scheduler.dispatch()
+    scheduler.queue_stats()
+"""
+from __future__ import unicode_literals
+from django.conf import settings
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+import redis
+from ws4redis import settings as redis_settings
+
+from .resources import get_named_profile, get_profile, get_profile_name
+
+logger = logging.getLogger(__name__)
+
+QUEUE_PREFIX = 'jobs-'
+
+# Pops the next job of a queue: the first job of the user with the fewest
+# dispatched and running jobs, the longest waiting job on a tie.
+# KEYS: users set, running hash (user: jobs), starting counter.
+# ARGV: pending list prefix, job hash prefix.
+POP_SCRIPT = """
+local best, best_running, best_enqueued
+for _, user in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    local job = redis.call('LINDEX', ARGV[1] .. user, 0)
+    if job then
+        local running = tonumber(redis.call('HGET', KEYS[2], user) or '0')
+        local enqueued = tonumber(
+            redis.call('HGET', ARGV[2] .. job, 'enqueued') or '0')
+        if best == nil or running < best_running or
+                (running == best_running and enqueued < best_enqueued) then
+            best, best_running, best_enqueued = user, running, enqueued
+        end
+    else
+        redis.call('SREM', KEYS[1], user)
+    end
+end
+if best == nil then
+    return false
+end
+local job = redis.call('LPOP', ARGV[1] .. best)
+if redis.call('LLEN', ARGV[1] .. best) == 0 then
+    redis.call('SREM', KEYS[1], best)
+end
+redis.call('HINCRBY', KEYS[2], best, 1)
+redis.call('INCR', KEYS[3])
+redis.call('HSET', ARGV[2] .. job, 'state', 'dispatched')
+return job
+"""
+
+# Reserves the vcpus and memory of a job on a host, if they are free.
+# KEYS: job hash, host reservations hash, running hash, starting counter.
+# ARGV: cpus, load, total memory, available memory, vcpus, memory, host,
+#   queue, user.
+ADMIT_SCRIPT = """
+local reserved_cpu = tonumber(redis.call('HGET', KEYS[2], 'vcpus') or '0')
+local reserved_memory = tonumber(
+    redis.call('HGET', KEYS[2], 'memory') or '0')
+local cpus = tonumber(ARGV[1])
+local free_cpu = math.min(cpus - tonumber(ARGV[2]), cpus - reserved_cpu)
+local free_memory = math.min(tonumber(ARGV[4]),
+                             tonumber(ARGV[3]) - reserved_memory)
+if free_cpu < tonumber(ARGV[5]) or free_memory < tonumber(ARGV[6]) then
+    return 0
+end
+local state = redis.call('HGET', KEYS[1], 'state')
+if state == 'running' then
+    return 1
+end
+if state == 'dispatched' then
+    redis.call('DECR', KEYS[4])
+else
+    redis.call('HINCRBY', KEYS[3], ARGV[9], 1)
+end
+redis.call('HINCRBY', KEYS[2], 'vcpus', ARGV[5])
+redis.call('HINCRBY', KEYS[2], 'memory', ARGV[6])
+redis.call('HMSET', KEYS[1], 'state', 'running', 'host', ARGV[7],
+           'vcpus', ARGV[5], 'memory', ARGV[6], 'queue', ARGV[8],
+           'user', ARGV[9])
+return 1
+"""
+
+# Forgets a job in any state, returns the state it had.
+# KEYS: job hash. ARGV: job uuid, key prefix.
+RELEASE_SCRIPT = """
+local job = redis.call('HGETALL', KEYS[1])
+if #job == 0 then
+    return false
+end
+local fields = {}
+for i = 1, #job, 2 do
+    fields[job[i]] = job[i + 1]
+end
+local prefix = ARGV[2]
+local queue, user, state = fields['queue'], fields['user'], fields['state']
+if state == 'pending' then
+    redis.call('LREM', prefix .. 'pending:' .. queue .. ':' .. user, 0,
+               ARGV[1])
+else
+    local running = prefix .. 'running:' .. queue
+    if redis.call('HINCRBY', running, user, -1) <= 0 then
+        redis.call('HDEL', running, user)
+    end
+    if state == 'dispatched' then
+        redis.call('DECR', prefix .. 'starting:' .. queue)
+    elseif state == 'running' then
+        local reserved = prefix .. 'reserved:' .. fields['host']
+        redis.call('HINCRBY', reserved, 'vcpus', -tonumber(fields['vcpus']))
+        redis.call('HINCRBY', reserved, 'memory', -tonumber(fields['memory']))
+    end
+end
+redis.call('DEL', KEYS[1])
+return state
+"""
+
+
+def get_queue(image):
+    """
+    Returns the name of the Celery queue of the jobs of image.
+    """
+    return QUEUE_PREFIX + get_profile_name(image)
+
+
+def get_queues():
+    """
+    Returns the names of the Celery queues of all resource profiles.
+    """
+    return sorted(QUEUE_PREFIX + name for name in
+                  settings.CONTAINER.get('resource_profiles', {}))
+
+
+def get_host():
+    return socket.gethostname()
+
+
+def read_meminfo(path='/proc/meminfo'):
+    """
+    Returns (total, available) memory of this host in MiB.
+    """
+    info = {}
+    with open(path) as f:
+        for line in f:
+            name, value = line.split(':', 1)
+            info[name] = int(value.split()[0])
+    # MemAvailable is missing before Linux 3.14.
+    available = info.get('MemAvailable')
+    if available is None:
+        available = info['MemFree'] + info.get('Buffers', 0) + \
+            info.get('Cached', 0)
+    return info['MemTotal'] // 1024, available // 1024
+
+
+def measure_headroom():
+    """
+    Returns dict with the cpus, load, total and available memory (MiB) and
+    free container disk (MiB) of this host.
+    """
+    total, available = read_meminfo()
+    stat = os.statvfs(settings.CONTAINER['base_dir'] or '/')
+    return {
+        'cpus': multiprocessing.cpu_count(),
+        'load': os.getloadavg()[0],
+        'total_memory': total,
+        'available_memory': available,
+        'free_disk': stat.f_bavail * stat.f_frsize // 1024 ** 2,
+    }
+
+
+def fits(report, profile):
+    """
+    Returns how many jobs of profile fit in the headroom of report.
+    """
+    if report['free_disk'] < settings.SCHEDULER['min_disk']:
+        return 0
+    return max(int(min(report['free_cpu'] / float(profile['vcpus']),
+                       report['free_memory'] / float(profile['memory']))), 0)
+
+
+class JobScheduler(object):
+    """
+    Queues, dispatches and admits processing jobs, see the module docstring.
+    """
+    def __init__(self, connection, prefix='scheduler:'):
+        """
+        Arguments:
+            connection: StrictRedis connection.
+            prefix: prefix of the redis keys.
+        """
+        self.connection = connection
+        self.prefix = prefix
+        self._pop_script = connection.register_script(POP_SCRIPT)
+        self._admit_script = connection.register_script(ADMIT_SCRIPT)
+        self._release_script = connection.register_script(RELEASE_SCRIPT)
+
+    def key(self, *parts):
+        return self.prefix + ':'.join(parts)
+
+    def submit(self, uuid, username, image):
+        """
+        Queues job uuid of username, unless it is queued already.
+
+        Returns:
+            True if the job was queued.
+        """
+        uuid = unicode(uuid)
+        queue = get_queue(image)
+        job_key = self.key('job', uuid)
+        if not self.connection.hsetnx(job_key, 'queue', queue):
+            return False
+        pipe = self.connection.pipeline()
+        pipe.hmset(job_key, {
+            'user': username,
+            'state': 'pending',
+            'enqueued': time.time(),
+        })
+        pipe.rpush(self.key('pending', queue, username), uuid)
+        pipe.sadd(self.key('users', queue), username)
+        pipe.execute()
+        return True
+
+    def pop(self, queue):
+        """
+        Takes the next job of queue, marks it dispatched.
+
+        Returns:
+            uuid of the job, or None if the queue is empty.
+        """
+        return self._pop_script(
+            keys=[self.key('users', queue), self.key('running', queue),
+                  self.key('starting', queue)],
+            args=[self.key('pending', queue, ''), self.key('job', '')]
+        )
+
+    def report(self, host=None, queues=None):
+        """
+        Stores the headroom of this host, less its reservations.
+
+        Arguments:
+            host: name of the host, default this host.
+            queues: queues the worker of this host consumes, default the
+                ones of its last report.
+
+        Returns:
+            The report, dict.
+        """
+        host = host or get_host()
+        if queues is None:
+            last = self.connection.hget(self.key('hosts'), host)
+            queues = json.loads(last)['queues'] if last else get_queues()
+        measured = measure_headroom()
+        reserved = self.connection.hgetall(self.key('reserved', host))
+        cpus = measured['cpus']
+        report = {
+            'queues': list(queues),
+            'time': time.time(),
+            'free_cpu': min(cpus - measured['load'],
+                            cpus - int(reserved.get('vcpus', 0))),
+            'free_memory': min(measured['available_memory'],
+                               measured['total_memory'] -
+                               int(reserved.get('memory', 0))),
+            'free_disk': measured['free_disk'],
+        }
+        self.connection.hset(self.key('hosts'), host, json.dumps(report))
+        return report
+
+    def get_reports(self):
+        """
+        Returns dict host: report of the hosts which reported recently.
+        """
+        expire = time.time() - settings.SCHEDULER['report_expire']
+        reports = {}
+        for host, report in self.connection.hgetall(self.key('hosts')).items():
+            report = json.loads(report)
+            if report['time'] >= expire:
+                reports[host] = report
+        return reports
+
+    def capacity(self, queue, reports=None):
+        """
+        Returns how many more jobs of queue can be dispatched.
+        """
+        if reports is None:
+            reports = self.get_reports()
+        profile = get_named_profile(queue[len(QUEUE_PREFIX):])
+        free = sum(fits(r, profile) for r in reports.values()
+                   if queue in r['queues'])
+        starting = int(self.connection.get(self.key('starting', queue)) or 0)
+        return max(free - starting, 0)
+
+    def dispatch(self, queues=None):
+        """
+        Sends jobs to their Celery queue while there is headroom for them.
+
+        Description:
+            One dispatcher runs at a time; when another one is running this
+            returns immediately, the next report dispatches again.
+
+        Returns:
+            Number of dispatched jobs.
+        """
+        lock = self.connection.lock(self.key('dispatch-lock'), timeout=60)
+        if not lock.acquire(blocking=False):
+            return 0
+        dispatched = 0
+        try:
+            reports = self.get_reports()
+            for queue in queues or get_queues():
+                for i in range(self.capacity(queue, reports)):
+                    uuid = self.pop(queue)
+                    if uuid is None:
+                        break
+                    self.send(uuid, queue)
+                    dispatched += 1
+        finally:
+            lock.release()
+        return dispatched
+
+    def send(self, uuid, queue):
+        from openearth.apps.processing.models import ProcessingJob
+        try:
+            job = ProcessingJob.objects.get(uuid=uuid)
+            job.send_job(queue)
+        except Exception:
+            logger.exception('Could not send job {0}'.format(uuid))
+            self.release(uuid)
+
+    def admit(self, uuid, username, image):
+        """
+        Reserves the resources of job uuid on this host.
+
+        Returns:
+            True if the job fits on this host; it may start.
+        """
+        uuid = unicode(uuid)
+        queue = get_queue(image)
+        profile = get_profile(image)
+        measured = measure_headroom()
+        if measured['free_disk'] < settings.SCHEDULER['min_disk']:
+            return False
+        host = get_host()
+        job_key = self.key('job', uuid)
+        enqueued = self.connection.hget(job_key, 'enqueued')
+        admitted = self._admit_script(
+            keys=[job_key, self.key('reserved', host),
+                  self.key('running', queue), self.key('starting', queue)],
+            args=[measured['cpus'], measured['load'],
+                  measured['total_memory'], measured['available_memory'],
+                  profile['vcpus'], profile['memory'], host, queue, username]
+        )
+        if not admitted:
+            return False
+        if enqueued:
+            waits = self.key('waits', queue)
+            pipe = self.connection.pipeline()
+            pipe.lpush(waits, time.time() - float(enqueued))
+            pipe.ltrim(waits, 0, settings.SCHEDULER['wait_history'] - 1)
+            pipe.execute()
+        self.report(host)
+        return True
+
+    def release(self, uuid):
+        """
+        Forgets job uuid and frees what it reserved.
+
+        Returns:
+            The state the job had: 'pending', 'dispatched' or 'running', or
+            None if the job was not known.
+        """
+        return self._release_script(
+            keys=[self.key('job', unicode(uuid))],
+            args=[unicode(uuid), self.prefix]
+        )
+
+    def queue_stats(self):
+        """
+        Returns dict queue: dict with the number of pending, starting
+        (dispatched, not yet admitted) and running jobs, the users with
+        pending jobs, the wait of the oldest pending job and the mean and
+        maximum wait of recently admitted jobs, in seconds.
+        """
+        now = time.time()
+        stats = {}
+        for queue in get_queues():
+            users = self.connection.smembers(self.key('users', queue))
+            pending = 0
+            oldest = None
+            for user in users:
+                pending_key = self.key('pending', queue, user)
+                pending += self.connection.llen(pending_key)
+                first = self.connection.lindex(pending_key, 0)
+                enqueued = first and self.connection.hget(
+                    self.key('job', first), 'enqueued')
+                if enqueued and (oldest is None or
+                                 now - float(enqueued) > oldest):
+                    oldest = now - float(enqueued)
+            running = self.connection.hgetall(self.key('running', queue))
+            waits = [float(w) for w in self.connection.lrange(
+                self.key('waits', queue), 0, -1)]
+            stats[queue] = {
+                'pending': pending,
+                'starting': int(
+                    self.connection.get(self.key('starting', queue)) or 0),
+                'running': sum(int(n) for n in running.values()),
+                'users': sorted(users),
+                'oldest_wait': oldest,
+                'mean_wait': sum(waits) / len(waits) if waits else None,
+                'max_wait': max(waits) if waits else None,
+            }
+        return stats
+
+
+class HeadroomReporter(threading.Thread):
+    """
+    Reports the headroom of this host and dispatches jobs, periodically.
+
+    Description:
+        Started in the main process of a Celery worker, see
+        tasks.worker_ready_handler.
+    """
+    def __init__(self, scheduler, queues, interval=None):
+        super(HeadroomReporter, self).__init__(name='headroom-reporter')
+        self.daemon = True
+        self.scheduler = scheduler
+        self.queues = [q for q in queues if q.startswith(QUEUE_PREFIX)]
+        self.interval = interval or settings.SCHEDULER['report_interval']
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.scheduler.report(queues=self.queues)
+                self.scheduler.dispatch()
+            except (redis.RedisError, EnvironmentError):
+                logger.warning('Reporting headroom failed', exc_info=True)
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """
+    Returns the JobScheduler of this process.
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = JobScheduler(
+            redis.StrictRedis(**redis_settings.WS4REDIS_CONNECTION)
+        )
+    return _scheduler
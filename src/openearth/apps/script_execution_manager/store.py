@@ -3,12 +3,83 @@ from django.core.handlers.wsgi import WSGIRequest
 
 from ws4redis.store import RedisStore
 from django.conf import settings
+from fnmatch import fnmatchcase
 import re
 import logging
 
 logger = logging.getLogger(__name__)
 re_ns = re.compile('^{0}(.*)'.format(settings.WEBSOCKET_URL), re.IGNORECASE)
 
+# History lines and published messages are "<seq><SEPARATOR><line>".
+SEPARATOR = '\x1e'
+
+# KEYS: channel, history, sequence counter, history registry.
+# ARGV: max history, history expire, channel expire, messages...
+PUBLISH_SCRIPT = """
+local max_history = tonumber(ARGV[1])
+local history_expire = tonumber(ARGV[2])
+local expire = tonumber(ARGV[3])
+local count = #ARGV - 3
+local seq = redis.call('INCRBY', KEYS[3], count) - count
+for i = 4, #ARGV do
+    seq = seq + 1
+    local entry = seq .. '\\30' .. ARGV[i]
+    redis.call('PUBLISH', KEYS[1], entry)
+    redis.call('RPUSH', KEYS[2], entry)
+end
+if max_history > 0 then
+    redis.call('LTRIM', KEYS[2], -max_history, -1)
+end
+if history_expire > 0 then
+    redis.call('EXPIRE', KEYS[2], history_expire)
+    redis.call('EXPIRE', KEYS[3], history_expire)
+end
+redis.call('SADD', KEYS[4], KEYS[2])
+if history_expire > 0 then
+    redis.call('EXPIRE', KEYS[4], history_expire)
+end
+if expire > 0 then
+    redis.call('SET', KEYS[1], ARGV[#ARGV], 'EX', expire)
+end
+return seq
+"""
+
+# KEYS: history. ARGV: last sequence number seen by the client.
+# The history is contiguous, so the index follows from the first entry.
+HISTORY_SCRIPT = """
+local first = redis.call('LINDEX', KEYS[1], 0)
+if not first then
+    return {}
+end
+local start = tonumber(ARGV[1]) - tonumber(string.match(first, '^%d+')) + 1
+return redis.call('LRANGE', KEYS[1], math.max(start, 0), -1)
+"""
+
+
+def split_message(message):
+    """
+    Returns (sequence number, line) of a history line or published message.
+    The sequence number is None for messages published without one.
+    """
+    seq, sep, line = message.partition(SEPARATOR)
+    if sep and seq.isdigit():
+        return int(seq), line
+    return None, message
+
+
+def registry_key(namespace):
+    """
+    Key of the set of history keys of namespace, kept up to date on publish.
+    """
+    return 'hist-registry:{0}'.format(namespace)
+
+
+def parse_since(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
 
 class RedisHistoryStore(RedisStore):
     """
@@ -22,13 +93,36 @@ class RedisHistoryStore(RedisStore):
     subscription_channels = ['subscribe-user', 'subscribe-superuser', 'subscribe-broadcast']
     publish_channels = ['publish-user', 'publish-broadcast']
 
+    def __init__(self, connection, expire=settings.WS4REDIS_EXPIRE,
+                 max_history=None, history_expire=None):
+        """
+        Arguments:
+            connection: StrictRedis connection.
+            expire: seconds the last message is kept, 0 to not keep it.
+            max_history: lines kept in the history of a channel.
+            history_expire: seconds the history is kept after the last line.
+        """
+        super(RedisHistoryStore, self).__init__(connection, expire)
+        options = settings.WEBSOCKETLOGGER
+        self.max_history = max_history or options.get('max_history', 10000)
+        self.history_expire = history_expire or options['expire_history']
+        self._publish_script = connection.register_script(PUBLISH_SCRIPT)
+        self._history_script = connection.register_script(HISTORY_SCRIPT)
+        self._since = 0
+        self._sent = dict()
+        self._namespace = None
+        self._patterns = []
+
     def subscribe_channels(self, request_or_config, channels, *args, **kwargs):
         """
         Initialize the channels used for subscribing and sending messages.
 
         This differs from the original RedisStore, in that there is no request
         object required. request_or_config can either be a request, or a dict
-        with keys: namespace and username.
+        with keys: namespace, username and optionally since.
+
+        since is the last sequence number the client has seen (the since
+        parameter of the websocket url); only later history lines are sent.
 
         Arguments:
             channels: a list, containing publish and subscribe channels.
@@ -37,28 +131,50 @@ class RedisHistoryStore(RedisStore):
                 a request object or dict containing keys:
                 namespace: usually an UUID string (key in redis)
                 username: string with username.
+                since: last sequence number seen, optional.
         """
         if isinstance(request_or_config, WSGIRequest):
             username = request_or_config.user.username
             match_ns = re_ns.match(request_or_config.path_info)
             namespace = match_ns.group(1)
+            self._since = parse_since(request_or_config.GET.get('since'))
         else:
             username = request_or_config['username']
             namespace = request_or_config['namespace']
+            self._since = parse_since(request_or_config.get('since'))
+
+        self._subscription = self._connection.pubsub()
+        for pattern in self.set_channels(username, namespace, channels):
+            self._subscription.psubscribe(pattern)
+            # old style subscribe
+            #self._subscription.subscribe(pattern)
+
+    def set_channels(self, username, namespace, channels, since=None):
+        """
+        Sets the channels to publish on and returns the patterns to
+        subscribe to, without subscribing.
+
+        Description:
+            Used by subscribe_channels, and by the websocket gateway which
+            subscribes all its clients through one connection.
 
+        Returns:
+            list of patterns.
+        """
         def subscribe_for(prefix):
             key = '{0}{1}'.format(prefix, namespace)
             logger.debug('Subscribing to key: {0}'.format(key))
-            self._subscription.psubscribe(key)
-            # old style subscribe
-            #self._subscription.subscribe(key)
+            self._patterns.append(key)
 
         def publish_on(prefix):
             key = '{0}{1}'.format(prefix, namespace)
             logger.debug('Publishing to key: {0}'.format(key))
             self._publishers.add(key)
 
-        self._subscription = self._connection.pubsub()
+        if since is not None:
+            self._since = parse_since(since)
+        self._namespace = namespace
+        self._patterns = []
         self._publishers = set()
         if 'subscribe-user' in channels and username:
             subscribe_for('{0}:'.format(username))
@@ -71,46 +187,103 @@ class RedisHistoryStore(RedisStore):
             publish_on('{0}:'.format(username))
         if 'publish-broadcast' in channels:
             publish_on('_broadcast_:')
+        return self._patterns
 
     def publish_message(self, message):
-        super(RedisHistoryStore, self).publish_message(message)
+        self.publish_messages([message])
+
+    def publish_messages(self, messages):
+        """
+        Publishes messages and appends them to the history.
+
+        Description:
+            Every line gets the next sequence number of its channel, and is
+            published and stored as "<seq>\\x1e<line>" (see split_message).
+            One script per channel does this atomically: readers see whole
+            batches, and the history is a contiguous range of sequence
+            numbers. The scripts of all channels are sent in one pipeline.
+            The history is trimmed to max_history lines, and expires
+            history_expire seconds after the last update.
+        """
+        messages = [m for m in messages if m]
+        if not messages:
+            return
+        pipeline = self._connection.pipeline(transaction=False)
         for channel in self._publishers:
-            self._connection.rpush('{0}:hist'.format(channel), message)
-            self._connection.expire(channel, 3600)
+            self._publish_script(
+                keys=[
+                    channel,
+                    '{0}:hist'.format(channel),
+                    '{0}:seq'.format(channel),
+                    registry_key(self._namespace),
+                ],
+                args=[self.max_history, self.history_expire,
+                      self._expire or 0] + messages,
+                client=pipeline
+            )
+        pipeline.execute()
 
     def get_history_key(self, pattern):
         """
         Get key which contains history
-        Raises:
-            Exception on multiple keys
+
+        Description:
+            Looks in the registry of the namespace in pattern
+            ("<prefix>:<namespace>:hist"), instead of scanning all keys.
+
         Returns:
             key name, or None
-
         """
         logger.debug('Get history key for "{0}"'.format(pattern))
-        keys = self._connection.keys(pattern)
-        return self._connection.keys(pattern)[0] if keys else None
+        namespace = pattern[:-len(':hist')].rsplit(':', 1)[-1]
+        keys = self._connection.smembers(registry_key(namespace))
+        keys = sorted(k for k in keys if fnmatchcase(k, pattern))
+        return keys[0] if keys else None
 
-    def send_persisted_messages(self, websocket, *args, **kwargs):
+    def get_history(self, key, since=0):
         """
-        Sends message persisted (string), but also sends history stored (list).
+        Returns the history lines of key after sequence number since.
         """
-        super(RedisHistoryStore, self).send_persited_messages(websocket, *args, **kwargs)
-        logger.info('sending persistent msgs for channels: {0}'.format(self._subscription.channels))
+        return self._history_script(keys=[key], args=[since])
 
-        # We swapped channels for patterns
-        # for channel in self._subscription.channels:
-        #     logger.info('sending persistent msgs: {0}'.format(channel))
-        #     history = self._connection.lrange('{0}:hist'.format(channel), 1, -1)
-        #     [websocket.send(msg) for msg in history if history]
-        #     #logger.info([msg for msg in history if history])
+    def send_persisted_messages(self, websocket, *args, **kwargs):
+        """
+        Sends the history lines the client has not seen yet.
 
-        for channel in self._subscription.patterns:
+        Description:
+            Only lines after the sequence number in the since parameter of
+            the websocket url are sent. The last sequence number sent is
+            remembered per channel, so filter_message can drop published
+            lines which were already sent from the history.
+        """
+        for channel in self._patterns:
             logger.info('sending persistent msgs: {0}'.format(channel))
             key = self.get_history_key('{0}:hist'.format(channel))
-            history = self._connection.lrange(key, 1, -1)
-            [websocket.send(msg) for msg in history if history]
+            if key is None:
+                continue
+            history = self.get_history(key, self._since)
+            for message in history:
+                websocket.send(message)
+            if history:
+                self._sent[key[:-len(':hist')]] = split_message(history[-1])[0]
 
+    def last_sent(self, channel):
+        """
+        Returns the last sequence number sent of channel, or None.
+        """
+        return self._sent.get(channel)
+
+    def filter_message(self, channel, message):
+        """
+        Returns published message, or None if it was sent already.
+        """
+        seq = split_message(message)[0]
+        if seq is not None:
+            if seq <= self._sent.get(channel, 0):
+                return None
+            # A channel can match more than one subscribed pattern.
+            self._sent[channel] = seq
+        return message
 
     # fix typo in original code
     send_persited_messages = send_persisted_messages
@@ -0,0 +1,204 @@
+"""
+Host side cache of svn exports, shared read-only with the containers.
+
+Description:
+    An entry is an export of (repository url, revision) in
+    settings.CONTAINER['svn_cache_dir']. That directory is bind mounted
+    read-only in every container at SVN_CACHE_MOUNT (see
+    templates/containers/domain.xml), so jobs at the same revision do not
+    transfer anything.
+
+    Jobs hold a shared lock on the entries they use until they are done.
+    When the cache grows beyond settings.CONTAINER['svn_cache_budget'] bytes,
+    the least recently used entries which are not locked are removed.
+"""
+from __future__ import unicode_literals
+from django.conf import settings
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import time
+
+from openearth.libs import svn
+
+logger = logging.getLogger(__name__)
+
+SVN_CACHE_MOUNT = '/home/worker/svn-cache'
+
+
+def directory_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return size
+
+
+class CacheEntry(object):
+    """
+    Export of url at revision, in use by a job until release() is called.
+    """
+    def __init__(self, cache, key, lock_fp):
+        self.cache = cache
+        self.key = key
+        self.lock_fp = lock_fp
+
+    @property
+    def path(self):
+        return os.path.join(self.cache.cache_dir, self.key)
+
+    @property
+    def container_path(self):
+        return os.path.join(SVN_CACHE_MOUNT, self.key)
+
+    def link_command(self, path):
+        """
+        Returns command which links path in the container to the entry.
+        """
+        return ['/bin/ln', '-sfn', self.container_path, path]
+
+    def release(self):
+        if self.lock_fp:
+            self.lock_fp.close()
+            self.lock_fp = None
+
+
+class SvnExportCache(object):
+
+    def __init__(self, cache_dir, budget):
+        """
+        Arguments:
+            cache_dir: directory of the entries.
+            budget: maximum size of all entries, in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.budget = budget
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Returns the configured cache, or None if it is disabled.
+        """
+        cache_dir = settings.CONTAINER.get('svn_cache_dir')
+        if not cache_dir:
+            return None
+        return cls(cache_dir, settings.CONTAINER.get('svn_cache_budget'))
+
+    @staticmethod
+    def make_key(url, revision):
+        return '{0}-r{1}'.format(
+            hashlib.sha1(url.encode('utf-8')).hexdigest(),
+            revision
+        )
+
+    def lock_path(self, key):
+        return os.path.join(self.cache_dir, key + '.lock')
+
+    def size_path(self, key):
+        return os.path.join(self.cache_dir, key + '.size')
+
+    def get(self, url, username, password, revision=None, job_logger=None):
+        """
+        Returns the CacheEntry of url at revision, exports it if needed.
+
+        Description:
+            Without revision, the revision in which url was last changed is
+            used, so HEAD is cached until the url changes. Concurrent jobs
+            wait for the one which exports.
+        """
+        job_logger = job_logger or logger
+        revision = svn.last_changed_revision(url, username, password,
+                                             revision)
+        key = self.make_key(url, revision)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        lock_fp = open(self.lock_path(key), 'a')
+        try:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            if os.path.isdir(os.path.join(self.cache_dir, key)):
+                job_logger.info('Using cached export of {0}@{1}'.format(
+                    url, revision
+                ))
+            else:
+                self.export(url, username, password, revision, key,
+                            job_logger)
+            os.utime(os.path.join(self.cache_dir, key), None)
+            # Downgrade; other jobs can use the entry, eviction can not.
+            fcntl.flock(lock_fp, fcntl.LOCK_SH)
+        except:
+            lock_fp.close()
+            raise
+
+        self.evict()
+        return CacheEntry(self, key, lock_fp)
+
+    def export(self, url, username, password, revision, key, job_logger):
+        path = os.path.join(self.cache_dir, key)
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        job_logger.info('Exporting {0}@{1} to cache'.format(url, revision))
+        start = time.time()
+        try:
+            svn.export(url, tmp_path, username, password, revision)
+        except svn.SvnException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        with open(self.size_path(key), 'w') as fp:
+            fp.write(str(directory_size(tmp_path)))
+        os.rename(tmp_path, path)
+        job_logger.info('Exported {0}@{1} in {2:.1f}s'.format(
+            url, revision, time.time() - start
+        ))
+
+    def entries(self):
+        """
+        Returns list of (last used, size, key), least recently used first.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp') or not os.path.isdir(path):
+                continue
+            try:
+                with open(self.size_path(name)) as fp:
+                    size = int(fp.read())
+            except (IOError, ValueError):
+                size = directory_size(path)
+            entries.append((os.stat(path).st_mtime, size, name))
+        return sorted(entries)
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits the budget.
+
+        Returns:
+            List of removed keys.
+        """
+        if not self.budget:
+            return []
+        entries = self.entries()
+        total = sum(size for used, size, key in entries)
+        removed = []
+        for used, size, key in entries:
+            if total <= self.budget:
+                break
+            with open(self.lock_path(key), 'a') as lock_fp:
+                try:
+                    fcntl.flock(lock_fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    continue  # In use by a job.
+                shutil.rmtree(os.path.join(self.cache_dir, key))
+                # The lock file stays; a job may be waiting on it.
+                if os.path.exists(self.size_path(key)):
+                    os.remove(self.size_path(key))
+            total -= size
+            removed.append(key)
+            logger.info('Evicted {0} from svn cache'.format(key))
+        return removed
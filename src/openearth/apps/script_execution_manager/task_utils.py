@@ -2,6 +2,7 @@ from __future__ import unicode_literals
 from django.conf import settings
 from filer.models import File
 import os
+import sys
 import time
 import redis
 import re
@@ -9,6 +10,7 @@ from celery.utils.log import get_task_logger
 from ws4redis import settings as redis_settings
 from django.core.files import File as DjangoFile
 
+from .commit_worker import CommitError
 from .container import LibVirtDomain
 from .container import LibVirtDomainException
 
@@ -17,39 +19,62 @@ _redis_connection = redis.StrictRedis(**redis_settings.WS4REDIS_CONNECTION)
 logger = get_task_logger(__name__)
 
 
-def wait_for_ip(lv):
+def commit_file(committer, filename, kind, job_logger):
     """
-    Tries to get IP until domain has one, or max_tries is reached.
+    Commits one result file and logs how long it took.
+
+    Description:
+        Used by the commit task, also from its worker threads. A CommitError
+        is logged as a warning, other exceptions as an error.
+
+    Arguments:
+        committer: CommitBase object.
+        filename: name of the file, used in log messages.
+        kind: description of the file type, used in log messages.
+        job_logger: logger of the job.
+
+    Returns:
+        tuple (filename, seconds, exc_info or None). exc_info is the
+        sys.exc_info() of the error, so it can be raised with its traceback.
     """
-    logger.info('Getting ip for mac address "{0}"...'.format(lv.network_mac_address))
-    max_tries = 40
-    while max_tries:
-        time.sleep(1)
-        try:
-            ip = lv.get_ip_address()
-            logger.info('Got ip "{0}"'.format(ip))
-            return ip
-        except LibVirtDomainException, e:
-            logger.info('{0}. {1} tries left.'.format(unicode(e), max_tries))
-        max_tries -= 1
-
-    raise ValueError('Tried a few times, but no IP found in "{0}."'.format(
-        lv.dnsmasq_leases
-    ))
+    start = time.time()
+    error = None
+    try:
+        committer.commit()
+    except CommitError, e:
+        error = sys.exc_info()
+        job_logger.warn(
+            'An error occurred while processing the {0} "{1}". {2}'.format(
+                kind, filename, e
+            )
+        )
+    except Exception, e:
+        error = sys.exc_info()
+        job_logger.error(
+            'Committing the {0} "{1}" failed. {2}'.format(kind, filename, e)
+        )
+    duration = time.time() - start
+    if error is None:
+        job_logger.info('Committed {0} "{1}" in {2:.2f}s'.format(
+            kind, filename, duration
+        ))
+    return filename, duration, error
 
 
 def cleanup(uuid, image):
     """
     Cleans up the environment for the task.
 
-    Tries to destroy the libvirt domain.
+    Tries to destroy the libvirt domain. If the job ran in a container of
+    the warm pool, that container is destroyed.
     TODO: manually check if image is gone. perhaps undo dhcp lease etc.
 
     Arguments:
         uuid: uuid of job as string.
         image: name of image used to run task.
     """
-    lv = LibVirtDomain(uuid=uuid, image=image)
+    from .pool import release_container
+    lv = LibVirtDomain(uuid=release_container(uuid) or uuid, image=image)
     try:
         logger.info("Destroying domain '{0}'".format(lv.get_instance_name()))
         lv.destroy()
@@ -2,17 +2,29 @@ from __future__ import unicode_literals
 from django.conf import settings
 import logging
 import os
+import pipes
 from celery.utils.log import get_task_logger
 from celery.signals import before_task_publish, after_task_publish, \
-    task_prerun, task_postrun, task_retry, task_success, task_failure, task_revoked
+    task_prerun, task_postrun, task_retry, task_success, task_failure, \
+    task_revoked, worker_ready
 import time
+from multiprocessing.pool import ThreadPool
 from .container import LibVirtDomain
-from .exec_wrapper import ExecWrapper, mark_secret
+from .exec_wrapper import mark_secret
 from .logger import WebsocketLoggerHandler
+from .models import ContainerPool
+from .pool import acquire_container, get_host, get_host_queue, get_pool, \
+    hand_over, replenish, trim
 from openearth.apps.script_execution_manager.commit_worker import CommitNetCDF, \
     CommitError, CommitKML, CommitCSV
 from openearth.celery import app
-from .task_utils import append_files, cleanup, wait_for_ip, create_results_dir
+from .readiness import wait_until_ready
+from .remote import RemoteExecutor
+from .resources import ResourceSampler, get_profile_name
+from .result_cache import find_cached_job, link_results, update_fingerprint
+from .scheduler import HeadroomReporter, get_scheduler
+from .svn_cache import SvnExportCache
+from .task_utils import append_files, cleanup, create_results_dir, commit_file
 logger = get_task_logger(__name__)
 from django.core.exceptions import ObjectDoesNotExist
 
@@ -81,10 +93,30 @@ def setup_logger(username, namespace, logfile_path):
     return child_logger
 
 
+def save_usage(job, usage, job_logger):
+    """
+    Stores the resource usage of the container on job.
+
+    Arguments:
+        job: ProcessingJob.
+        usage: dict, see resources.ResourceSampler.usage.
+        job_logger: logger of the job.
+    """
+    job.cpu_seconds = usage['cpu_seconds']
+    job.peak_cpu = usage['peak_cpu']
+    job.peak_memory = usage['peak_memory']
+    job.save(update_fields=['cpu_seconds', 'peak_cpu', 'peak_memory'])
+    job_logger.info(
+        'Used {0:.1f} CPU seconds, at most {1:.2f} cores and {2:.0f} MiB '
+        'memory'.format(usage['cpu_seconds'], usage['peak_cpu'],
+                        usage['peak_memory'] / 1024.0 / 1024)
+    )
+
+
 @app.task()
 def run_script(namespace, username, image, interpreter, script_name, svn_url,
                svn_script_path, revision, script_revision, open_earth_tools,
-               open_earth_revision):
+               open_earth_revision, parameters=''):
     """
     Start container, ssh into it and run script.
 
@@ -106,32 +138,57 @@ def run_script(namespace, username, image, interpreter, script_name, svn_url,
         script_name: TBD
         open_earth_tools: Boolean which indicates if open_earth_tools have to be
             checked out.
+        parameters: JSON object, given to the script in the environment
+            variable DATALAB_PARAMETERS.
 
     """
     from openearth.apps.processing.models import ProcessingJob
+    scheduler = get_scheduler()
+    if not scheduler.admit(namespace, username, image):
+        # Not enough free resources on this host (anymore).
+        raise run_script.retry(
+            countdown=settings.SCHEDULER['retry_countdown'], max_retries=None
+        )
     obj = ProcessingJob.objects.get(uuid=namespace)
     obj.set_status('RUNNING')
+    obj.resource_profile = get_profile_name(image)
+    obj.save(update_fields=['resource_profile'])
 
     results_dir = create_results_dir(uuid=namespace)
     log_file_path = os.path.join(results_dir, 'run.log')
     logger = setup_logger(
         username=username, namespace=namespace, logfile_path=log_file_path
     )
-    logger.info('Defining processing environment')
-    lv = LibVirtDomain(
-        uuid=namespace,
-        image=image,
-        external_logger=logger
-    )
+    launched = time.time()
+    cache_entries = []
+    sampler = None
+    container = acquire_container(image, namespace)
     try:
-        logger.info('Launching processing environment')
-        lv.create()
-        ip = wait_for_ip(lv)
-        logger.info('Wait until SSH server is started in container')
-        time.sleep(15)
-
-        commands = []
-        commands.append([
+        if container:
+            logger.info('Using pre-booted processing environment')
+            lv = hand_over(container, namespace, external_logger=logger)
+            ip = container.ip_address
+        else:
+            logger.info('Defining processing environment')
+            lv = LibVirtDomain(
+                uuid=namespace,
+                image=image,
+                external_logger=logger
+            )
+            logger.info('Launching processing environment')
+            lv.create()
+            logger.info('Wait until container has an ip address and its SSH '
+                        'server is started')
+            ip, ip_seconds, ssh_seconds = wait_until_ready(lv)
+            logger.info('Got ip "{0}" after {1:.1f}s, SSH ready after '
+                        '{2:.1f}s'.format(ip, ip_seconds, ssh_seconds))
+        obj.ready_seconds = time.time() - launched
+        obj.save(update_fields=['ready_seconds'])
+        if get_pool(image):
+            replenish_pools(image, [get_host()])
+
+        checkout = []
+        checkout.append([
             '/usr/bin/svn', 'co', svn_url, '/home/worker/svn',
             '--revision', str(revision),
             '--username', mark_secret(settings.ENVIRONMENT_SVN_USERNAME),
@@ -140,7 +197,7 @@ def run_script(namespace, username, image, interpreter, script_name, svn_url,
         ])
 
         if script_revision and script_revision != revision:
-            commands.append([
+            checkout.append([
                 '/usr/bin/svn', 'co', svn_url + svn_script_path,
                 '/home/worker/svn/' + svn_script_path,
                 '--revision', str(script_revision),
@@ -148,17 +205,19 @@ def run_script(namespace, username, image, interpreter, script_name, svn_url,
                 '--password', mark_secret(settings.ENVIRONMENT_SVN_PASSWORD),
                 '--non-interactive', '--trust-server-cert'
             ])
-        commands.append([
+        inventory = []
+        inventory.append([
             '/usr/bin/yum', 'list', 'installed', '>',
             '/home/worker/results/installed_rpms.txt'
         ])
-        commands.append([
+        inventory.append([
             '/opt/python2.7/bin/pip', 'freeze', '>',
             '/home/worker/results/installed_python_packages.txt'
         ])
         #[interpreter, '/home/worker/svn/scripts/{0}'.format(script_name)]
         # Should be (A migration plan should be made as well. (do it
         # manually?)):
+        tools = []
         if open_earth_tools:
             command_parts = [
                 '/usr/bin/svn', 'co', '--non-interactive',
@@ -169,7 +228,7 @@ def run_script(namespace, username, image, interpreter, script_name, svn_url,
                     '--revision', str(open_earth_tools),
                 ]
 
-            commands.append(command_parts + [
+            tools.append(command_parts + [
                 '--username', mark_secret(
                     settings.OPEN_EARTH_TOOLS_MATLAB_USERNAME),
                 '--password', mark_secret(
@@ -177,7 +236,7 @@ def run_script(namespace, username, image, interpreter, script_name, svn_url,
                 settings.OPEN_EARTH_TOOLS_MATLAB_URL,
                 settings.OPEN_EARTH_TOOLS_MATLAB_PATH,
             ])
-            commands.append(command_parts + [
+            tools.append(command_parts + [
                 '--username', mark_secret(
                     settings.OPEN_EARTH_TOOLS_PYTHON_USERNAME),
                 '--password', mark_secret(
@@ -187,27 +246,60 @@ def run_script(namespace, username, image, interpreter, script_name, svn_url,
             ])
         # oe tools: https://svn.oss.deltares.nl/repos/openearthtools/trunk/matlab/
         #/opt/matlab/bin/matlab  -nosplash -nodisplay -r "run('oetsettings');run('{script_path}');exit"
-        commands.append([interpreter.format(script_path='/home/worker/svn/scripts/{0}'.format(script_name))])
-
-        home_dir = os.path.expanduser("~")
-        ssh_command = [
-            '/usr/bin/ssh',
-            "-oStrictHostKeyChecking=no",
-            "-oUserKnownHostsFile=/dev/null",
-            "-i", "{0}/.ssh/id_rsa_worker".format(home_dir),
-            "worker@{0}".format(ip)
-        ]
-        for c in commands:
-            logger.info('Executing command "{0}"'.format(c))
-            command = ssh_command + c
-            ew = ExecWrapper(
-                command=command,
+        script = [interpreter.format(script_path='/home/worker/svn/scripts/{0}'.format(script_name))]
+        if parameters:
+            script.insert(0, 'DATALAB_PARAMETERS={0}'.format(
+                pipes.quote(parameters)))
+
+        # With the svn cache, checkouts become links to exports on the host.
+        # A script revision other than the data revision is checked out as
+        # before; it can not be written into the read-only export.
+        svn_cache = SvnExportCache.from_settings()
+        script_override = script_revision and script_revision != revision
+        if svn_cache and not script_override:
+            entry = svn_cache.get(
+                svn_url,
+                settings.ENVIRONMENT_SVN_USERNAME,
+                settings.ENVIRONMENT_SVN_PASSWORD,
+                revision,
+                job_logger=logger
             )
-            for stdout_stderr in ew.start_process():
-                logger.info(stdout_stderr)
+            cache_entries.append(entry)
+            checkout = [entry.link_command('/home/worker/svn')]
+        if svn_cache and open_earth_tools:
+            tools = [['/bin/mkdir', '-p', settings.OPEN_EARTH_TOOLS_PATH]]
+            for prefix in ('OPEN_EARTH_TOOLS_MATLAB',
+                           'OPEN_EARTH_TOOLS_PYTHON'):
+                entry = svn_cache.get(
+                    getattr(settings, prefix + '_URL'),
+                    getattr(settings, prefix + '_USERNAME'),
+                    getattr(settings, prefix + '_PASSWORD'),
+                    open_earth_revision,
+                    job_logger=logger
+                )
+                cache_entries.append(entry)
+                tools.append(
+                    entry.link_command(getattr(settings, prefix + '_PATH'))
+                )
+
+        # The checkout, the environment inventory and the tools checkout are
+        # independent; they run at the same time over one SSH connection.
+        sampler = ResourceSampler(lv.domain)
+        sampler.start()
+        with RemoteExecutor(ip, job_logger=logger) as remote:
+            remote.run_concurrently(checkout, inventory, tools)
+            remote.run(script)
     except Exception as e:
         logger.error(str(e))
         raise e
+    finally:
+        for entry in cache_entries:
+            entry.release()
+        if sampler:
+            sampler.stop()
+            save_usage(obj, sampler.usage(), logger)
+        scheduler.release(namespace)
+        scheduler.dispatch()
 
     logger.info('Cleaning image')
     cleanup(uuid=namespace, image=image)
@@ -217,6 +309,157 @@ def run_script(namespace, username, image, interpreter, script_name, svn_url,
     return True
 
 
+@app.task()
+def schedule_job(namespace):
+    """
+    Queues a ProcessingJob in the scheduler and dispatches what fits.
+
+    Arguments:
+        namespace: uuid of ProcessingJob
+    """
+    from openearth.apps.processing.models import ProcessingJob
+    obj = ProcessingJob.objects.get(uuid=namespace)
+    if obj.status >= obj.STATUS.STARTED:
+        # Stopped before it was due, or started already.
+        return False
+    if finish_from_cache(obj):
+        return True
+    scheduler = get_scheduler()
+    scheduler.submit(
+        namespace,
+        obj.environment.author.username,
+        obj.environment.libvirt_image.libvirt_image
+    )
+    obj.set_status('SCHEDULED')
+    scheduler.dispatch()
+    return True
+
+
+def finish_from_cache(obj):
+    """
+    Gives a job the results of a finished job with the same inputs.
+
+    Description:
+        Stores the fingerprint of the job's inputs (see result_cache). When a
+        finished job has the same fingerprint, its results are linked and
+        the commit task is sent; the job does not wait in the scheduler.
+        The results of a job of the same environment are committed already,
+        commit skips them.
+
+    Arguments:
+        obj: ProcessingJob, not started yet.
+
+    Returns:
+        True if the job got the results of another job.
+    """
+    update_fingerprint(obj)
+    cached = find_cached_job(obj)
+    if cached is None:
+        return False
+    results_dir = create_results_dir(uuid=obj.uuid)
+    logger = setup_logger(
+        username=obj.environment.author.username,
+        namespace=obj.uuid,
+        logfile_path=os.path.join(results_dir, 'run.log')
+    )
+    logger.info('Inputs are unchanged since job {0}, using its '
+                'results'.format(cached.uuid))
+    obj.set_status('RUNNING')
+    link_results(cached, obj, logger)
+    obj.commit_signature().apply_async(args=[{
+        'cached_from': cached.uuid,
+        'skip_commit': cached.environment_id == obj.environment_id,
+    }])
+    return True
+
+
+@app.task()
+def schedule_batch(batch_id):
+    """
+    Starts a ProcessingBatch: schedules its first jobs.
+
+    Arguments:
+        batch_id: pk of ProcessingBatch
+    """
+    from openearth.apps.processing.models import ProcessingBatch
+    batch = ProcessingBatch.objects.get(pk=batch_id)
+    if batch.reuse_containers:
+        batch.resize_pool(grow=True)
+    return batch.advance()
+
+
+@app.task()
+def advance_batch(batch_id):
+    """
+    Schedules the next jobs of a ProcessingBatch, see ProcessingBatch.advance.
+
+    Arguments:
+        batch_id: pk of ProcessingBatch
+    """
+    from openearth.apps.processing.models import ProcessingBatch
+    return ProcessingBatch.objects.get(pk=batch_id).advance()
+
+
+@app.task()
+def refresh_log_index(index_id, username, password):
+    """
+    Adds the new revisions of an svn url to its log index.
+
+    Description:
+        The first refresh of a large repository takes minutes, too long for
+        a request. See SvnLogIndex.for_url.
+
+    Arguments:
+        index_id: pk of SvnLogIndex
+        username, password: credentials of its url.
+
+    Returns:
+        Number of added revisions.
+    """
+    from openearth.apps.processing.models import SvnLogIndex
+    return SvnLogIndex.objects.get(pk=index_id).refresh(
+        username, password, force=True)
+
+
+@app.task()
+def replenish_pool(image, host=None):
+    """
+    Boots containers until the pool of image is full again, or destroys the
+    ready containers beyond its size when it shrank.
+
+    Arguments:
+        image: filename of image in containers dir.
+        host: host to boot the containers on. Other hosts skip the task.
+
+    Returns:
+        Number of booted containers.
+    """
+    if host and host != get_host():
+        return 0
+    # Also a disabled pool (size 0), its containers are destroyed.
+    pool = ContainerPool.objects.filter(image=image).first()
+    if pool is None:
+        return 0
+    trim(pool)
+    return replenish(pool)
+
+
+def replenish_pools(image, hosts=None):
+    """
+    Sends replenish_pool of image to the queue of each host.
+
+    Arguments:
+        image: filename of image in containers dir.
+        hosts: names of the hosts, default the hosts which reported to the
+            scheduler recently.
+    """
+    if hosts is None:
+        hosts = get_scheduler().get_reports().keys()
+    for host in hosts:
+        replenish_pool.apply_async(args=[image, host],
+                                   queue=get_host_queue(host))
+
+
 @before_task_publish.connect()
 def after_task_publish_handler(sender=None, body=None, **kwargs):
     if sender == 'openearth.apps.script_execution_manager.tasks.run_script':
@@ -229,6 +472,28 @@ def after_task_publish_handler(sender=None, body=None, **kwargs):
             pass
 
 
+@worker_ready.connect
+def worker_ready_handler(sender=None, **kwargs):
+    """
+    Starts reporting the headroom of this host to the scheduler, and consumes
+    the queue of this host (see pool.get_host_queue).
+    """
+    queues = list(sender.app.amqp.queues.consume_from)
+    HeadroomReporter(get_scheduler(), queues).start()
+    sender.add_task_queue(get_host_queue())
+
+
+@task_postrun.connect
+def task_postrun_handler(task_id, task, *args, **kwargs):
+    """
+    Publishes the websocket log lines still buffered for the task.
+    """
+    namespace = (kwargs.get('kwargs') or {}).get('namespace')
+    if namespace:
+        for handler in logger.getChild(str(namespace)).handlers:
+            handler.flush()
+
+
 @task_prerun.connect
 def task_prerun_handler(task_id, task, *args, **kwargs):
     from openearth.apps.processing.models import ProcessingJob
@@ -267,6 +532,7 @@ def task_revoked_handler(request, sender, *args, **kwargs):
         pass
 
     logger.warn("Task '{0}' REVOKED, cleaning environment.".format(request.task_id))
+    get_scheduler().release(request.task_id)
     logger.warn("Sender: {0}".format(sender.name))
     logger.warn("Request.name: {0}".format(request.name))
     try:
@@ -316,16 +582,29 @@ def task_failure_handler(sender, task_id, *args, **kwargs):
         }
     }
     """
+    from openearth.apps.processing.models import ProcessingJob
     obj = None
-    results_dir = create_results_dir(uuid=kwargs['kwargs']['namespace'])
+    task_kwargs = kwargs.get('kwargs') or {}
+    namespace = task_kwargs.get('namespace')
+    if not namespace:
+        # Only run_script and commit run in a job's results dir. A job whose
+        # schedule_job failed never reached a worker; it leaves the queue.
+        if sender.name == schedule_job.name and kwargs.get('args'):
+            namespace = kwargs['args'][0]
+            get_scheduler().release(namespace)
+            try:
+                ProcessingJob.objects.get(uuid=namespace).set_status(
+                    'FAILURE')
+            except ObjectDoesNotExist:
+                pass
+        return
+    results_dir = create_results_dir(uuid=namespace)
     log_file_path = os.path.join(results_dir, 'run.log')
-    namespace = kwargs['kwargs']['namespace']
     logger = setup_logger(
-        username=kwargs['kwargs']['username'],
+        username=task_kwargs['username'],
         namespace=namespace,
         logfile_path=log_file_path
     )
-    from openearth.apps.processing.models import ProcessingJob
     try:
         obj = ProcessingJob.objects.get(uuid=namespace)
         obj.set_status('FAILURE')
@@ -337,6 +616,7 @@ def task_failure_handler(sender, task_id, *args, **kwargs):
 
     logger.info('sender: {0}'.format(sender))
     logger.warn("Task '{0}' FAILED, cleaning environment.".format(task_id))
+    get_scheduler().release(namespace)
     logger.warn("Running failure hander for id '{0}'".format(namespace))
     logger.warn("Sender: {0}".format(sender.name))
     try:
@@ -346,7 +626,7 @@ def task_failure_handler(sender, task_id, *args, **kwargs):
         logger.error('Continue to force cleanup. ')
     if obj:
         try:
-            image = obj.environment.libvirt_image
+            image = obj.environment.libvirt_image.libvirt_image
             logger.info("Destroying image 'instance-{0}'".format(namespace))
             # cleanup(uuid=task_id, image=kwargs['kwargs']['image'])
             cleanup(uuid=namespace, image=image)
@@ -355,7 +635,7 @@ def task_failure_handler(sender, task_id, *args, **kwargs):
                 type(e).__name__, str(e))
             )
     logger.info("Task failure handler '{0}' finished.".format(task_id))
-    logger.info("Job '{0}' FAILED.".format(kwargs['kwargs']['namespace']))
+    logger.info("Job '{0}' FAILED.".format(namespace))
 
 
 @app.task()
@@ -367,6 +647,10 @@ def commit(prev_task_result, namespace, username, user_name=None, user_email=Non
     so it figures out if it's a nc or a csv file. netcdfs will be copied to the
     opendap dir. The netcdf processing_level argument will be updated to final.
 
+    NetCDF and KML files are committed concurrently, by at most
+    settings.COMMIT_CONCURRENCY threads. CSV files are imported one after
+    another. Duration and errors per file are written to the job log.
+
     This task has to be run on the host which has the file servers and db
     servers.
 
@@ -386,73 +670,100 @@ def commit(prev_task_result, namespace, username, user_name=None, user_email=Non
     )
     logger.info('Starting commit worker for: {0}'.format(namespace))
     job = ProcessingJob.objects.get(pk=namespace)
-
-    for result in job.processing_result.all():
-        file_ext = os.path.splitext(result.file.path)[1]
-        filename = os.path.basename(result.file.path)
-        logger.info('Try to commit file: {0}'.format(filename))
-        if file_ext == '.nc':
-            dest_dir = os.path.join(
-                settings.OPENDAP_DATA_DIR,
-                job.environment.repo
-            )
-            dest = os.path.join(dest_dir, filename)
-            if not os.path.exists(dest_dir):
-                os.makedirs(dest_dir)
-
-            logger.info('Adding file "{0}" to "{1}"'.format(
-                filename,
-                dest
-            ))
-            cncdf = CommitNetCDF(
-                source=result.file.path,
-                dest=dest,
-                processing_job=job.uuid,
-                published=True,
-                user_email=user_email,
-                user_name=user_name
-            )
-            try:
-                cncdf.commit()
-            except CommitError, e:
-                logger.warn(
-                    'An error occurred while processing the nc file. '
-                    '{0}'.format(e)
+    if isinstance(prev_task_result, dict) and \
+            prev_task_result.get('skip_commit'):
+        logger.info('Results of job {0} are committed already.'.format(
+            prev_task_result['cached_from']))
+        job.set_status('FINISHED')
+        return job.uuid
+
+    # NetCDF and KML commits do not touch the database and are run by a pool
+    # of threads. CSV files are imported one after another, in this thread.
+    pool = ThreadPool(processes=settings.COMMIT_CONCURRENCY)
+    pending = []
+    csv_commits = []
+    start = time.time()
+    try:
+        for result in job.processing_result.all():
+            file_ext = os.path.splitext(result.file.path)[1]
+            filename = os.path.basename(result.file.path)
+            logger.info('Try to commit file: {0}'.format(filename))
+            if file_ext == '.nc':
+                dest_dir = os.path.join(
+                    settings.OPENDAP_DATA_DIR,
+                    job.environment.repo
                 )
-        elif file_ext == '.csv': # Should be merged w orm_commit_worker branch
-            logger.info('Adding file "{0}" to database'.format(filename))
-            ccsv = CommitCSV(
-                source=result.file.path,
-                processing_job=job,
-                published=True
-            )
-            try:
-                ccsv.commit()
-            except CommitError, e:
-                print e
-                logger.warn(
-                    'An error occurred while processing the CSV file. '
-                    '{0}'.format(e)
+                dest = os.path.join(dest_dir, filename)
+                if not os.path.exists(dest_dir):
+                    os.makedirs(dest_dir)
+
+                logger.info('Adding file "{0}" to "{1}"'.format(
+                    filename,
+                    dest
+                ))
+                cncdf = CommitNetCDF(
+                    source=result.file.path,
+                    dest=dest,
+                    processing_job=job.uuid,
+                    published=True,
+                    user_email=user_email,
+                    user_name=user_name
                 )
+                pending.append(pool.apply_async(
+                    commit_file, (cncdf, filename, 'nc file', logger)
+                ))
+            elif file_ext == '.csv': # Should be merged w orm_commit_worker branch
+                logger.info('Adding file "{0}" to database'.format(filename))
+                ccsv = CommitCSV(
+                    source=result.file.path,
+                    processing_job=job,
+                    published=True
+                )
+                csv_commits.append((ccsv, filename))
                 # TODO: make results-directory traversal recursive. Integrate
                 # for netcdf as well.
-        if file_ext in settings.KML_FILE_EXTS:
-            dest_dir = os.path.join(
-                settings.KML_FILE_DIR,
-                job.environment.repo
-            )
-            logger.info('Adding file "{0}" to "{1}"'.format(filename, dest_dir))
-            dest = os.path.join(dest_dir, filename)
-            if not os.path.exists(dest_dir):
-                os.makedirs(dest_dir)
-
-            ckml = CommitKML(
-                source=result.file.path,
-                dest=dest,
-                processing_job=job,
-                published=True
-            )
-            ckml.commit()
+            if file_ext in settings.KML_FILE_EXTS:
+                dest_dir = os.path.join(
+                    settings.KML_FILE_DIR,
+                    job.environment.repo
+                )
+                logger.info('Adding file "{0}" to "{1}"'.format(filename, dest_dir))
+                dest = os.path.join(dest_dir, filename)
+                if not os.path.exists(dest_dir):
+                    os.makedirs(dest_dir)
+
+                ckml = CommitKML(
+                    source=result.file.path,
+                    dest=dest,
+                    processing_job=job,
+                    published=True
+                )
+                pending.append(pool.apply_async(
+                    commit_file, (ckml, filename, 'KML file', logger)
+                ))
+
+        results = [
+            commit_file(csv_commit, csv_filename, 'CSV file', logger)
+            for csv_commit, csv_filename in csv_commits
+        ]
+        results += [p.get() for p in pending]
+    finally:
+        pool.close()
+        pool.join()
+
+    failed = [r for r in results if r[2] is not None]
+    logger.info(
+        'Committed {0} files in {1:.2f}s ({2:.2f}s of work), {3} failed.'.format(
+            len(results),
+            time.time() - start,
+            sum(r[1] for r in results),
+            len(failed)
+        )
+    )
+    # CommitErrors are reported only, like before. Other errors fail the job.
+    for filename, duration, exc_info in failed:
+        if not isinstance(exc_info[1], CommitError):
+            raise exc_info[0], exc_info[1], exc_info[2]
     logger.info('Finished committing files.')
     job.set_status('FINISHED')
     return job.uuid
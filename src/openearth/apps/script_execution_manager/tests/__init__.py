@@ -2,6 +2,11 @@ from .management_commands import *
 from .commit_worker import *
 from .container import *
 from .exec_wrapper import *
+from .gateway import *
 from .logger import *
+from .resources import *
+from .scheduler import *
 from .store import *
 from .tasks import *
+from .svn_cache import *
+from .result_cache import *
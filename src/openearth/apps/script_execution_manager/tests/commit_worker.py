@@ -3,8 +3,11 @@ from django.db import connection
 from django.test import TestCase
 from factory import DjangoModelFactory
 import inspect
+import mock
 import os
 import re
+import shutil
+import tempfile
 from netCDF4 import Dataset
 import logging
 
@@ -104,28 +107,33 @@ class TestCommitCSV(TestCase):
             'quality': q.description,
             'unit': u.description
         }
-    # Mocking call_commit_command does not make sense if you'e testing it.
-    # And mocking is required, because it calls the management command with
-    # subprocess. Because this command is called with subprocess, the management
-    # command executes not in testing mode. So it uses production database.
-    # Not possible to test against.
-    #
-    # def test_call_commit_command(self):
-    #     data = [self.get_dictified_chunk_data(i) for i in range(3)]
-    #     print data
-    #
-    #     pj = ProcessingJobFactory()
-    #     ccsv = CommitCSV(source=self.test_data, processing_job=pj)
-    #
-    #     # dit werkt niet, omdat het command dat uitgevoerd wordt dus niet de
-    #     # test-database gebruikt. Mock: subprocess.Popen(cmd, stderr=subprocess.PIPE)?
-    #     ccsv.call_commit_command()
-    #     #for row in data:
-    #     #    self.assertIsInstance(
-    #     #        Observation.objects.get(compartment__description=row['compartment']),
-    #     #        Observation
-    #     #    )
-    #
+    def test_call_commit_command_logs_to_job_logger(self):
+        """
+        The CSV is imported in-process, on the test database. Errors of the
+        import end up in the job logger and raise a CommitError.
+        """
+        pj = ProcessingJobFactory()
+        ccsv = CommitCSV(
+            source=os.path.join(
+                os.path.dirname(__file__),
+                'files',
+                'test_data_broken.csv'
+            ),
+            processing_job=pj
+        )
+        job_logger = logging.getLogger(
+            'openearth.apps.script_execution_manager.tasks.{0}'.format(pj.pk)
+        )
+        with mock.patch.object(job_logger, 'log') as log, \
+                mock.patch.object(job_logger, 'error') as error:
+            self.assertRaises(CommitError, ccsv.call_commit_command)
+        self.assertIn(
+            'Compartment "compartment description 1" does not exist.',
+            error.call_args[0][0]
+        )
+        self.assertTrue(log.called)
+        self.assertEqual(0, Observation.objects.count())
+
     # def test_mark_published_marks_data_published(self):
     #     pass
     #
@@ -269,10 +277,47 @@ class TestCommitNetCDF(TestCase):
         cncdf = CommitNetCDF(source=source, dest=dest, processing_job=self.pj)
         self.assertRaisesRegexp(
             CommitError,
-            r'ncatted:\ ERROR\ file.*',
+            r'.*i_do_not_exist\.nc: .*',
             cncdf.mark_published
         )
 
+    def test_mark_published_failure_leaves_no_file(self):
+        """
+        A file which is not NetCDF raises a CommitError, dest and the
+        temporary copy are not created.
+        """
+        source = os.path.join(self.dest_data_dir, 'empty.nc')
+        open(source, 'w').close()
+        dest_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dest_dir)
+        cncdf = CommitNetCDF(
+            source=source,
+            dest=os.path.join(dest_dir, 'empty.nc'),
+            processing_job=self.pj
+        )
+        self.assertRaises(CommitError, cncdf.mark_published)
+        self.assertListEqual([], os.listdir(dest_dir))
+
+    def test_mark_published_keeps_history(self):
+        """
+        Like ncatted --history, the history attribute is not changed.
+        """
+        source = os.path.join(
+            self.source_data_dir,
+            'commit_results',
+            'jarkusKB117_3736.nc'
+        )
+        dest = os.path.join(self.dest_data_dir, 'jarkusKB117_3736.nc')
+        rootgrp = Dataset(filename=source, mode='r')
+        history = rootgrp.__dict__.get('history')
+        rootgrp.close()
+        cncdf = CommitNetCDF(source=source, dest=dest, processing_job=self.pj)
+        cncdf.mark_published()
+        rootgrp = Dataset(filename=dest, mode='r')
+        self.assertEqual(history, rootgrp.__dict__.get('history'))
+        self.assertEqual(str(self.pj.pk), rootgrp.getncattr('uuid'))
+        rootgrp.close()
+
     #
     # Second test mark published
     #
@@ -368,7 +413,7 @@ class TestCommitNetCDF(TestCase):
         cncdf = CommitNetCDF(source=source, dest=dest, processing_job=self.pj)
         self.assertRaisesRegexp(
             CommitError,
-            r'ncatted:\ ERROR\ file.*',
+            r'.*i_do_not_exist\.nc: .*',
             cncdf.mark_unpublished
         )
 
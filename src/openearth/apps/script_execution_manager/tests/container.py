@@ -2,6 +2,8 @@ from __future__ import unicode_literals
 from django.core.validators import validate_ipv46_address
 from django.conf import settings
 from django.test import TestCase
+from django.utils import timezone
+from datetime import timedelta
 import grp
 import time
 from uuid import uuid1
@@ -12,8 +14,20 @@ import mock
 import re
 import xml.etree.ElementTree as ET
 import shutil
+import socket
+import tempfile
+import threading
 
 from ..container import LibVirtDomain, LibVirtNet, LibVirtDomainException, logger as container_logger
+from ..models import ContainerPool, WarmContainer
+from ..pool import acquire_container, get_host, hand_over, \
+    release_container, replenish, trim
+from ..readiness import LeaseWatcher, ReadinessTimeout, ssh_banner, \
+    wait_for_ssh
+from ..tasks import replenish_pool, replenish_pools
+from ..provisioners import provision_image, provisioner_for_instance, \
+    ProvisionerUnavailable, ReflinkProvisioner, Qcow2Provisioner, \
+    OverlayProvisioner, SparseCopyProvisioner, LvmThinProvisioner
 
 logger = logging.getLogger(__name__)
 
@@ -260,6 +274,26 @@ class LibVirtTest(LibVirtTestMixin):
             "Mac addres undefined or incorrect"
         )
 
+    def test_render_xml_resource_profile(self):
+        """
+        The limits of the profile of the image are rendered.
+        """
+        container = dict(settings.CONTAINER)
+        container['resource_profiles'] = {
+            'large': {'vcpus': 4, 'memory': 16384, 'cpu_shares': 2048},
+        }
+        container['image_profiles'] = {'base_image': 'large'}
+        with self.settings(CONTAINER=container):
+            lv = LibVirtDomain(uuid=uuid1(), image='base_image',
+                               driver_uri='lxc:///')
+            root = ET.fromstring(lv.render_xml())
+        self.assertEqual(root.find('./vcpu').text, '4')
+        self.assertEqual(root.find('./memory').text, '16384')
+        self.assertEqual(
+            root.find('./memtune/swap_hard_limit').text, '16512')
+        self.assertEqual(root.find('./cputune/shares').text, '2048')
+        self.assertEqual(root.find('./blkiotune/weight').text, '500')
+
     def test_get_or_create_domain_defined_returned(self):
         """
         Tests if a domain is defined and returned
@@ -627,3 +661,293 @@ class LibVirtNetworkTest(LibVirtTestMixin):
                 lv.network.network.isActive(),
                 0
             )
+
+
+class ProvisionerTest(TestCase):
+    """
+    Tests choosing and falling back of instance image provisioners.
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.src = os.path.join(self.tmp_dir, 'base_image')
+        with open(self.src, 'wb') as fp:
+            fp.write(b'data')
+            fp.seek(1024 * 1024)
+            fp.write(b'end')
+        self.dst = os.path.join(self.tmp_dir, 'instance-1')
+
+    def test_provision_image_falls_back_to_copy(self):
+        """
+        Unavailable provisioners are skipped, the sparse copy always works.
+        The chosen provisioner is logged, between imgcopy info lines.
+        """
+        log = mock.MagicMock()
+        with mock.patch.object(ReflinkProvisioner, 'provision',
+                               side_effect=ProvisionerUnavailable('no')):
+            provisioner = provision_image(
+                self.src, self.dst, log,
+                {'provisioners': ('reflink', 'lvm-thin', 'overlay')}
+            )
+        self.assertIsInstance(provisioner, SparseCopyProvisioner)
+        with open(self.src, 'rb') as fsrc, open(self.dst, 'rb') as fdst:
+            self.assertEqual(fsrc.read(), fdst.read())
+        lines = [c[0][0] for c in log.info.call_args_list]
+        self.assertEqual(lines[0], '[# 0% imgcopy info #] Provisioning image')
+        self.assertTrue(lines[-2].startswith('Image provisioned with copy'))
+        self.assertEqual(lines[-1], '[# 100% imgcopy info #] Image provisioned')
+
+    def test_provision_image_progress_of_reflink(self):
+        """
+        Backends without progress lines of their own still log the start and
+        the end of provisioning.
+        """
+        log = mock.MagicMock()
+        with mock.patch.object(ReflinkProvisioner, 'provision'):
+            provision_image(self.src, self.dst, log,
+                            {'provisioners': ('reflink',)})
+        lines = [c[0][0] for c in log.info.call_args_list]
+        self.assertEqual(
+            [l for l in lines if 'imgcopy info' in l],
+            ['[# 0% imgcopy info #] Provisioning image',
+             '[# 100% imgcopy info #] Image provisioned']
+        )
+
+    def test_overlay_requires_directory(self):
+        provisioner = OverlayProvisioner(self.src, self.dst, mock.MagicMock())
+        self.assertRaises(ProvisionerUnavailable, provisioner.provision)
+        self.assertFalse(os.path.exists(self.dst))
+
+    def test_lvm_thin_removes_volume_before_link(self):
+        """
+        The link to the volume stays when lvremove fails, so a retry finds it.
+        """
+        os.symlink(self.src, self.dst)
+        provisioner = LvmThinProvisioner(self.src, self.dst, mock.MagicMock(),
+                                         volume_group='vg')
+        with mock.patch('openearth.apps.script_execution_manager.provisioners'
+                        '.run', side_effect=ProvisionerUnavailable('busy')):
+            self.assertRaises(ProvisionerUnavailable, provisioner.remove)
+        self.assertTrue(os.path.lexists(self.dst))
+
+        with mock.patch('openearth.apps.script_execution_manager.provisioners'
+                        '.run') as run:
+            provisioner.remove()
+        run.assert_called_once_with(
+            ['lvremove', '--force', os.path.realpath(self.src)])
+        self.assertFalse(os.path.lexists(self.dst))
+
+    @mock.patch('libvirt.open')
+    def test_destroy_removes_image_last(self, libvirt_open):
+        """
+        The instance image is removed after the domain is destroyed and
+        undefined.
+        """
+        calls = mock.MagicMock()
+        domain = libvirt_open.return_value.lookupByName.return_value
+        calls.attach_mock(domain.destroy, 'destroy')
+        calls.attach_mock(domain.undefine, 'undefine')
+        with self.settings(CONTAINER=dict(settings.CONTAINER,
+                                          base_dir=self.tmp_dir)):
+            lv = LibVirtDomain(uuid='1', image='base_image')
+            with mock.patch.object(LibVirtDomain,
+                                   'delete_instance_image') as delete:
+                calls.attach_mock(delete, 'delete_instance_image')
+                lv.destroy()
+        self.assertEqual([c[0] for c in calls.mock_calls],
+                         ['destroy', 'undefine', 'delete_instance_image'])
+
+    def test_provisioner_for_instance(self):
+        """
+        The provisioner of an existing instance image is derived from disk.
+        """
+        shutil.copy(self.src, self.dst)
+        self.assertIsInstance(
+            provisioner_for_instance(self.dst, logger, {}),
+            SparseCopyProvisioner
+        )
+        with open(self.dst, 'wb') as fp:
+            fp.write(Qcow2Provisioner.magic)
+        self.assertIsInstance(
+            provisioner_for_instance(self.dst, logger, {}),
+            Qcow2Provisioner
+        )
+
+
+class ContainerPoolTest(TestCase):
+    """
+    Tests leasing containers of the warm pool, without booting them.
+    """
+    def setUp(self):
+        self.pool = ContainerPool.objects.create(image='test.img', size=2)
+
+    def create_container(self, **kwargs):
+        defaults = dict(
+            pool=self.pool,
+            uuid=str(uuid1()),
+            host=get_host(),
+            state=WarmContainer.READY,
+            ip_address='192.168.122.2'
+        )
+        defaults.update(kwargs)
+        return WarmContainer.objects.create(**defaults)
+
+    def test_acquire_counts_hits_and_misses(self):
+        container = self.create_container()
+        self.create_container(host='other-host')
+        job = str(uuid1())
+
+        self.assertEqual(acquire_container('test.img', job), container)
+        self.assertIsNone(acquire_container('test.img', str(uuid1())))
+
+        pool = ContainerPool.objects.get(pk=self.pool.pk)
+        self.assertEqual((pool.hits, pool.misses), (1, 1))
+        self.assertEqual(pool.hit_rate(), 0.5)
+        container = WarmContainer.objects.get(pk=container.pk)
+        self.assertEqual(container.state, WarmContainer.LEASED)
+        self.assertEqual(container.job, job)
+
+    def test_acquire_without_pool(self):
+        self.pool.size = 0
+        self.pool.save()
+        self.create_container()
+        self.assertIsNone(acquire_container('test.img', str(uuid1())))
+        self.assertIsNone(acquire_container('other.img', str(uuid1())))
+        self.assertEqual(ContainerPool.objects.get(pk=self.pool.pk).misses, 0)
+
+    def test_time_to_ready(self):
+        self.assertIsNone(self.pool.time_to_ready())
+        self.pool.ready_count = 4
+        self.pool.ready_seconds = 10.0
+        self.assertEqual(self.pool.time_to_ready(), 2.5)
+
+    def test_release_container(self):
+        container = self.create_container(state=WarmContainer.LEASED,
+                                          job='job-uuid')
+        self.assertEqual(release_container('job-uuid'), container.uuid)
+        self.assertFalse(WarmContainer.objects.exists())
+        self.assertIsNone(release_container('job-uuid'))
+
+    @mock.patch('openearth.apps.script_execution_manager.pool'
+                '.boot_container')
+    @mock.patch('openearth.apps.script_execution_manager.pool.LibVirtDomain')
+    def test_replenish_destroys_stale_booting(self, LibVirtDomainMock,
+                                              boot_container):
+        """
+        A container left booting by a dead worker does not count.
+        """
+        self.create_container()
+        stale = self.create_container(state=WarmContainer.BOOTING)
+        other = self.create_container(state=WarmContainer.BOOTING,
+                                      host='other-host')
+        WarmContainer.objects.filter(pk__in=[stale.pk, other.pk]).update(
+            created=timezone.now() - timedelta(hours=1))
+        self.create_container(state=WarmContainer.BOOTING)
+
+        self.assertEqual(replenish(self.pool), 0)
+        self.assertFalse(WarmContainer.objects.filter(pk=stale.pk).exists())
+        self.assertTrue(WarmContainer.objects.filter(pk=other.pk).exists())
+        LibVirtDomainMock.return_value.destroy.assert_called_once_with()
+        self.assertFalse(boot_container.called)
+
+    @mock.patch('openearth.apps.script_execution_manager.pool.LibVirtDomain')
+    def test_trim_destroys_ready_beyond_size(self, LibVirtDomainMock):
+        oldest = self.create_container(ready_at=timezone.now())
+        self.create_container(ready_at=timezone.now())
+        self.create_container(state=WarmContainer.BOOTING)
+        self.create_container(host='other-host')
+        self.pool.size = 2
+        self.assertEqual(trim(self.pool), 1)
+        self.assertFalse(WarmContainer.objects.filter(pk=oldest.pk).exists())
+
+        # A disabled pool keeps no ready containers.
+        self.pool.size = 0
+        self.assertEqual(trim(self.pool), 1)
+        self.assertItemsEqual(
+            WarmContainer.objects.values_list('host', 'state'),
+            [(get_host(), WarmContainer.BOOTING),
+             ('other-host', WarmContainer.READY)]
+        )
+        self.assertEqual(LibVirtDomainMock.return_value.destroy.call_count,
+                         2)
+
+    @mock.patch('openearth.apps.script_execution_manager.pool'
+                '.boot_container')
+    @mock.patch('openearth.apps.script_execution_manager.tasks'
+                '.replenish_pool.apply_async')
+    def test_replenish_on_host(self, apply_async, boot_container):
+        replenish_pools('test.img', ['host1', 'host2'])
+        self.assertEqual(
+            [c[1] for c in apply_async.call_args_list],
+            [{'args': ['test.img', 'host1'], 'queue': 'host-host1'},
+             {'args': ['test.img', 'host2'], 'queue': 'host-host2'}]
+        )
+        self.assertEqual(replenish_pool('test.img', 'other-host'), 0)
+        self.assertEqual(replenish_pool('test.img', get_host()), 2)
+        self.assertEqual(boot_container.call_count, 2)
+
+    @mock.patch('openearth.apps.script_execution_manager.pool.LibVirtDomain')
+    def test_hand_over_moves_results_dir(self, LibVirtDomainMock):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        container = self.create_container()
+        container_dir = os.path.join(base_dir, 'results-' + container.uuid)
+        job_dir = os.path.join(base_dir, 'results-job')
+        os.makedirs(container_dir)
+        os.makedirs(job_dir)
+        LibVirtDomainMock.return_value.results_dir = container_dir
+        with open(os.path.join(job_dir, 'run.log'), 'w') as fp:
+            fp.write('log')
+
+        with self.settings(CONTAINER=dict(settings.CONTAINER,
+                                          base_dir=base_dir)):
+            lv = hand_over(container, 'job')
+
+        self.assertEqual(lv.results_dir, job_dir)
+        self.assertEqual(os.listdir(base_dir), ['results-job'])
+        self.assertEqual(os.listdir(job_dir), ['run.log'])
+
+
+class ReadinessTest(TestCase):
+    """
+    Tests the lease watcher and the SSH probe.
+    """
+    def serve_banner(self, banner):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.addCleanup(server.close)
+
+        def accept():
+            conn, addr = server.accept()
+            conn.sendall(banner)
+            conn.close()
+        threading.Thread(target=accept).start()
+        return server.getsockname()[1]
+
+    def test_lease_watcher_wakes_up_on_write(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        leases = os.path.join(tmp_dir, 'default.leases')
+        watcher = LeaseWatcher(leases)
+        self.addCleanup(watcher.close)
+        threading.Timer(0.1, lambda: open(leases, 'w').close()).start()
+        start = time.time()
+        watcher.wait(5)
+        self.assertLess(time.time() - start, 2)
+
+    def test_ssh_banner(self):
+        port = self.serve_banner(b'SSH-2.0-OpenSSH_5.3\r\n')
+        self.assertEqual(ssh_banner('127.0.0.1', port), b'SSH-2.0-OpenSSH_5.3')
+
+    def test_ssh_banner_not_ssh(self):
+        port = self.serve_banner(b'HTTP/1.1 400 Bad Request\r\n')
+        self.assertIsNone(ssh_banner('127.0.0.1', port))
+
+    def test_wait_for_ssh_timeout(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        server.close()
+        self.assertRaises(ReadinessTimeout, wait_for_ssh, '127.0.0.1', 0.3,
+                          port)
@@ -1,8 +1,15 @@
 from __future__ import unicode_literals
 import logging
 from django.test import TestCase
+import mock
 import os
-from ..exec_wrapper import ExecWrapper, mark_secret, SecretString
+import subprocess
+import tempfile
+import threading
+import time
+from ..exec_wrapper import CommandFailed, ExecWrapper, LineSplitter, \
+    OutputLine, mark_secret, SecretString
+from ..remote import RemoteExecutor
 
 
 logger = logging.getLogger(__name__)
@@ -52,6 +59,46 @@ class ExecWrapperTest(TestCase):
             lambda: list(generator)
         )
 
+    def test_stream_output(self):
+        """
+        Batches have stream tags; lines of both streams are read.
+        """
+        ew = ExecWrapper(command=['sh', self.test_script])
+        lines = [line for batch in ew.stream_output() for line in batch]
+        self.assertIn(('stdout', 'Output for stdout 2'),
+                      [(l.stream, l.text) for l in lines])
+        self.assertIn(('stderr', 'Output for stderr 2'),
+                      [(l.stream, l.text) for l in lines])
+        stats = ew.get_stats()
+        self.assertEqual(stats['lines'], len(lines))
+        self.assertGreater(stats['bytes'], 0)
+
+    def test_command_fails_with_tail(self):
+        ew = ExecWrapper(
+            command=['sh', '-c', 'echo out; echo err >&2; exit 3'],
+            tail_lines=1
+        )
+        try:
+            list(ew.stream_output())
+        except CommandFailed as e:
+            self.assertEqual(e.returncode, 3)
+            self.assertEqual(len(e.tail), 1)
+        else:
+            self.fail('CommandFailed not raised')
+
+    def test_line_splitter(self):
+        """
+        Lines are completed over chunks, long lines are cut off.
+        """
+        splitter = LineSplitter('stdout', max_line_length=5)
+        self.assertEqual(splitter.feed(b'ab', 1), [])
+        self.assertEqual(
+            [l.text for l in splitter.feed(b'c\n0123456789\nd', 2)],
+            ['abc', '01234 [5 bytes truncated]']
+        )
+        self.assertEqual([l.text for l in splitter.flush(3)], ['d'])
+        self.assertEqual(splitter.flush(4), [])
+
     def test_parse_command(self):
         secret = 'a secret pass'
         ew = ExecWrapper(
@@ -83,3 +130,58 @@ class ExecWrapperUtilsTest(TestCase):
 
 
 
+
+
+class RemoteExecutorTest(TestCase):
+
+    def test_commands_use_control_socket(self):
+        """
+        Commands reuse the master connection and log their output.
+        """
+        job_logger = mock.MagicMock()
+        remote = RemoteExecutor('10.0.0.2', job_logger=job_logger,
+                                key_path='/tmp/key')
+        remote.control_dir = '/tmp/ssh-test'
+        with mock.patch('openearth.apps.script_execution_manager.remote.'
+                        'ExecWrapper') as ExecWrapperMock:
+            ExecWrapperMock.return_value.stream_output.return_value = \
+                iter([[OutputLine('stdout', 0, 'line 1'),
+                       OutputLine('stderr', 0, 'line 2')]])
+            remote.run(['uptime'])
+        command = ExecWrapperMock.call_args[1]['command']
+        self.assertIn('-oControlPath=/tmp/ssh-test/control', command)
+        self.assertIn('-oControlMaster=no', command)
+        self.assertEqual(command[-2:], ['worker@10.0.0.2', 'uptime'])
+        job_logger.info.assert_called_with('line 1\nline 2')
+
+    @mock.patch('subprocess.check_call',
+                side_effect=subprocess.CalledProcessError(255, 'ssh'))
+    def test_open_failure_removes_control_dir(self, check_call):
+        remote = RemoteExecutor('10.0.0.2', job_logger=mock.MagicMock())
+        with mock.patch('tempfile.mkdtemp',
+                        return_value=tempfile.mkdtemp()) as mkdtemp:
+            self.assertRaises(subprocess.CalledProcessError, remote.open)
+        self.assertFalse(os.path.exists(mkdtemp.return_value))
+        self.assertIsNone(remote.control_dir)
+
+    def test_run_concurrently(self):
+        """
+        Sequences run at the same time, the first error is raised after all
+        sequences ended.
+        """
+        remote = RemoteExecutor('10.0.0.2', job_logger=mock.MagicMock())
+        started = []
+
+        def run(command):
+            started.append((command, threading.current_thread()))
+            time.sleep(0.1)
+            if command == ['fail']:
+                raise Exception('failed')
+
+        with mock.patch.object(remote, 'run', side_effect=run):
+            self.assertRaisesRegexp(
+                Exception, 'failed',
+                remote.run_concurrently, [['a'], ['b']], [['fail']], []
+            )
+        self.assertEqual(len(started), 3)
+        self.assertEqual(len(set(t for c, t in started)), 2)
@@ -0,0 +1,115 @@
+from django.contrib.auth.models import User
+from django.core import signing
+from django.test import RequestFactory, TestCase
+import mock
+import redis
+from ws4redis import settings as redis_settings
+from ..gateway import Client, Multiplexer, get_channels, make_token, \
+    read_token
+from ..store import RedisHistoryStore
+
+
+class GatewayTest(TestCase):
+
+    def setUp(self):
+        self.namespace = 'b4c4fb0e-9a63-4b1b-8f5d-1d8c3e2f7a10'
+        self.user = User.objects.create_user(
+            username='admin', email='test@test.com', password='top_secret'
+        )
+        self.factory = RequestFactory()
+
+    def test_token(self):
+        token = make_token(self.user, self.namespace)
+        data = read_token(token, self.namespace)
+        self.assertEqual(data['username'], 'admin')
+        self.assertFalse(data['staff'])
+
+        self.assertRaises(signing.BadSignature, read_token, token, 'other')
+        self.assertRaises(signing.BadSignature, read_token, token + 'x',
+                          self.namespace)
+        self.assertRaises(signing.BadSignature, read_token, '',
+                          self.namespace)
+
+    def test_get_channels(self):
+        """
+        Only staff can subscribe to the channels of all users.
+        """
+        request = self.factory.get('/ws/{0}'.format(self.namespace), {
+            'subscribe-user': '', 'subscribe-superuser': '', 'since': '3'
+        })
+        token = read_token(make_token(self.user, self.namespace),
+                           self.namespace)
+        self.assertEqual(get_channels(request, token), ['subscribe-user'])
+
+        self.user.is_staff = True
+        token = read_token(make_token(self.user, self.namespace),
+                           self.namespace)
+        self.assertItemsEqual(get_channels(request, token),
+                              ['subscribe-user', 'subscribe-superuser'])
+
+    def test_slow_client_is_closed(self):
+        client = Client(mock.MagicMock(), mock.MagicMock(), max_queue=2)
+        client.put('admin:ns', '1\x1ea')
+        client.put('admin:ns', '2\x1eb')
+        self.assertFalse(client.closed)
+        client.put('admin:ns', '3\x1ec')
+        self.assertTrue(client.closed)
+
+    def test_client_sends_each_line_once(self):
+        """
+        Lines matching two patterns are sent once, a gap closes the client.
+        """
+        connection = redis.StrictRedis(**redis_settings.WS4REDIS_CONNECTION)
+        websocket = mock.MagicMock()
+        client = Client(websocket, RedisHistoryStore(connection), max_queue=10)
+        for message in ('1\x1ea', '1\x1ea', '2\x1eb', 'no sequence',
+                        '4\x1ed'):
+            client.put('admin:ns', message)
+        client.run_sender()
+
+        self.assertEqual(
+            [c[0][0] for c in websocket.send.call_args_list],
+            ['1\x1ea', '2\x1eb', 'no sequence']
+        )
+        self.assertTrue(client.closed)
+
+    def test_multiplexer(self):
+        connection = redis.StrictRedis(**redis_settings.WS4REDIS_CONNECTION)
+        multiplexer = Multiplexer(connection)
+        multiplexer.pubsub = mock.MagicMock()
+        user_client = Client(mock.MagicMock(), mock.MagicMock(), max_queue=10)
+        other_client = Client(mock.MagicMock(), mock.MagicMock(),
+                              max_queue=10)
+        with mock.patch('openearth.apps.script_execution_manager.gateway'
+                        '.gevent.spawn') as spawn:
+            multiplexer.subscribe(user_client, ['admin:ns'])
+            multiplexer.subscribe(other_client, ['admin:ns', '*:ns'])
+        # One listener, and one subscription per pattern.
+        self.assertEqual(spawn.call_count, 1)
+        self.assertEqual(
+            [c[0][0] for c in multiplexer.pubsub.psubscribe.call_args_list],
+            ['admin:ns', '*:ns']
+        )
+
+        multiplexer.pubsub.listen.return_value = iter([
+            {'type': 'pmessage', 'pattern': 'admin:ns',
+             'channel': 'admin:ns', 'data': '1\x1ea'},
+            {'type': 'pmessage', 'pattern': '*:ns',
+             'channel': 'other:ns', 'data': '1\x1eb'},
+        ])
+        multiplexer.listener = True
+        with mock.patch('openearth.apps.script_execution_manager.gateway'
+                        '.gevent.spawn') as spawn:
+            multiplexer.listen()
+        self.assertEqual(user_client.queue.qsize(), 1)
+        self.assertEqual(other_client.queue.qsize(), 2)
+        # The pubsub stopped listening while there are clients; restarted.
+        self.assertEqual(multiplexer.listener, spawn.return_value)
+
+        multiplexer.unsubscribe(user_client)
+        self.assertFalse(multiplexer.pubsub.punsubscribe.called)
+        multiplexer.unsubscribe(other_client)
+        self.assertItemsEqual(
+            [c[0][0] for c in multiplexer.pubsub.punsubscribe.call_args_list],
+            ['admin:ns', '*:ns']
+        )
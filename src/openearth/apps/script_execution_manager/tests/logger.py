@@ -6,6 +6,7 @@ import redis
 from ws4redis import settings as redis_settings
 import socket
 from ..logger import WebsocketLoggerHandler
+from ..store import split_message
 
 
 class WebsocketLoggerHandlerTest(TestCase):
@@ -28,6 +29,9 @@ class WebsocketLoggerHandlerTest(TestCase):
         self._redis_connection.delete('{0}:{1}:hist'.format(
             self.user.username, self.namespace
         ))
+        self._redis_connection.delete('{0}:{1}:seq'.format(
+            self.user.username, self.namespace
+        ))
 
     def test_log_debug(self):
         config = {
@@ -40,11 +44,12 @@ class WebsocketLoggerHandlerTest(TestCase):
         logger.addHandler(redis_handler)
         message = 'test test test'
         logger.debug(message)
+        redis_handler.flush()
         history = self._redis_connection.lrange('admin:426db016-dc2d-45a4-9b95-f11a3ddedc3f:hist', 0, -1)
         #print history[0]
         self.assertEqual(
-            history[0],
-            message
+            split_message(history[0]),
+            (1, message)
         )
 
 
@@ -70,9 +75,66 @@ class WebsocketLoggerHandlerTest(TestCase):
         logger.addHandler(redis_handler)
         message = 'format format format'
         logger.debug(message)
+        redis_handler.flush()
         history = self._redis_connection.lrange('admin:426db016-dc2d-45a4-9b95-f11a3ddedc3f:hist', 0, -1)
         print history[0]
         self.assertEqual(
-             history[0],
+             split_message(history[0])[1],
              template % {'message': message}
-        )
\ No newline at end of file
+        )
+
+    def test_log_batches(self):
+        """
+        Records are published in batches of max_batch, in order.
+        """
+        config = {
+            'username': self.user.username,
+            'namespace': self.namespace
+        }
+        redis_handler = WebsocketLoggerHandler(
+            config=config, channels=['subscribe-user', 'publish-user'],
+            flush_interval=60, max_batch=10
+        )
+        publish_messages = MagicMock(
+            wraps=redis_handler.redis_store.publish_messages)
+        redis_handler.redis_store.publish_messages = publish_messages
+        logger = logging.getLogger('{0}.batches'.format(__name__))
+        logger.addHandler(redis_handler)
+        for i in range(25):
+            logger.info(str(i))
+        # Two full batches were published by the logging thread.
+        self.assertEqual(publish_messages.call_count, 2)
+        redis_handler.close()
+        logger.removeHandler(redis_handler)
+
+        self.assertEqual(publish_messages.call_count, 3)
+        history = self._redis_connection.lrange(
+            'admin:{0}:hist'.format(self.namespace), 0, -1)
+        self.assertEqual(
+            [split_message(line) for line in history],
+            [(i + 1, str(i)) for i in range(25)]
+        )
+
+    def test_log_drops_oldest_when_redis_is_down(self):
+        config = {
+            'username': self.user.username,
+            'namespace': self.namespace
+        }
+        redis_handler = WebsocketLoggerHandler(
+            config=config, channels=['subscribe-user', 'publish-user'],
+            flush_interval=60, max_batch=5, max_buffer=5
+        )
+        redis_handler.redis_store.publish_messages = MagicMock(
+            side_effect=redis.ConnectionError)
+        logger = logging.getLogger('{0}.drops'.format(__name__))
+        logger.addHandler(redis_handler)
+        for i in range(8):
+            logger.info(str(i))
+        logger.removeHandler(redis_handler)
+
+        self.assertEqual(list(redis_handler.buffer), ['3', '4', '5', '6', '7'])
+        self.assertEqual(redis_handler.dropped, 3)
+        redis_handler.redis_store.publish_messages = MagicMock()
+        redis_handler.flush()
+        redis_handler.redis_store.publish_messages.assert_called_once_with(
+            ['[3 log lines dropped]', '3', '4', '5', '6', '7'])
@@ -2,18 +2,20 @@ from __future__ import unicode_literals
 from collections import OrderedDict
 from django.contrib.gis.geos import Point
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
+from django.db import connection
 from django.test import TestCase
 import hashlib
 from django.test.utils import override_settings
 import pandas
 import os
+import tempfile
 
 from pandas.tslib import Timestamp
 
 from ..management.commands import csv_worker
 from openearth.apps.processing.tests.factories import ProcessingJobFactory
 from openearth.apps.script_execution_manager.models import LocationPoint, \
-    Compartment, Observation
+    Compartment, Observation, Parameter
 from . import factories
 from openearth.apps.script_execution_manager.tests.factories import \
     ObservationFactory
@@ -285,6 +287,30 @@ class TestCSVWorkerCommand(TestCase):
         o = Observation.objects.all()[0]
         self.assertListEqual([pj_1.uuid, pj_2.uuid], o.processing_jobs)
 
+    def test_attach_processing_job_updates_arrays_only(self):
+        """
+        Re-used observations get the job and environment appended in one
+        query, other columns are left alone. Attaching twice is a no-op.
+        """
+        o_1 = factories.ObservationFactory(remark='Remark')
+        o_2 = factories.ObservationFactory(remark='Remark')
+        Observation.objects.filter(pk=o_1.pk).update(remark='Changed')
+        pj = ProcessingJobFactory()
+        cmd = csv_worker.Command()
+        with self.assertNumQueries(1):
+            updated = cmd.attach_processing_job([o_1.pk, o_2.pk], pj)
+        self.assertEqual(2, updated)
+        cmd.attach_processing_job([o_1.pk], pj)
+
+        o_1 = Observation.objects.get(pk=o_1.pk)
+        self.assertEqual('Changed', o_1.remark)
+        self.assertEqual(str(pj.uuid), o_1.processing_jobs[-1])
+        self.assertEqual(1, o_1.processing_jobs.count(str(pj.uuid)))
+        self.assertEqual(
+            [self.make_env_hash(pj)],
+            Observation.objects.get(pk=o_2.pk).processing_environments[-1:]
+        )
+
     def test_dicitified_chunk_to_db_unpublished(self):
         """
         Tests if results from tmp table are inserted in the 'live' db structure.
@@ -356,6 +382,57 @@ class TestCSVWorkerCommand(TestCase):
         rv = cmd.observation_exists('Non Existing Data')
         self.assertIsNone(rv)
 
+    def test_observation_identity_is_md5_of_concatenated_data(self):
+        """
+        Identity is set on save and equals md5(concatenated_data) in SQL, which
+        is used by the migration to backfill existing observations.
+        """
+        o = factories.ObservationFactory()
+        cursor = connection.cursor()
+        cursor.execute(
+            'SELECT md5(concatenated_data)::uuid = identity FROM '
+            'script_execution_manager_observation WHERE id = %s', [o.pk]
+        )
+        self.assertTrue(cursor.fetchone()[0])
+        self.assertEqual(
+            o.identity,
+            Observation.make_identity(o.concatenated_data)
+        )
+
+    def test_prefetch_observations_uses_one_query(self):
+        """
+        Existing observations of a chunk are looked up in one query, after
+        which observation_exists does not query the database.
+        """
+        o = factories.ObservationFactory()
+        cmd = csv_worker.Command()
+        dictified_chunks = [self.get_dictified_chunk_data() for i in range(3)]
+        for i, dc in enumerate(dictified_chunks):
+            dc.update({
+                'origx': 74235.579,
+                'origy': 453534.92600000004,
+                'value': i
+            })
+        with self.assertNumQueries(1):
+            cmd.prefetch_observations(dictified_chunks)
+        cmd.existing_observations[o.concatenated_data] = o
+        with self.assertNumQueries(0):
+            for dc in dictified_chunks:
+                self.assertIsNone(
+                    cmd.observation_exists(cmd.concatenate_row(dc))
+                )
+            self.assertEqual(cmd.observation_exists(o.concatenated_data), o)
+
+    def test_identified_by_returns_existing_observations(self):
+        o = factories.ObservationFactory()
+        factories.ObservationFactory()
+        self.assertListEqual(
+            [o],
+            list(Observation.objects.identified_by(
+                [o.concatenated_data, 'Non Existing Data']
+            ))
+        )
+
     def test_point_exists_returns_false(self):
         """
         Test if point_exists() returns false if LocationPoint doesnt exist.
@@ -726,6 +803,191 @@ class TestCSVWorkerCommand(TestCase):
         self.assertRaises(ObjectDoesNotExist, call_command, *args, **kwargs)
         self.assertEqual(0, LocationPoint.objects.count())
 
+    def write_csv(self, rows):
+        """
+        Writes rows (list of dicts) to a temporary CSV file, returns path.
+        """
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(','.join(self.csv_cols) + '\n')
+            for row in rows:
+                row = dict(row, date=row['date'].strftime('%m/%d/%Y'))
+                fp.write(','.join(str(row[c]) for c in self.csv_cols) + '\n')
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_copy_mode_no_rows_inserted_on_import_fail(self):
+        """
+        Tests if the copy mode aborts the transaction on invalid data.
+        """
+        from django.core.management import call_command
+        processing_job = ProcessingJobFactory()
+        kwargs = {"csv_input": self.test_data_broken,
+                  "processing_job": processing_job.uuid,
+                  "mode": "copy"}
+        self.assertRaisesRegexp(
+            ObjectDoesNotExist,
+            'CSV file contains values which are not correct:\n'
+            'Compartment "compartment description 1" does not exist.\n'
+            'Compartment "compartment description 2" does not exist.',
+            call_command, 'csv_worker', **kwargs
+        )
+        self.assertEqual(0, LocationPoint.objects.count())
+        self.assertEqual(0, Observation.objects.count())
+
+    def test_copy_mode_inserts_and_reuses(self):
+        """
+        Tests if the copy mode inserts observations once and reuses them.
+
+        Description:
+            The CSV contains a duplicate row and two rows on one location. A
+            second run with another processing job should reuse everything.
+        """
+        from django.core.management import call_command
+        common = self.get_dictified_chunk_data()
+        rows = [
+            dict(common, origx=74235.579, origy=453534.926, value=1.261),
+            dict(common, origx=74235.579, origy=453534.926, value=1.261),
+            dict(common, origx=74235.579, origy=453534.926, value=1.257),
+            dict(common, origx=74238.578, origy=453534.925, value=1.259),
+        ]
+        csv_input = self.write_csv(rows)
+        pj_1 = ProcessingJobFactory()
+        pj_2 = ProcessingJobFactory()
+        call_command('csv_worker', csv_input=csv_input,
+                     processing_job=pj_1.uuid, mode='copy', published=True)
+        self.assertEqual(2, LocationPoint.objects.count())
+        self.assertEqual(3, Observation.objects.count())
+        self.assertTrue(Observation.objects.last().published)
+
+        call_command('csv_worker', csv_input=csv_input,
+                     processing_job=pj_2.uuid, mode='copy', published=True)
+        self.assertEqual(2, LocationPoint.objects.count())
+        self.assertEqual(3, Observation.objects.count())
+        for o in Observation.objects.all():
+            self.assertListEqual([pj_1.uuid, pj_2.uuid], o.processing_jobs)
+
+    def test_orm_mode_duplicate_row(self):
+        """
+        Tests if a row which is twice in one chunk is stored once.
+        """
+        from django.core.management import call_command
+        common = self.get_dictified_chunk_data()
+        rows = [
+            dict(common, origx=74235.579, origy=453534.926, value=1.261),
+            dict(common, origx=74235.579, origy=453534.926, value=1.261),
+        ]
+        csv_input = self.write_csv(rows)
+        processing_job = ProcessingJobFactory()
+        call_command('csv_worker', csv_input=csv_input,
+                     processing_job=processing_job.uuid, mode='orm')
+        self.assertEqual(1, Observation.objects.count())
+        self.assertListEqual([processing_job.uuid],
+                             Observation.objects.get().processing_jobs)
+
+    def test_mixed_case_vocabulary(self):
+        """
+        Tests if both modes match descriptions case insensitively.
+        """
+        from django.core.management import call_command
+        p = factories.ParameterFactory(description='Actinocyclus Normanii')
+        rows = [dict(self.get_dictified_chunk_data(),
+                     parameter='ACTINOCYCLUS normanii', origx=74235.579,
+                     origy=453534.926, value=1.261)]
+        csv_input = self.write_csv(rows)
+        for mode in ('orm', 'copy'):
+            call_command('csv_worker', csv_input=csv_input,
+                         processing_job=ProcessingJobFactory().uuid,
+                         mode=mode)
+            self.assertEqual(Observation.objects.get().parameter, p)
+            Observation.objects.all().delete()
+
+    def test_validate_relations_reports_all_unknown_values(self):
+        """
+        Tests if unknown values of all rows are reported in one error.
+        """
+        cmd = csv_worker.Command()
+        cmd.copy_chunksize = 1
+        self.assertRaisesRegexp(
+            ObjectDoesNotExist,
+            'CSV file contains values which are not correct:\n'
+            'Compartment "compartment description 1" does not exist.\n'
+            'Compartment "compartment description 2" does not exist.\n',
+            cmd.validate_relations,
+            self.test_data_broken
+        )
+
+    def test_vocabulary_index_loads_table_once(self):
+        """
+        Tests if the vocabulary index queries each lookup table only once.
+        """
+        c = factories.CompartmentFactory()
+        index = csv_worker.VocabularyIndex()
+        with self.assertNumQueries(1):
+            self.assertEqual(index.get(Compartment, c.description.upper()), c)
+            self.assertEqual(index.get(Compartment, c.description), c)
+            self.assertIsNone(index.get(Compartment, 'Non existing'))
+        self.assertEqual(index.hits, 2)
+        self.assertEqual(index.misses, 1)
+
+    def test_vocabulary_index_non_ascii(self):
+        """
+        Tests if utf-8 byte strings, as read from the CSV, are found.
+        """
+        p = factories.ParameterFactory(description='Actinocyclus k\xfctzingii')
+        index = csv_worker.VocabularyIndex()
+        value = 'actinocyclus k\xfctzingii'.encode('utf-8')
+        self.assertEqual(index.get(Parameter, value), p)
+        self.assertIn((Parameter, value), index)
+
+    def test_location_resolver_clusters_new_points(self):
+        """
+        Tests if points within tolerance in one batch share a LocationPoint.
+        """
+        resolver = csv_worker.LocationResolver()
+        keys = [
+            (74235.579, 453534.926, 28992),
+            (74235.5795, 453534.926, 28992),
+            (74238.578, 453534.926, 28992),
+        ]
+        # One spatial query, one INSERT of the new points.
+        with self.assertNumQueries(2):
+            points = resolver.resolve(keys)
+        self.assertEqual(2, LocationPoint.objects.count())
+        self.assertEqual(points[keys[0]], points[keys[1]])
+        self.assertNotEqual(points[keys[0]], points[keys[2]])
+        self.assertEqual(1, resolver.queries)
+        self.assertEqual(
+            set(LocationPoint.objects.values_list('id', flat=True)),
+            resolver.created_ids
+        )
+        lp = LocationPoint.objects.get(pk=points[keys[2]].id)
+        self.assertEqual((lp.origx, lp.origy, lp.orig_srid), keys[2])
+        self.assertAlmostEqual(lp.thegeometry.x, points[keys[2]].thegeometry.x)
+
+    def test_location_resolver_inserts_in_chunks(self):
+        resolver = csv_worker.LocationResolver()
+        resolver.insert_size = 2
+        keys = [(74235.579 + 10 * i, 453534.926, 28992) for i in range(5)]
+        with self.assertNumQueries(4):
+            points = resolver.resolve(keys)
+        self.assertEqual(5, LocationPoint.objects.count())
+        self.assertEqual(5, len(set(lp.id for lp in points.values())))
+
+    def test_location_resolver_reuses_existing_points(self):
+        """
+        Tests if resolved points are cached and existing points are matched.
+        """
+        lp = factories.LocationPointFactory()
+        resolver = csv_worker.LocationResolver()
+        point = (float(lp.thegeometry.x) + 0.000005, float(lp.thegeometry.y),
+                 4326)
+        self.assertEqual(resolver.get(*point), lp)
+        self.assertEqual(resolver.get(*point), lp)
+        self.assertEqual(1, resolver.queries)
+        self.assertEqual(1, resolver.reused)
+        self.assertEqual(1, LocationPoint.objects.count())
+
     @staticmethod
     def make_env_hash(pj):
         return hashlib.md5('{0}{1}'.format(
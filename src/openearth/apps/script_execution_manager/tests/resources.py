@@ -0,0 +1,61 @@
+from __future__ import unicode_literals
+from django.conf import settings
+from django.test import TestCase
+import libvirt
+import mock
+
+from ..resources import ResourceSampler, get_profile, get_profile_name
+
+
+class ResourcesTest(TestCase):
+
+    def test_get_profile(self):
+        container = dict(settings.CONTAINER)
+        container['resource_profiles'] = {
+            'default': {'cpu_shares': 512},
+            'large': {'vcpus': 4},
+        }
+        container['image_profiles'] = {'matlab': 'large'}
+        with self.settings(CONTAINER=container):
+            self.assertEqual(get_profile_name('python'), 'default')
+            self.assertEqual(get_profile_name('matlab'), 'large')
+            large = get_profile('matlab')
+            default = get_profile('python')
+        self.assertEqual(large['vcpus'], 4)
+        # Missing keys come from the default profile.
+        self.assertEqual(large['cpu_shares'], 512)
+        self.assertEqual(default['vcpus'], 1)
+
+    def test_sampler(self):
+        """
+        CPU time counts from the first sample, peaks are kept.
+        """
+        domain = mock.MagicMock()
+        running = libvirt.VIR_DOMAIN_RUNNING
+        domain.info.side_effect = [
+            [running, 4194304, 1024, 1, 10 * 10 ** 9],
+            [running, 4194304, 4096, 1, 12 * 10 ** 9],
+            [running, 4194304, 2048, 1, 13 * 10 ** 9],
+        ]
+        sampler = ResourceSampler(domain)
+        with mock.patch('openearth.apps.script_execution_manager.resources.'
+                        'time.time', side_effect=[100, 102, 104]):
+            sampler.sample()
+            sampler.sample()
+            sampler.sample()
+        self.assertEqual(sampler.usage(), {
+            'cpu_seconds': 3,
+            'peak_cpu': 1,
+            'peak_memory': 4096 * 1024,
+        })
+
+    def test_sampler_stops_when_domain_is_gone(self):
+        domain = mock.MagicMock()
+        domain.info.return_value = [libvirt.VIR_DOMAIN_RUNNING, 0, 1, 1, 0]
+        sampler = ResourceSampler(domain, interval=0.01)
+        sampler.start()
+        domain.info.side_effect = libvirt.libvirtError('gone')
+        sampler._thread.join(1)
+        self.assertFalse(sampler._thread.is_alive())
+        sampler.stop()
+        self.assertEqual(sampler.peak_memory, 1024)
@@ -0,0 +1,135 @@
+from __future__ import unicode_literals
+from django.conf import settings
+from django.test import TestCase
+from django.test.utils import override_settings
+import mock
+import os
+import shutil
+import tempfile
+from openearth.apps.processing.models import ProcessingJob
+from openearth.apps.processing.tests import factories as processing_factories
+from ..result_cache import find_cached_job, job_fingerprint, link_results, \
+    update_fingerprint
+from ..task_utils import add_file_to_job_result
+from ..tasks import schedule_job
+
+
+@mock.patch.object(ProcessingJob, 'start_job')
+class ResultCacheTest(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.base_dir, 'python'), 'w') as f:
+            f.write('image')
+        patcher = override_settings(
+            CONTAINER=dict(settings.CONTAINER, base_dir=self.base_dir))
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.addCleanup(shutil.rmtree, self.base_dir)
+
+    def fingerprint(self, job, open_earth_tools=False):
+        return job_fingerprint(job, 'python', 'python {script_path}',
+                               'https://svn/repo', open_earth_tools)
+
+    def create_job(self, **kwargs):
+        defaults = {'script': 'script.py', 'revision': 10}
+        defaults.update(kwargs)
+        job = processing_factories.ProcessingJobFactory(**defaults)
+        job.input_fingerprint = self.fingerprint(job) or ''
+        job.save()
+        return job
+
+    def test_fingerprint(self, start_job):
+        job = self.create_job(parameters='{"x": 1, "y": 2}',
+                              open_earth_revision=5)
+        same = self.create_job(parameters='{"y": 2, "x": 1}',
+                               script_revision=10)
+        self.assertEqual(job.input_fingerprint, same.input_fingerprint)
+
+        other = self.create_job(parameters='{"x": 2, "y": 2}')
+        self.assertNotEqual(job.input_fingerprint, other.input_fingerprint)
+        self.assertNotEqual(self.fingerprint(job),
+                            self.fingerprint(job, open_earth_tools=True))
+
+        # Without fixed revisions the inputs are not known.
+        self.assertIsNone(self.fingerprint(self.create_job(revision=None)))
+        job.open_earth_revision = None
+        self.assertIsNone(self.fingerprint(job, open_earth_tools=True))
+
+        # A replaced image changes the fingerprint.
+        os.utime(os.path.join(self.base_dir, 'python'), (0, 0))
+        self.assertNotEqual(self.fingerprint(same), same.input_fingerprint)
+
+    def test_find_and_link(self, start_job):
+        environment = processing_factories.ProcessingEnvironmentFactory()
+        previous = self.create_job(environment=environment,
+                                   status=ProcessingJob.STATUS.FINISHED)
+        job = self.create_job(environment=environment)
+        self.assertIsNone(find_cached_job(job))
+
+        path = os.path.join(self.base_dir, 'result.txt')
+        with open(path, 'w') as f:
+            f.write('result')
+        result = add_file_to_job_result(previous, path)
+        self.assertEqual(find_cached_job(job), previous)
+
+        self.assertEqual(link_results(previous, job), 1)
+        self.assertEqual(link_results(previous, job), 0)
+        self.assertEqual(job.processing_result.get().file, result.file)
+        self.assertEqual(job.cached_from, previous)
+
+        job.force_rerun = True
+        self.assertIsNone(find_cached_job(job))
+
+    def test_find_other_users_job(self, start_job):
+        """
+        The results of another user are not reused.
+        """
+        previous = self.create_job(status=ProcessingJob.STATUS.FINISHED)
+        path = os.path.join(self.base_dir, 'result.txt')
+        with open(path, 'w') as f:
+            f.write('result')
+        add_file_to_job_result(previous, path)
+
+        job = self.create_job()
+        self.assertEqual(job.input_fingerprint, previous.input_fingerprint)
+        self.assertNotEqual(job.environment.author,
+                            previous.environment.author)
+        self.assertIsNone(find_cached_job(job))
+
+    @mock.patch.object(ProcessingJob, 'commit_signature')
+    @mock.patch('openearth.apps.script_execution_manager.tasks'
+                '.get_scheduler')
+    @mock.patch('openearth.apps.script_execution_manager.tasks'
+                '.setup_logger')
+    def test_schedule_job_skips_scheduler(self, setup_logger, get_scheduler,
+                                          commit_signature, start_job):
+        """
+        A job with cached results is not queued, it is committed directly.
+        """
+        environment = processing_factories.ProcessingEnvironmentFactory(
+            libvirt_image=processing_factories.ProcessingJobImageFactory(
+                libvirt_image='python'),
+            open_earth=False
+        )
+        previous = self.create_job(environment=environment,
+                                   status=ProcessingJob.STATUS.FINISHED)
+        self.assertTrue(update_fingerprint(previous))
+        path = os.path.join(self.base_dir, 'result.txt')
+        with open(path, 'w') as f:
+            f.write('result')
+        add_file_to_job_result(previous, path)
+
+        job = self.create_job(environment=environment)
+        self.assertTrue(schedule_job(job.uuid))
+        self.assertFalse(get_scheduler.return_value.submit.called)
+        commit_signature.return_value.apply_async.assert_called_once_with(
+            args=[{'cached_from': previous.uuid, 'skip_commit': True}])
+        job = ProcessingJob.objects.get(uuid=job.uuid)
+        self.assertEqual(job.cached_from, previous)
+        self.assertEqual(job.status, ProcessingJob.STATUS.RUNNING)
+
+        job = self.create_job(environment=environment, force_rerun=True)
+        schedule_job(job.uuid)
+        get_scheduler.return_value.submit.assert_called_once_with(
+            job.uuid, environment.author.username, 'python')
@@ -0,0 +1,172 @@
+from __future__ import unicode_literals
+from django.conf import settings
+from django.test import TestCase
+from django.test.utils import override_settings
+import mock
+import os
+import redis
+import shutil
+import tempfile
+from ws4redis import settings as redis_settings
+from openearth.apps.processing.models import ProcessingJob
+from openearth.apps.processing.tests import factories as processing_factories
+from ..scheduler import JobScheduler, fits, get_queue
+from ..tasks import advance_batch, run_script, schedule_job, \
+    task_failure_handler
+
+CONTAINER = dict(settings.CONTAINER, resource_profiles={
+    'default': {'vcpus': 1, 'memory': 4096},
+    'large': {'vcpus': 4, 'memory': 16384},
+}, image_profiles={'matlab': 'large'})
+
+HEADROOM = {
+    'cpus': 4,
+    'load': 0.5,
+    'total_memory': 16384,
+    'available_memory': 9000,
+    'free_disk': 100 * 1024,
+}
+
+
+@override_settings(CONTAINER=CONTAINER)
+@mock.patch('openearth.apps.script_execution_manager.scheduler'
+            '.measure_headroom', new=lambda: dict(HEADROOM))
+@mock.patch('openearth.apps.script_execution_manager.scheduler.get_host',
+            new=lambda: 'host1')
+class JobSchedulerTest(TestCase):
+
+    def setUp(self):
+        self.connection = redis.StrictRedis(
+            **redis_settings.WS4REDIS_CONNECTION)
+        self.scheduler = JobScheduler(self.connection,
+                                      prefix='test-scheduler:')
+
+    def tearDown(self):
+        keys = self.connection.keys('test-scheduler:*')
+        if keys:
+            self.connection.delete(*keys)
+
+    def test_queues(self):
+        self.assertEqual(get_queue('matlab'), 'jobs-large')
+        self.assertEqual(get_queue('python'), 'jobs-default')
+        report = {'free_cpu': 3.5, 'free_memory': 9000, 'free_disk': 10240}
+        self.assertEqual(fits(report, {'vcpus': 1, 'memory': 4096}), 2)
+        self.assertEqual(fits(report, {'vcpus': 4, 'memory': 16384}), 0)
+
+    def test_fair_share(self):
+        """
+        A user's batch does not go before the first job of another user.
+        """
+        for uuid in ('a0', 'a1', 'a2'):
+            self.scheduler.submit(uuid, 'alice', 'python')
+        self.scheduler.submit('b0', 'bob', 'python')
+        # Submitting twice does not queue twice.
+        self.assertFalse(self.scheduler.submit('a0', 'alice', 'python'))
+
+        order = [self.scheduler.pop('jobs-default') for i in range(5)]
+        self.assertEqual(order, ['a0', 'b0', 'a1', 'a2', None])
+
+    def test_dispatch_uses_headroom(self):
+        for uuid in ('a0', 'a1', 'a2'):
+            self.scheduler.submit(uuid, 'alice', 'python')
+        self.scheduler.submit('m0', 'bob', 'matlab')
+        self.scheduler.report('host1', ['jobs-default', 'jobs-large'])
+
+        with mock.patch.object(self.scheduler, 'send') as send:
+            self.assertEqual(self.scheduler.dispatch(), 2)
+            # Dispatched jobs take the headroom until they are admitted.
+            self.assertEqual(self.scheduler.dispatch(), 0)
+        self.assertEqual([c[0] for c in send.call_args_list],
+                         [('a0', 'jobs-default'), ('a1', 'jobs-default')])
+
+        stats = self.scheduler.queue_stats()
+        self.assertEqual(stats['jobs-default']['pending'], 1)
+        self.assertEqual(stats['jobs-default']['starting'], 2)
+        self.assertEqual(stats['jobs-default']['running'], 2)
+        self.assertEqual(stats['jobs-large']['pending'], 1)
+        self.assertEqual(stats['jobs-large']['users'], ['bob'])
+        self.assertIsNotNone(stats['jobs-large']['oldest_wait'])
+
+    def test_admit_and_release(self):
+        for uuid in ('a0', 'a1'):
+            self.scheduler.submit(uuid, 'alice', 'python')
+            self.scheduler.pop('jobs-default')
+
+        self.assertTrue(self.scheduler.admit('a0', 'alice', 'python'))
+        self.assertEqual(
+            self.connection.hgetall('test-scheduler:reserved:host1'),
+            {'vcpus': '1', 'memory': '4096'}
+        )
+        # 16384 MiB - 4096 reserved leaves room, the available memory not.
+        HEADROOM['available_memory'] = 4000
+        try:
+            self.assertFalse(self.scheduler.admit('a1', 'alice', 'python'))
+        finally:
+            HEADROOM['available_memory'] = 9000
+        self.assertTrue(self.scheduler.admit('a1', 'alice', 'python'))
+
+        stats = self.scheduler.queue_stats()['jobs-default']
+        self.assertEqual(stats['starting'], 0)
+        self.assertEqual(stats['running'], 2)
+        self.assertEqual(len(self.connection.lrange(
+            'test-scheduler:waits:jobs-default', 0, -1)), 2)
+
+        self.assertEqual(self.scheduler.release('a0'), 'running')
+        self.assertEqual(self.scheduler.release('a1'), 'running')
+        self.assertIsNone(self.scheduler.release('a1'))
+        self.assertEqual(
+            self.connection.hgetall('test-scheduler:reserved:host1'),
+            {'vcpus': '0', 'memory': '0'}
+        )
+        self.assertEqual(
+            self.scheduler.queue_stats()['jobs-default']['running'], 0)
+
+    def test_release_pending(self):
+        self.scheduler.submit('a0', 'alice', 'python')
+        self.assertEqual(self.scheduler.release('a0'), 'pending')
+        self.assertIsNone(self.scheduler.pop('jobs-default'))
+
+
+@mock.patch.object(ProcessingJob, 'start_job')
+@mock.patch('openearth.apps.script_execution_manager.tasks.get_scheduler')
+class FailureHandlerTest(TestCase):
+
+    def test_tasks_without_namespace(self, get_scheduler, start_job):
+        job = processing_factories.ProcessingJobFactory()
+        task_failure_handler(sender=advance_batch, task_id='1', args=[1],
+                             kwargs={})
+        self.assertFalse(get_scheduler.called)
+
+        task_failure_handler(sender=schedule_job, task_id='2',
+                             args=[job.uuid], kwargs={})
+        get_scheduler.return_value.release.assert_called_once_with(job.uuid)
+        self.assertEqual(ProcessingJob.objects.get(uuid=job.uuid).status,
+                         ProcessingJob.STATUS.FAILURE)
+
+    @mock.patch('openearth.apps.script_execution_manager.tasks'
+                '.setup_logger')
+    @mock.patch('libvirt.open')
+    def test_failed_job_image_is_removed(self, libvirt_open, setup_logger,
+                                         get_scheduler, start_job):
+        """
+        The instance image of a failed job is removed, without knowing the
+        provisioner which made it.
+        """
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        job = processing_factories.ProcessingJobFactory()
+        instance_image = os.path.join(base_dir,
+                                      'instance-{0}'.format(job.uuid))
+        with open(instance_image, 'wb') as fp:
+            fp.write(b'image')
+
+        with self.settings(CONTAINER=dict(CONTAINER, base_dir=base_dir)):
+            task_failure_handler(
+                sender=run_script, task_id='1', args=[],
+                kwargs={'namespace': job.uuid, 'username': 'admin'})
+        self.assertTrue(
+            libvirt_open.return_value.lookupByName.return_value.undefine
+            .called)
+        self.assertFalse(os.path.lexists(instance_image))
+        self.assertEqual(ProcessingJob.objects.get(uuid=job.uuid).status,
+                         ProcessingJob.STATUS.FAILURE)
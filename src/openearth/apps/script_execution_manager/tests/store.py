@@ -6,7 +6,7 @@ import multiprocessing
 import redis
 import socket
 import time
-from ..store import RedisHistoryStore
+from ..store import RedisHistoryStore, registry_key, split_message
 from ws4redis import settings as redis_settings
 from openearth.apps.processing.tests.factories import AdminFactory, \
     StaffUserFactory
@@ -35,10 +35,15 @@ class HistoryStoreTest(TestCase):
         self._redis_connection.delete('{0}:{1}:hist'.format(
             self.user.username, self.namespace
         ))
+        self._redis_connection.delete('{0}:{1}:seq'.format(
+            self.user.username, self.namespace
+        ))
+        self._redis_connection.delete(registry_key(self.namespace))
 
     def tearDown(self):
         super(HistoryStoreTest, self).tearDown()
         keys = self._redis_connection.keys('*hist')
+        keys += self._redis_connection.keys('*:seq')
         for k in keys:
             self._redis_connection.delete(k)
 
@@ -79,10 +84,11 @@ class HistoryStoreTest(TestCase):
             """
             for m in redis_store_user_check._subscription.listen():
                 if m['type'] == 'pmessage':
-                    print m['data']  # message 1
-                    if m['data'] in msgs:
-                        print 'remove: {0}'.format(m['data'])
-                        msgs.remove(m['data'])
+                    data = split_message(m['data'])[1]
+                    print data  # message 1
+                    if data in msgs:
+                        print 'remove: {0}'.format(data)
+                        msgs.remove(data)
                 if not msgs:
                     break
 
@@ -146,12 +152,12 @@ class HistoryStoreTest(TestCase):
         history = self._redis_connection.lrange('{0}:hist'.format(name), 0, -1)
         logger.debug(history)
         self.assertEqual(
-            history[-2],
-            messages[0]
+            split_message(history[-2]),
+            (1, messages[0])
         )
         self.assertEqual(
-            history[-1],
-            messages[1]
+            split_message(history[-1]),
+            (2, messages[1])
         )
 
     def test_publish_message_with_request_object(self):
@@ -179,12 +185,12 @@ class HistoryStoreTest(TestCase):
         history = self._redis_connection.lrange('{0}:hist'.format(name), 0, -1)
         logger.debug(history)
         self.assertEqual(
-            history[-2],
-            messages[0]
+            split_message(history[-2]),
+            (1, messages[0])
         )
         self.assertEqual(
-            history[-1],
-            messages[1]
+            split_message(history[-1]),
+            (2, messages[1])
         )
 
     def test_superuser_reads_other_user(self):
@@ -327,3 +333,89 @@ class HistoryStoreTest(TestCase):
         redis_store.publish_message(messages[0])
         redis_store.publish_message(messages[1])
         self.assertIsNone(redis_store.get_history_key(pattern='*:doesntexist:hist'.format(self.namespace)))
+
+    def test_history_is_capped(self):
+        redis_store = RedisHistoryStore(
+            self._redis_connection, max_history=5, history_expire=60)
+        config = {
+            'username': self.user.username,
+            'namespace': self.namespace
+        }
+        redis_store.subscribe_channels(
+            request_or_config=config, channels=['publish-user'])
+        redis_store.publish_messages(['line {0}'.format(i) for i in range(8)])
+
+        name = '{0}:{1}:hist'.format(self.user.username, self.namespace)
+        history = self._redis_connection.lrange(name, 0, -1)
+        self.assertEqual(
+            [split_message(line) for line in history],
+            [(i + 1, 'line {0}'.format(i)) for i in range(3, 8)]
+        )
+        # The history expires, not only the last message.
+        self.assertTrue(0 < self._redis_connection.ttl(name) <= 60)
+
+    def test_send_missed_messages(self):
+        """
+        A reconnecting client only gets the lines after since.
+        """
+        publisher = RedisHistoryStore(self._redis_connection)
+        config = {
+            'username': self.user.username,
+            'namespace': self.namespace
+        }
+        publisher.subscribe_channels(
+            request_or_config=config, channels=['publish-user'])
+        publisher.publish_messages(['line {0}'.format(i) for i in range(5)])
+
+        sock = MagicMock(name='socket', spec=socket.socket)
+        request = self.factory.get(
+            path='/ws/{0}'.format(self.namespace), data={'since': '3'})
+        request.user = self.user
+        redis_store = RedisHistoryStore(self._redis_connection)
+        redis_store.subscribe_channels(
+            request_or_config=request, channels=['subscribe-user'])
+        redis_store.send_persisted_messages(sock)
+        self.assertEqual(
+            [split_message(c[0][0]) for c in sock.send.call_args_list],
+            [(4, 'line 3'), (5, 'line 4')]
+        )
+
+        # Published lines which were sent from the history are dropped.
+        channel = '{0}:{1}'.format(self.user.username, self.namespace)
+        self.assertIsNone(redis_store.filter_message(channel, '5\x1eline 4'))
+        self.assertEqual(
+            redis_store.filter_message(channel, '6\x1eline 5'),
+            '6\x1eline 5'
+        )
+        self.assertEqual(
+            redis_store.filter_message(channel, 'no sequence'),
+            'no sequence'
+        )
+
+    def test_get_history_key_uses_registry(self):
+        """
+        History keys are found in the registry of the namespace, KEYS is not
+        used.
+        """
+        redis_store = RedisHistoryStore(self._redis_connection)
+        config = {
+            'username': self.user.username,
+            'namespace': self.namespace
+        }
+        redis_store.subscribe_channels(
+            request_or_config=config, channels=['publish-user'])
+        redis_store.publish_message('test message 1')
+        history_key = '{0}:{1}:hist'.format(self.user.username, self.namespace)
+        self.assertEqual(
+            self._redis_connection.smembers(registry_key(self.namespace)),
+            set([history_key])
+        )
+
+        redis_store._connection = MagicMock(wraps=self._redis_connection)
+        self.assertEqual(
+            redis_store.get_history_key('*:{0}:hist'.format(self.namespace)),
+            history_key
+        )
+        self.assertIsNone(redis_store.get_history_key(
+            'other:{0}:hist'.format(self.namespace)))
+        self.assertFalse(redis_store._connection.keys.called)
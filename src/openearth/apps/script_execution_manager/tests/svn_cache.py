@@ -0,0 +1,66 @@
+from __future__ import unicode_literals
+from django.test import TestCase
+import mock
+import os
+import shutil
+import tempfile
+
+from ..svn_cache import SvnExportCache, SVN_CACHE_MOUNT
+
+
+def fake_export(url, path, username, password, revision=None):
+    os.makedirs(path)
+    with open(os.path.join(path, 'data.csv'), 'wb') as fp:
+        fp.write(b'x' * 8192)
+
+
+@mock.patch('openearth.libs.svn.export', side_effect=fake_export)
+@mock.patch('openearth.libs.svn.last_changed_revision',
+            side_effect=lambda url, u, p, revision=None: int(revision or 7))
+class SvnExportCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.cache = SvnExportCache(self.cache_dir, budget=None)
+
+    def test_export_once(self, last_changed_revision, export):
+        """
+        Jobs at the same revision share one export.
+        """
+        first = self.cache.get('https://svn/repo', 'u', 'p', '')
+        first.release()
+        second = self.cache.get('https://svn/repo', 'u', 'p', '7')
+        second.release()
+
+        self.assertEqual(export.call_count, 1)
+        self.assertEqual(first.key, second.key)
+        self.assertTrue(os.path.isfile(os.path.join(first.path, 'data.csv')))
+        self.assertEqual(
+            first.link_command('/home/worker/svn'),
+            ['/bin/ln', '-sfn', os.path.join(SVN_CACHE_MOUNT, first.key),
+             '/home/worker/svn']
+        )
+
+    def test_evict_least_recently_used(self, last_changed_revision, export):
+        """
+        Entries are removed oldest first, entries in use are kept.
+        """
+        entries = [
+            self.cache.get('https://svn/repo', 'u', 'p', str(revision))
+            for revision in (1, 2, 3)
+        ]
+        for i, entry in enumerate(entries):
+            os.utime(entry.path, (i, i))
+        entries[1].release()
+        entries[2].release()
+
+        self.cache.budget = sum(
+            size for used, size, key in self.cache.entries()
+        ) - 1
+        removed = self.cache.evict()
+
+        self.assertEqual(removed, [entries[1].key])
+        self.assertTrue(os.path.isdir(entries[0].path))
+        self.assertFalse(os.path.isdir(entries[1].path))
+        entries[0].release()
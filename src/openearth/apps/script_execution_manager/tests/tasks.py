@@ -8,6 +8,7 @@ import mock
 import multiprocessing
 import shutil
 import time
+import traceback
 from uuid import uuid1
 import re
 from pandas.tslib import Timestamp
@@ -15,8 +16,10 @@ from subprocess import Popen
 from ..container import LibVirtDomain
 from openearth.apps.processing.tests import factories as processing_factories
 from . import factories as script_exec_factories
-from ..task_utils import wait_for_ip, cleanup, find_files, add_file_to_job_result, \
-    create_results_dir
+from ..commit_worker import CommitError
+from ..readiness import wait_for_ip
+from ..task_utils import cleanup, find_files, add_file_to_job_result, \
+    create_results_dir, commit_file
 from openearth.apps.script_execution_manager.models import Observation
 from openearth.apps.script_execution_manager.tasks import run_script, commit, \
     setup_logger
@@ -326,6 +329,36 @@ class TestCommitTask(LibVirtTestMixin):
 
         #os.listdir(self.dest_data_dir)
 
+    def test_commit_file_reports_timing_and_failure(self):
+        """
+        commit_file logs the duration of a commit, or the error, and returns
+        both instead of raising.
+        """
+        job_logger = mock.MagicMock()
+        committer = mock.MagicMock()
+        filename, duration, error = commit_file(
+            committer, 'a.kml', 'KML file', job_logger
+        )
+        self.assertEqual('a.kml', filename)
+        self.assertIsNone(error)
+        self.assertTrue(job_logger.info.called)
+
+        committer.commit.side_effect = CommitError('ncatted failed')
+        filename, duration, error = commit_file(
+            committer, 'a.nc', 'nc file', job_logger
+        )
+        self.assertIsInstance(error[1], CommitError)
+        self.assertIn('ncatted failed', job_logger.warn.call_args[0][0])
+
+        # The traceback is kept, for the commit task to raise the error.
+        committer.commit.side_effect = ValueError('bad file')
+        filename, duration, error = commit_file(
+            committer, 'a.kml', 'KML file', job_logger
+        )
+        self.assertIs(error[0], ValueError)
+        self.assertTrue(traceback.extract_tb(error[2]))
+        self.assertIn('bad file', job_logger.error.call_args[0][0])
+
     # def test_logger_task(self):
     #     logger_task.apply_async()
     #     logger_task.apply_async()
@@ -46,8 +46,11 @@ def patched_call(self, environ, start_response):
                     elif response[0] == 'pmessage':
                         # This is the patch. Listen to pmessage types as well.
                         # this is required for pattern subscribe.
-                        message = response[3]
-                        websocket.send(message)
+                        # Lines already sent from the history are skipped.
+                        message = redis_store.filter_message(
+                            response[2], response[3])
+                        if message is not None:
+                            websocket.send(message)
                 else:
                     logger.error('Invalid file descriptor: {0}'.format(fd))
     except WebSocketError, excpt:
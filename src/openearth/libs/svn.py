@@ -1,6 +1,13 @@
+from django.conf import settings
+from django.core.cache import cache
+import hashlib
+import os
+import pipes
 import subprocess
+import tempfile
+import threading
+import time
 from urlparse import urlparse, urlunparse
-from collections import defaultdict
 
 try:
     from xml.etree import cElementTree as ET
@@ -16,26 +23,73 @@ class SvnRepoDoesNotExist(SvnException):
     pass
 
 
-def xml_to_dict(t):
-    # Source: http://stackoverflow.com/a/10077069
-    d = {t.tag: {} if t.attrib else None}
-    children = list(t)
-    if children:
-        dd = defaultdict(list)
-        for dc in map(xml_to_dict, children):
-            for k, v in dc.iteritems():
-                dd[k].append(v)
-        d = {t.tag: {k: v[0] if len(v) == 1 else v for k, v in dd.iteritems()}}
-    if t.attrib:
-        d[t.tag].update(('@' + k, v) for k, v in t.attrib.iteritems())
-    if t.text:
-        text = t.text.strip()
-        if children or t.attrib:
-            if text:
-                d[t.tag]['#text'] = text
-        else:
-            d[t.tag] = text
-    return d
+# Identical requests running at the same time in this process wait on the
+# same lock; between processes a lock key in the cache is used.
+_locks = [threading.Lock() for i in range(32)]
+
+# Seconds a process waits for the result of another process.
+COALESCE_TIMEOUT = 30
+
+
+def make_key(*parts):
+    digest = hashlib.sha1(
+        '|'.join(unicode(p) for p in parts).encode('utf-8')
+    ).hexdigest()
+    return 'svn:{0}:{1}'.format(parts[0], digest)
+
+
+def is_fixed_revision(revision):
+    """
+    True if revision (42 or 42:0) does not depend on HEAD.
+    """
+    if revision is None or revision == '':
+        return False
+    return all(p.isdigit() for p in unicode(revision).split(':'))
+
+
+def cached_call(key, timeout, fetch, cache_result=None):
+    """
+    Returns the cached result of fetch, calls it on a cache miss.
+
+    Description:
+        Concurrent calls with the same key run fetch once: threads of this
+        process wait on a lock, other processes wait (up to
+        COALESCE_TIMEOUT seconds) until the result appears in the cache.
+        Exceptions are not cached.
+
+    Arguments:
+        key: cache key.
+        timeout: cache timeout, None caches forever.
+        fetch: function without arguments.
+        cache_result: function which returns False for results which should
+            not be cached.
+    """
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    with _locks[hash(key) % len(_locks)]:
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+        lock_key = key + ':lock'
+        locked = cache.add(lock_key, 1, COALESCE_TIMEOUT)
+        if not locked:
+            deadline = time.time() + COALESCE_TIMEOUT
+            while time.time() < deadline:
+                time.sleep(0.1)
+                result = cache.get(key)
+                if result is not None:
+                    return result
+        try:
+            result = fetch()
+            if cache_result is None or cache_result(result):
+                cache.set(key, result, timeout)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return result
 
 
 def kwargs_to_args(**kwargs):
@@ -50,40 +104,156 @@ def kwargs_to_args(**kwargs):
     return ' '.join(args)
 
 
-def command(command, url, **kwargs):
+def popen(command, url, *paths, **kwargs):
+    stderr = kwargs.pop('stderr', subprocess.PIPE)
     args = kwargs_to_args(non_interactive=None, trust_server_cert=None,
                           **kwargs)
 
-    full_command = ' '.join(('svn', command, urlunparse(urlparse(url)), args))
-    p = subprocess.Popen(
+    full_command = ' '.join(
+        ('svn', command, urlunparse(urlparse(url))) +
+        tuple(pipes.quote(p) for p in paths) +
+        (args,)
+    )
+    return subprocess.Popen(
         full_command,
         stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+        stderr=stderr,
         shell=True)
 
-    return p.communicate()
 
+def command(command, url, *paths, **kwargs):
+    return popen(command, url, *paths, **kwargs).communicate()
 
-def list_(url, username, password):
+
+def fetch_list(url, username, password):
     output, err = command('list', url, username=username, password=password)
     return output.splitlines(), err
 
 
-def revisions(url, username, password, limit=10, revision=None):
+def list_(url, username, password):
+    """
+    Cached `svn list` of url. Returns (lines, error output).
+    """
+    def fetch():
+        return fetch_list(url, username, password)
+    return cached_call(
+        make_key('list', url, username),
+        settings.SVN_METADATA_HEAD_TIMEOUT,
+        fetch,
+        cache_result=lambda result: not result[1]
+    )
+
+
+def iter_log(url, username, password, limit=None, revision=None,
+             verbose=False):
+    """
+    Yields the log entries of url while `svn log --xml` writes them.
+
+    Description:
+        Entries are compact dicts with '@revision', 'author', 'date' and
+        'msg', and 'paths' (list of changed paths) when verbose. Parsed
+        elements are discarded, so memory use does not grow with the log.
+        svn is stopped when the caller stops iterating.
+
+    Raises:
+        SvnRepoDoesNotExist if svn does not return a log.
+    """
     kwargs = dict()
     if revision:
         kwargs['revision'] = revision
+    if limit:
+        kwargs['limit'] = limit
+    if verbose:
+        kwargs['verbose'] = None
 
-    xml, err = command('log', url, username=username, password=password,
-                       limit=limit, xml=None, **kwargs)
+    # stderr goes to a file; a full stderr pipe would block svn.
+    with tempfile.TemporaryFile() as err:
+        p = popen('log', url, username=username, password=password,
+                  xml=None, stderr=err, **kwargs)
+        try:
+            root = None
+            for event, elem in ET.iterparse(p.stdout, ('start', 'end')):
+                if root is None:
+                    root = elem
+                if event != 'end' or elem.tag != 'logentry':
+                    continue
+                entry = {
+                    '@revision': elem.get('revision'),
+                    'author': (elem.findtext('author') or '').strip(),
+                    'date': elem.findtext('date'),
+                    'msg': (elem.findtext('msg') or '').strip(),
+                }
+                if verbose:
+                    entry['paths'] = [
+                        path.text for path in elem.iterfind('paths/path')
+                    ]
+                root.clear()
+                yield entry
+        except ET.ParseError:
+            raise SvnRepoDoesNotExist(url, revision)
+        finally:
+            p.stdout.close()
+            if p.poll() is None:
+                p.kill()
+            p.wait()
 
-    try:
-        revisions = xml_to_dict(ET.XML(xml))['log']['logentry']
 
-        if isinstance(revisions, dict):
-            revisions = [revisions]
+def fetch_revisions(url, username, password, limit=10, revision=None,
+                    verbose=False):
+    return list(iter_log(url, username, password, limit, revision, verbose))
+
+
+def revisions(url, username, password, limit=10, revision=None):
+    """
+    Cached `svn log` of url.
+
+    Description:
+        Logs of fixed revisions (42, 42:0) are cached with
+        settings.SVN_METADATA_FIXED_TIMEOUT, logs relative to HEAD with the
+        short settings.SVN_METADATA_HEAD_TIMEOUT.
+    """
+    def fetch():
+        return fetch_revisions(url, username, password, limit, revision)
+    if is_fixed_revision(revision):
+        timeout = settings.SVN_METADATA_FIXED_TIMEOUT
+    else:
+        timeout = settings.SVN_METADATA_HEAD_TIMEOUT
+    return cached_call(
+        make_key('log', url, username, revision, limit),
+        timeout,
+        fetch
+    )
+
 
-        return revisions
+def last_changed_revision(url, username, password, revision=None):
+    """
+    Returns the revision in which url was last changed (at revision), as int.
+    """
+    kwargs = dict()
+    if revision:
+        kwargs['revision'] = revision
+
+    xml, err = command('info', url, username=username, password=password,
+                       xml=None, **kwargs)
+
+    try:
+        commit = ET.XML(xml).find('entry/commit')
     except ET.ParseError:
         raise SvnRepoDoesNotExist(url, revision)
+    if commit is None:
+        raise SvnRepoDoesNotExist(url, revision)
+    return int(commit.get('revision'))
+
+
+def export(url, path, username, password, revision=None):
+    """
+    Exports url (at revision) to path, which should not exist yet.
+    """
+    kwargs = dict()
+    if revision:
+        kwargs['revision'] = revision
 
+    output, err = command('export', url, path, username=username,
+                          password=password, quiet=None, **kwargs)
+    if not os.path.isdir(path):
+        raise SvnException(url, revision, err)
@@ -13,6 +13,7 @@ from sys import path
 import os
 from datetime import timedelta
 from django_auth_ldap.config import LDAPSearch, PosixGroupType
+from kombu import Exchange, Queue
 from os.path import abspath, basename, dirname, join, normpath
 import warnings
 
@@ -512,7 +513,22 @@ WS4REDIS_EXPIRE = 3600
 WEBSOCKETLOGGER = {
     # How many seconds after last update, will the history be purged?
     'expire_history': 3600,
+    # Lines kept in the history of a job; older lines are trimmed.
+    'max_history': 10000,
+    # Log lines are published in batches, at least every flush_interval
+    # seconds or when max_batch lines are waiting. At most max_buffer lines
+    # are kept while redis is unreachable.
+    'flush_interval': 0.1,
+    'max_batch': 500,
+    'max_buffer': 10000,
+}
 
+WEBSOCKET_GATEWAY = {
+    # Messages waiting for a websocket client before it is disconnected; it
+    # reconnects and gets the missed lines from the history.
+    'max_queue': 1000,
+    # Seconds a websocket token (made by the job page) can be used.
+    'token_max_age': 24 * 3600,
 }
 ########## END REDIS CONFIGURATION
 
@@ -531,8 +547,9 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERYD_POOL_RESTARTS = True
 CELERY_TRACK_STARTED = True
-# 4 cores= 4 worker threads (preforked)
-CELERYD_CONCURRENCY = 4
+# Processing jobs are admitted on the free resources of the host (see
+# SCHEDULER), the concurrency only bounds the number of worker processes.
+CELERYD_CONCURRENCY = 16
 # Maximum of tasks before restarting worker. This frees memory from potential
 # memory leaks.
 CELERYD_MAX_TASKS_PER_CHILD = 20
@@ -548,9 +565,67 @@ WSGI_APPLICATION = 'openearth.wsgi.application'
 CONTAINER = {
     "base_dir": os.environ.get('CONTAINER_BASE_DIR'),
     #"base_image": os.environ.get('CONTAINER_BASE_IMAGE'),
+    # Instance image provisioners, tried in this order. Available: reflink,
+    # qcow2, lvm-thin, overlay and copy (always tried last). See
+    # openearth.apps.script_execution_manager.provisioners.
+    "provisioners": ('reflink', 'copy'),
+    # Volume group with the base image logical volumes, for lvm-thin.
+    "lvm_volume_group": os.environ.get('CONTAINER_LVM_VOLUME_GROUP'),
+    # Host side cache of svn exports, mounted read-only in the containers.
+    # Disabled when not set. See
+    # openearth.apps.script_execution_manager.svn_cache.
+    "svn_cache_dir": os.environ.get('CONTAINER_SVN_CACHE_DIR'),
+    # Maximum size of the svn cache in bytes; least recently used exports
+    # are removed beyond it.
+    "svn_cache_budget": 20 * 1024 ** 3,
+    # Container limits per profile: vcpus, memory, current_memory and swap
+    # (MiB), cpu_shares and blkio_weight (relative, default 1024 and 500).
+    # Missing keys are taken from the default profile. See
+    # openearth.apps.script_execution_manager.resources.
+    "resource_profiles": {
+        'default': {
+            'vcpus': 1,
+            'memory': 4096,
+            'current_memory': 512,
+            'swap': 128,
+            'cpu_shares': 1024,
+            'blkio_weight': 500,
+        },
+    },
+    # Image filename: profile name. Other images use the default profile.
+    "image_profiles": {},
+    # Seconds after which a pool container which is still booting is
+    # destroyed; its worker died. See
+    # openearth.apps.script_execution_manager.pool.
+    "pool_boot_timeout": 600,
 }
 ########## END CONTAINER CONFIGURATION
 
+
+########## SCHEDULER CONFIGURATION
+# See openearth.apps.script_execution_manager.scheduler.
+SCHEDULER = {
+    # Seconds between the headroom reports of a worker host. Reports older
+    # than report_expire seconds are ignored.
+    "report_interval": 10,
+    "report_expire": 60,
+    # Free disk space (MiB) in CONTAINER['base_dir'] needed to start a job.
+    "min_disk": 10 * 1024,
+    # Seconds before a job which does not fit on its host is tried again.
+    "retry_countdown": 30,
+    # Wait times of admitted jobs kept per queue, for queue statistics.
+    "wait_history": 100,
+}
+
+# One queue per resource profile for run_script, the default queue for the
+# other tasks. Workers consume all of them unless started with -Q.
+CELERY_DEFAULT_QUEUE = 'celery'
+CELERY_QUEUES = [Queue('celery', Exchange('celery'), routing_key='celery')] + [
+    Queue('jobs-' + name, Exchange('jobs-' + name), routing_key='jobs-' + name)
+    for name in CONTAINER['resource_profiles']
+]
+########## END SCHEDULER CONFIGURATION
+
 # directory where the root of the dataset is located. Adapt by provisioning with sed script.
 DATASET_ROOT = '/demodata/'
 
@@ -637,6 +712,10 @@ ENVIRONMENT_SVN_SETTINGS = {
     'password': ENVIRONMENT_SVN_PASSWORD,
     'scripts': ENVIRONMENT_SVN_SCRIPTS,
 }
+# Cache timeouts of svn log and list results, see openearth.libs.svn. Results
+# which depend on HEAD expire soon, logs of fixed revisions never change.
+SVN_METADATA_HEAD_TIMEOUT = 60
+SVN_METADATA_FIXED_TIMEOUT = None
 ########## END ENVIRONMENT SVN
 
 ########## ENVIRONMENT THREDDS
@@ -649,6 +728,23 @@ KML_FILE_EXTS = ('.kml', '.kmz', '.png')
 KML_NGINX_LOCATION = '/secure_kml'
 ########## END ENVIRONMENT KML
 
+########## COMMIT
+# Number of NetCDF and KML result files which the commit task commits
+# concurrently. CSV files are committed one after another.
+COMMIT_CONCURRENCY = 4
+########## END COMMIT
+
+########## PROCESSING BATCH
+# Batches of jobs, see openearth.apps.processing.models.ProcessingBatch.
+# concurrency: default number of jobs of a batch which run at the same time,
+# max_concurrency and max_jobs: limits of a batch submitted by a user.
+PROCESSING_BATCH = {
+    'concurrency': 4,
+    'max_concurrency': 50,
+    'max_jobs': 1000,
+}
+########## END PROCESSING BATCH
+
 
 ########## PASSWORD POLICY
 # LDAP
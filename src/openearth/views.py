@@ -13,6 +13,7 @@ from django.core.context_processors import csrf
 from django.contrib.auth.models import User
 import redis
 from ws4redis import settings as redis_settings
+from openearth.apps.script_execution_manager.gateway import make_token
 from openearth.apps.script_execution_manager.store import RedisHistoryStore
 from openearth.forms import PasswordPolicyAuthenticationForm
 
@@ -37,7 +38,10 @@ class BaseTemplateView(TemplateView):
         if self.request.META['wsgi.url_scheme'] == 'https':
             self.request.META['SCHEMA'] = 'wss'
 
-        context.update(ws_url='{SCHEMA}://{SERVER_NAME}:{SERVER_PORT}{WEBSOCKET_URL}foobar'.format(**self.request.META))
+        context.update(
+            ws_url='{SCHEMA}://{SERVER_NAME}:{SERVER_PORT}{WEBSOCKET_URL}foobar'.format(**self.request.META),
+            ws_token=make_token(self.request.user, 'foobar'),
+        )
         return context
 
 
@@ -15,8 +15,8 @@ import redis.connection
 redis.connection.socket = gevent.socket
 os.environ.update(DJANGO_SETTINGS_MODULE='openearth.settings.prod')
 from ws4redis.uwsgi_runserver import uWSGIWebsocketServer
-from apps.script_execution_manager.wsgi_server import patched_call
-uWSGIWebsocketServer.__call__ = patched_call
+from apps.script_execution_manager.gateway import gateway_call
+uWSGIWebsocketServer.__call__ = gateway_call
 application = uWSGIWebsocketServer()
 
 